@@ -0,0 +1,482 @@
+"""
+Resolution of extracted artist names to canonical artista rows.
+
+The same artist appears as "@juan_castro_musica", "Juan Castro" or
+"JUAN CASTRO". Every spelling seen is stored in artista_alias under its
+folded key, and an in-memory NameIndex maps handles and display names to the
+canonical artist id during ingestion, with trigram similarity for
+misspellings.
+
+Existing duplicates are merged with:
+
+    python artist_resolver.py --recluster [--dry-run]
+"""
+
+import argparse
+import logging
+import threading
+from typing import NamedTuple
+
+from database_schema import connect_to_db
+from db_pool import close_all_pools
+from name_index import HANDLE_SUFFIXES, NameIndex, TrigramIndex, compact_name, name_keys
+from event_stats import refresh_event_stats
+from event_changes import record_event_changes
+from log_config import setup_logging, add_logging_arguments
+
+logger = logging.getLogger(__name__)
+
+# Generic words ignored when comparing artist names ("Los Suaves" == "Suaves")
+ARTIST_STOPWORDS = frozenset({"the", "los", "las", "el", "la", "os", "as", "band", "banda", "oficial", "official"})
+
+# Handle suffixes of artist accounts ("@juan_castro_musica"); venue names keep them
+ARTIST_HANDLE_SUFFIXES = HANDLE_SUFFIXES + ("musica", "music")
+
+# Minimum trigram similarity to accept a misspelled artist name during ingestion
+ARTIST_MIN_SIMILARITY = 0.8
+
+# Minimum trigram similarity to merge two existing artists when re-clustering
+RECLUSTER_MIN_SIMILARITY = 0.85
+
+
+class ArtistMatch(NamedTuple):
+    """
+    Result of resolving an artist mention.
+    """
+    artista_id: int
+    nombre: str
+    score: float
+    method: str
+
+
+class _Artist:
+    """
+    Artist known to the resolver.
+    """
+
+    def __init__(self, artista_id, nombre, confirmed=True):
+        self.artista_id = artista_id
+        self.nombre = nombre
+        # Rows created by the resolver may still be rolled back by their transaction
+        self.confirmed = confirmed
+        # Transaction (txid) that inserted the row
+        self.created_by = None
+
+
+def artist_key(name):
+    """
+    Folds an artist name to the key used by artista.clave and artista_alias.
+
+    Args:
+        name (str): Name or handle as written
+
+    Returns:
+        str: Compact name without artist handle suffixes
+    """
+    return compact_name(name, ARTIST_HANDLE_SUFFIXES)
+
+
+def _save_alias(cursor, alias, artista_id):
+    """
+    Stores a spelling of an artist unless its key is already taken.
+
+    Args:
+        cursor: Cursor of the connection to the database
+        alias (str): Name as written
+        artista_id (int): ID of the artist
+    """
+    key = artist_key(alias)
+    if key:
+        cursor.execute(
+            "INSERT INTO artista_alias (clave, alias, artista_id) VALUES (%s, %s, %s) ON CONFLICT (clave) DO NOTHING",
+            (key, alias, artista_id)
+        )
+
+
+class ArtistResolver:
+    """
+    In-memory index resolving artist mentions to artista ids.
+
+    Safe to share between worker threads.
+    """
+
+    def __init__(self, min_similarity=ARTIST_MIN_SIMILARITY):
+        """
+        Creates an empty resolver; call load() before resolving.
+
+        Args:
+            min_similarity (float): Minimum trigram similarity of fuzzy matches
+        """
+        self.min_similarity = min_similarity
+        self.lock = threading.Lock()
+        self.index = NameIndex(ARTIST_STOPWORDS, min_similarity, ARTIST_HANDLE_SUFFIXES)
+        self.known_keys = set()
+
+    def load(self, connection):
+        """
+        (Re)builds the index from the artista and artista_alias tables.
+
+        Args:
+            connection: Connection to the database
+        """
+        with self.lock:
+            self.index = NameIndex(ARTIST_STOPWORDS, self.min_similarity, ARTIST_HANDLE_SUFFIXES)
+            self.known_keys = set()
+            artists = {}
+
+            cursor = connection.cursor()
+            try:
+                cursor.execute("SELECT id, nombre FROM artista ORDER BY id")
+                for artista_id, nombre in cursor.fetchall():
+                    artists[artista_id] = _Artist(artista_id, nombre)
+                    self.index.add(nombre, artists[artista_id])
+
+                cursor.execute("SELECT clave, alias, artista_id FROM artista_alias")
+                for key, alias, artista_id in cursor.fetchall():
+                    self.known_keys.add(key)
+                    if artista_id in artists:
+                        self.index.add(alias, artists[artista_id])
+            finally:
+                cursor.close()
+
+            logger.info("Artist index loaded: %d artists", len(artists))
+
+    def _store(self, connection, artist):
+        """
+        Gets the artista row of an artist, inserting it if no artist has its key.
+
+        The INSERT ... ON CONFLICT on artista.clave waits for another
+        worker's open transaction that is inserting the same artist instead
+        of adding a duplicate. Runs without the resolver lock.
+
+        Args:
+            connection: Connection to the database
+            artist (_Artist): Artist to store
+
+        Returns:
+            tuple: (artista_id, txid, inserted) where txid is the current transaction
+        """
+        key = artist_key(artist.nombre)
+        cursor = connection.cursor()
+        try:
+            cursor.execute(
+                """
+                INSERT INTO artista (nombre, clave) VALUES (%s, %s)
+                ON CONFLICT (clave) DO NOTHING
+                RETURNING id, txid_current()
+                """,
+                (artist.nombre, key)
+            )
+            row = cursor.fetchone()
+            if row is not None:
+                logger.info("New artist stored: %s (ID %s)", artist.nombre, row[0])
+                return row[0], row[1], True
+
+            # Committed by another transaction, or stored earlier by this one
+            cursor.execute("SELECT id, txid_current() FROM artista WHERE clave = %s", (key,))
+            artista_id, txid = cursor.fetchone()
+            return artista_id, txid, False
+        finally:
+            cursor.close()
+
+    def resolve(self, connection, name, create=True):
+        """
+        Resolves an extracted artist to its artista row.
+
+        New spellings of a known artist are stored as aliases, so they are
+        exact matches from then on. Unknown artists get a new row if create
+        is set. The index is only locked while it is read or updated, never
+        during SQL.
+
+        Args:
+            connection: Connection to the database
+            name (str): Extracted artist name or handle
+            create (bool): Insert a new artist when nothing matches
+
+        Returns:
+            ArtistMatch: Resolved artist, or None if it could not be resolved
+        """
+        name = str(name or "").strip()
+        key = artist_key(name)
+        if not key:
+            return None
+
+        with self.lock:
+            artist, score, method = self.index.lookup(name)
+            if artist is not None:
+                artista_id, confirmed = artist.artista_id, artist.confirmed
+        if artist is None:
+            if not create:
+                return None
+            artist = _Artist(None, name, confirmed=False)
+            artista_id, confirmed = None, False
+            score, method = 0.0, "created"
+
+        # Rows created by the resolver are looked up again until they are
+        # seen from a later transaction, in case theirs was rolled back
+        if artista_id is None or not confirmed:
+            artista_id, txid, inserted = self._store(connection, artist)
+            with self.lock:
+                artist.artista_id = artista_id
+                if inserted:
+                    artist.confirmed = False
+                    artist.created_by = txid
+                elif artist.created_by != txid:
+                    artist.confirmed = True
+
+        # Remember this spelling for the next time
+        with self.lock:
+            known = key in self.known_keys
+        if not known:
+            cursor = connection.cursor()
+            try:
+                _save_alias(cursor, name, artista_id)
+            finally:
+                cursor.close()
+            with self.lock:
+                if key not in self.known_keys:
+                    self.known_keys.add(key)
+                    self.index.add(name, artist)
+
+        return ArtistMatch(artista_id, artist.nombre, score, method)
+
+
+# Resolver shared by the whole process, loaded on first use
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def get_artist_resolver(connection):
+    """
+    Gets the shared artist resolver, loading it on first use.
+
+    Args:
+        connection: Connection used to load the artist tables the first time
+
+    Returns:
+        ArtistResolver: Shared resolver
+    """
+    global _resolver
+    with _resolver_lock:
+        if _resolver is None:
+            resolver = ArtistResolver()
+            resolver.load(connection)
+            _resolver = resolver
+        return _resolver
+
+
+def find_artist_clusters(artists, min_similarity=RECLUSTER_MIN_SIMILARITY):
+    """
+    Groups the artists that are spellings of the same name.
+
+    Two artists are joined when they share a folded key or their names are
+    at least min_similarity similar; groups are closed transitively.
+
+    Args:
+        artists (list): (artista_id, nombre) pairs
+        min_similarity (float): Minimum trigram similarity to join two artists
+
+    Returns:
+        list: Clusters of two or more artist ids, each sorted
+    """
+    parent = {artista_id: artista_id for artista_id, _ in artists}
+
+    def find(artista_id):
+        while parent[artista_id] != artista_id:
+            parent[artista_id] = parent[parent[artista_id]]
+            artista_id = parent[artista_id]
+        return artista_id
+
+    def union(first, second):
+        first, second = find(first), find(second)
+        if first != second:
+            parent[max(first, second)] = min(first, second)
+
+    by_key = {}
+    fuzzy = TrigramIndex()
+    for artista_id, nombre in artists:
+        for key in name_keys(nombre, ARTIST_STOPWORDS, ARTIST_HANDLE_SUFFIXES):
+            if key in by_key:
+                union(artista_id, by_key[key])
+            else:
+                by_key[key] = artista_id
+
+        # Only compare with the artists indexed so far: each pair is scored once
+        compact = artist_key(nombre)
+        if compact:
+            for other, _ in fuzzy.candidates(compact, min_similarity):
+                union(artista_id, other)
+            fuzzy.add(compact, artista_id)
+
+    clusters = {}
+    for artista_id in parent:
+        clusters.setdefault(find(artista_id), []).append(artista_id)
+    return [sorted(members) for members in clusters.values() if len(members) > 1]
+
+
+def merge_artists(connection, canonical_id, duplicate_ids):
+    """
+    Merges duplicate artists into a canonical one.
+
+    Events that would end up repeated are removed first (their source posts
+    are linked to the event that is kept), the remaining events and the
+    aliases are repointed, the names of the duplicates become aliases, the
+    summary tables of the affected months are refreshed and the duplicates
+    are deleted. The
+    changed and removed events are appended to the change log. Runs in the
+    caller's transaction.
+
+    Args:
+        connection: Connection to the database
+        canonical_id (int): Artist that is kept
+        duplicate_ids (list): Artists merged into it
+    """
+    cursor = connection.cursor()
+    try:
+        # The names of the duplicates become aliases of the canonical artist
+        cursor.execute("SELECT nombre FROM artista WHERE id = ANY(%s)", (duplicate_ids,))
+        for (nombre,) in cursor.fetchall():
+            _save_alias(cursor, nombre, canonical_id)
+        cursor.execute(
+            "UPDATE artista_alias SET artista_id = %s WHERE artista_id = ANY(%s)",
+            (canonical_id, duplicate_ids)
+        )
+
+        # Events that will be repeated once repointed (same venue, date and
+        # time); the one with the lowest id is kept
+        repeated = """
+            SELECT id, fecha, MIN(id) OVER (PARTITION BY sala_id, fecha, hora) AS keep_id
+            FROM eventos WHERE artista_id = ANY(%s)
+        """
+        artist_ids = [canonical_id] + list(duplicate_ids)
+
+        # The posts of the repeated events become sources of the event that is kept
+        cursor.execute(
+            f"""
+            INSERT INTO evento_fuente (evento_id, evento_fecha, post_id, extraccion_version)
+            SELECT r.keep_id, r.fecha, f.post_id, f.extraccion_version
+            FROM ({repeated}) r
+            JOIN evento_fuente f ON f.evento_id = r.id AND f.evento_fecha = r.fecha
+            WHERE r.id <> r.keep_id
+            ON CONFLICT (evento_id, post_id) DO NOTHING
+            """,
+            (artist_ids,)
+        )
+
+        # Drop them before repointing, which the unique event key would reject;
+        # their old evento_fuente rows go with them (ON DELETE CASCADE)
+        cursor.execute(
+            f"""
+            DELETE FROM eventos e USING ({repeated}) r
+            WHERE e.id = r.id AND e.fecha = r.fecha AND r.id <> r.keep_id
+            RETURNING e.id, e.artista_id, e.sala_id, e.fecha, e.hora
+            """,
+            (artist_ids,)
+        )
+        deleted = cursor.fetchall()
+
+        # Repoint the remaining events
+        cursor.execute(
+            "UPDATE eventos SET artista_id = %s WHERE artista_id = ANY(%s) RETURNING id, artista_id, sala_id, fecha, hora",
+            (canonical_id, duplicate_ids)
+        )
+        updated = cursor.fetchall()
+        months = [row[3] for row in updated + deleted]
+
+        record_event_changes(connection, "delete", deleted)
+        record_event_changes(connection, "update", updated)
+
+        refresh_event_stats(connection, months)
+        cursor.execute("DELETE FROM artista WHERE id = ANY(%s)", (duplicate_ids,))
+    finally:
+        cursor.close()
+
+
+def recluster_artists(connection, min_similarity=RECLUSTER_MIN_SIMILARITY, dry_run=False):
+    """
+    Finds and merges the duplicate artists already in the database.
+
+    In each cluster the artist with most events is kept (the oldest one on a
+    tie). Does not commit.
+
+    Args:
+        connection: Connection to the database
+        min_similarity (float): Minimum trigram similarity to join two artists
+        dry_run (bool): Only report the clusters
+
+    Returns:
+        list: (canonical_id, duplicate_ids) of every cluster
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute("""
+        SELECT a.id, a.nombre, COUNT(e.id)
+        FROM artista a
+        LEFT JOIN eventos e ON e.artista_id = a.id
+        GROUP BY a.id, a.nombre
+        ORDER BY a.id
+        """)
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+
+    names = {artista_id: nombre for artista_id, nombre, _ in rows}
+    event_counts = {artista_id: count for artista_id, _, count in rows}
+
+    merges = []
+    for cluster in find_artist_clusters([(artista_id, nombre) for artista_id, nombre, _ in rows], min_similarity):
+        canonical_id = min(cluster, key=lambda artista_id: (-event_counts[artista_id], artista_id))
+        duplicate_ids = [artista_id for artista_id in cluster if artista_id != canonical_id]
+        logger.info(
+            "Merging %s into %s (%s)",
+            [names[artista_id] for artista_id in duplicate_ids], names[canonical_id], canonical_id
+        )
+        if not dry_run:
+            merge_artists(connection, canonical_id, duplicate_ids)
+        merges.append((canonical_id, duplicate_ids))
+
+    logger.info("%d duplicate artists in %d clusters", sum(len(d) for _, d in merges), len(merges))
+    return merges
+
+
+def parse_arguments():
+    """
+    Parses the command line arguments.
+
+    Returns:
+        argparse.Namespace: Object with the processed arguments
+    """
+    parser = argparse.ArgumentParser(description='Mantenimiento de la resolución de artistas')
+    parser.add_argument('--recluster', action='store_true',
+                    help='Merge the duplicate artists already in the database')
+    parser.add_argument('--min-similarity', type=float, default=RECLUSTER_MIN_SIMILARITY,
+                    help=f'Minimum name similarity to merge two artists (default: {RECLUSTER_MIN_SIMILARITY})')
+    parser.add_argument('--dry-run', action='store_true',
+                    help='Only report the clusters that would be merged')
+    add_logging_arguments(parser)
+    return parser.parse_args()
+
+
+def main():
+    """
+    Entry point of the maintenance commands.
+    """
+    args = parse_arguments()
+    setup_logging(level=args.log_level, log_format=args.log_format, quiet=args.quiet)
+
+    if not args.recluster:
+        logger.info("Nothing to do: use --recluster")
+        return
+
+    pool = connect_to_db()
+    if pool is None:
+        return
+    try:
+        with pool.connection() as connection:
+            recluster_artists(connection, args.min_similarity, args.dry_run)
+    finally:
+        close_all_pools()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,404 @@
+"""
+Offline throughput and latency benchmark of the ingestion pipeline.
+
+Starts the local Dify/Meta stand-ins from benchmark_stubs, points the Meta
+connector and the Dify client at them and drives get_posts_with_images,
+process_post and save_results_to_db at scale. Reports posts/s, p50/p95/p99
+latencies and database round-trips per post, saves the results as JSON and
+can compare them with a previous run.
+
+Usage:
+    python benchmark.py --venues 20 --posts-per-venue 25 --concurrency 8
+    python benchmark.py --compare benchmark_results/baseline.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import meta_api_connector
+import evaluation
+from evaluation import process_post, process_posts_batch, build_batches, save_results_to_db, connect_to_db
+from metrics import REGISTRY
+from log_config import setup_logging, add_logging_arguments
+from benchmark_stubs import StubState, start_stub_server, DEFAULT_DATASET
+from langfuse.decorators import langfuse_context
+
+# Directory where the results of each run are saved
+RESULTS_DIR = "benchmark_results"
+
+# Relative change considered a regression when comparing runs
+REGRESSION_TOLERANCE = 0.10
+
+
+def parse_arguments():
+    """
+    Configures and processes command line arguments of the benchmark.
+
+    Returns:
+        argparse.Namespace: Object with the processed arguments
+    """
+    parser = argparse.ArgumentParser(description='Offline benchmark of the post ingestion pipeline')
+    parser.add_argument('--dataset', type=str, default=DEFAULT_DATASET,
+                    help=f'CSV dataset used to synthesize posts (default: {DEFAULT_DATASET})')
+    parser.add_argument('--venues', type=int, default=20,
+                    help='Number of synthetic venues (default: 20)')
+    parser.add_argument('--posts-per-venue', type=int, default=25,
+                    help='Posts served per venue (default: 25)')
+    parser.add_argument('--concurrency', type=int, default=8,
+                    help='Posts processed at the same time (default: 8)')
+    parser.add_argument('--batch-size', type=int, default=1,
+                    help='Posts per workflow run with the batched workflow (default: 1, no batching)')
+    parser.add_argument('--dify-latency', type=str, default='lognormal:0.05,0.5',
+                    help='Dify latency distribution, e.g. fixed:0.1, uniform:0.05,0.2, lognormal:0.05,0.5')
+    parser.add_argument('--dify-error-rate', type=float, default=0.0,
+                    help='Fraction of Dify requests that fail (default: 0)')
+    parser.add_argument('--meta-latency', type=str, default='fixed:0.01',
+                    help='Graph API latency distribution (default: fixed:0.01)')
+    parser.add_argument('--meta-error-rate', type=float, default=0.0,
+                    help='Fraction of Graph API requests that fail (default: 0)')
+    parser.add_argument('--meta-quota', type=int, default=0,
+                    help='Graph API calls allowed per minute; the stub then sends usage headers and throttles (default: 0, unlimited)')
+    parser.add_argument('--db', choices=['stub', 'postgres'], default='stub',
+                    help='Save to an in-memory stub or to the configured PostgreSQL (default: stub)')
+    parser.add_argument('--output-dir', type=str, default=RESULTS_DIR,
+                    help=f'Directory where results are saved (default: {RESULTS_DIR})')
+    parser.add_argument('--compare', type=str, default=None,
+                    help='Previous results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE,
+                    help=f'Relative change reported as a regression (default: {REGRESSION_TOLERANCE})')
+    add_logging_arguments(parser)
+    parser.set_defaults(log_level='WARNING')
+    return parser.parse_args()
+
+
+class CountingCursor:
+    """
+    Cursor wrapper that counts the statements sent to the database.
+    """
+
+    def __init__(self, cursor, connection):
+        self._cursor = cursor
+        self._connection = connection
+
+    def execute(self, *args, **kwargs):
+        self._connection.round_trips += 1
+        return self._cursor.execute(*args, **kwargs)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class CountingConnection:
+    """
+    Connection wrapper that counts database round-trips.
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+        self.round_trips = 0
+
+    def cursor(self, *args, **kwargs):
+        return CountingCursor(self._connection.cursor(*args, **kwargs), self)
+
+    def commit(self):
+        self.round_trips += 1
+        self._connection.commit()
+
+    def rollback(self):
+        self.round_trips += 1
+        self._connection.rollback()
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+class StubCursor:
+    """
+    In-memory cursor answering the statements of the persistence functions.
+
+    Lookups find nothing, inserts return new IDs and aggregate queries return
+    no rows, which is enough to exercise every statement of a save.
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._result = []
+
+    def execute(self, query, params=None):
+        statement = query.lstrip().upper()
+        if "RETURNING" in statement:
+            self._result = [(self._connection.next_id(),)]
+        else:
+            self._result = []
+
+    def fetchone(self):
+        return self._result.pop(0) if self._result else None
+
+    def fetchall(self):
+        result, self._result = self._result, []
+        return result
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        pass
+
+
+class StubConnection:
+    """
+    In-memory stand-in for a PostgreSQL connection.
+    """
+
+    def __init__(self):
+        self._ids = 0
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        with self._lock:
+            self._ids += 1
+            return self._ids
+
+    def cursor(self, *args, **kwargs):
+        return StubCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def percentile(values, fraction):
+    """
+    Computes a percentile by linear interpolation.
+
+    Args:
+        values (list): Measured values
+        fraction (float): Percentile between 0 and 1
+
+    Returns:
+        float: Percentile value (0 when there are no values)
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(values):
+    """
+    Summarizes a list of latencies.
+
+    Args:
+        values (list): Latencies in seconds
+
+    Returns:
+        dict: Mean, p50, p95 and p99 in milliseconds
+    """
+    return {
+        "mean_ms": round(1000 * sum(values) / len(values), 2) if values else 0.0,
+        "p50_ms": round(1000 * percentile(values, 0.50), 2),
+        "p95_ms": round(1000 * percentile(values, 0.95), 2),
+        "p99_ms": round(1000 * percentile(values, 0.99), 2),
+    }
+
+
+def run_benchmark(args):
+    """
+    Runs the pipeline against the stand-ins and measures it.
+
+    Args:
+        args (argparse.Namespace): Benchmark configuration
+
+    Returns:
+        dict: Benchmark results
+    """
+    state = StubState(
+        dataset=args.dataset,
+        posts_per_venue=args.posts_per_venue,
+        dify_latency=args.dify_latency,
+        dify_error_rate=args.dify_error_rate,
+        meta_latency=args.meta_latency,
+        meta_error_rate=args.meta_error_rate,
+        meta_quota=args.meta_quota,
+    )
+    server = start_stub_server(state)
+
+    # Point the pipeline at the stand-ins and keep Langfuse out of the measurements
+    meta_api_connector.META_API_SIMULATED = False
+    meta_api_connector.META_API_BASE_URL = state.base_url
+    evaluation.DIFY_WORKFLOW_URL = f"{state.base_url}/v1/workflows/run"
+    evaluation.DIFY_UPLOAD_URL = f"{state.base_url}/v1/files/upload"
+    langfuse_context.configure(enabled=False)
+
+    pool = connect_to_db() if args.db == "postgres" else None
+    stub_connection = StubConnection()
+    venues = [
+        {"id": f"bench_venue_{i}", "name": f"Benchmark venue {i}", "city": "Benchmark"}
+        for i in range(args.venues)
+    ]
+
+    measurements = []
+    lock = threading.Lock()
+
+    def process_batch(batch):
+        started = time.perf_counter()
+        if len(batch) == 1:
+            outputs = [process_post(batch[0], post_id=batch[0]["id"])]
+        else:
+            outputs = process_posts_batch(batch, [post["id"] for post in batch])
+        processed = time.perf_counter()
+
+        for post, output in zip(batch, outputs):
+            save_one(post, output, started, processed)
+
+    def save_one(post, output, started, processed):
+        round_trips = 0
+        saved = False
+        if isinstance(output, dict):
+            raw = pool.getconn() if pool else stub_connection
+            connection = CountingConnection(raw)
+            try:
+                # None means the save failed and was already rolled back
+                if save_results_to_db(connection, output, post) is not None:
+                    connection.commit()
+                    saved = True
+            except Exception:
+                connection.rollback()
+            finally:
+                if pool:
+                    pool.putconn(raw)
+            round_trips = connection.round_trips
+        finished = time.perf_counter()
+
+        with lock:
+            measurements.append({
+                "process": processed - started,
+                "save": finished - processed,
+                "total": finished - started,
+                "round_trips": round_trips,
+                "saved": saved,
+                "error": not saved,
+            })
+
+    try:
+        with tempfile.TemporaryDirectory() as image_dir:
+            started = time.perf_counter()
+            posts = meta_api_connector.get_posts_with_images(
+                venues=venues, image_dir=image_dir, limit=args.posts_per_venue
+            )
+            fetched = time.perf_counter()
+
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                batches = [[posts[i] for i in batch] for batch in build_batches(posts, args.batch_size)]
+                list(executor.map(process_batch, batches))
+            finished = time.perf_counter()
+    finally:
+        server.shutdown()
+
+    processing_seconds = finished - fetched
+    saved = [m for m in measurements if m["saved"]]
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": vars(args),
+        "posts": len(posts),
+        "saved": len(saved),
+        "fetch_seconds": round(fetched - started, 3),
+        "processing_seconds": round(processing_seconds, 3),
+        # Only posts that were actually saved count as throughput
+        "posts_per_second": round(len(saved) / processing_seconds, 2) if processing_seconds else 0.0,
+        "end_to_end_posts_per_second": round(len(saved) / (finished - started), 2) if posts else 0.0,
+        "latency": {
+            "process_post": summarize([m["process"] for m in measurements]),
+            "save_results_to_db": summarize([m["save"] for m in saved]),
+            "total": summarize([m["total"] for m in measurements]),
+        },
+        "db_round_trips_per_post": round(sum(m["round_trips"] for m in saved) / len(saved), 2) if saved else 0.0,
+        "errors": sum(1 for m in measurements if m["error"]),
+        "stub_requests": dict(state.requests),
+        "stages": REGISTRY.snapshot().get("pipeline_stage_seconds", {}),
+    }
+
+
+def compare_results(current, baseline, tolerance):
+    """
+    Compares two benchmark results and reports regressions.
+
+    Args:
+        current (dict): Results of this run
+        baseline (dict): Results of a previous run
+        tolerance (float): Relative change reported as a regression
+
+    Returns:
+        list: Descriptions of the regressions found
+    """
+    # (label, getter, True if higher is better)
+    checks = [
+        ("posts/s", lambda r: r["posts_per_second"], True),
+        ("total p50", lambda r: r["latency"]["total"]["p50_ms"], False),
+        ("total p95", lambda r: r["latency"]["total"]["p95_ms"], False),
+        ("total p99", lambda r: r["latency"]["total"]["p99_ms"], False),
+        ("DB round-trips/post", lambda r: r["db_round_trips_per_post"], False),
+    ]
+
+    regressions = []
+    print(f"\nComparison with {baseline['timestamp']}:")
+    for label, get, higher_is_better in checks:
+        old, new = get(baseline), get(current)
+        change = (new - old) / old if old else 0.0
+        worse = -change if higher_is_better else change
+        flag = "REGRESSION" if worse > tolerance else ""
+        print(f"- {label}: {old} -> {new} ({change:+.1%}) {flag}")
+        if flag:
+            regressions.append(f"{label} {change:+.1%}")
+    return regressions
+
+
+def main():
+    """
+    Main function that runs the benchmark.
+    """
+    args = parse_arguments()
+    setup_logging(level=args.log_level, log_format=args.log_format, quiet=args.quiet)
+    results = run_benchmark(args)
+
+    print(f"\nBenchmark: {results['posts']} posts ({results['saved']} saved), concurrency {args.concurrency}")
+    print(f"- Fetch (Meta + images): {results['fetch_seconds']}s")
+    print(f"- Throughput: {results['posts_per_second']} posts/s "
+          f"({results['end_to_end_posts_per_second']} posts/s end to end)")
+    for stage, stats in results["latency"].items():
+        print(f"- {stage}: p50 {stats['p50_ms']}ms, p95 {stats['p95_ms']}ms, p99 {stats['p99_ms']}ms")
+    print(f"- DB round-trips per post: {results['db_round_trips_per_post']}")
+    for stage, stats in sorted(results["stages"].items()):
+        print(f"  - stage {stage}: {stats['count']} calls, mean {1000 * stats['mean_seconds']:.2f}ms")
+    print(f"- Errors: {results['errors']}")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    results_path = os.path.join(args.output_dir, f"benchmark-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(results_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {results_path}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare_results(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,428 @@
+"""
+Local stand-ins for the Dify and Meta Graph APIs used by the benchmark.
+
+A single HTTP server answers:
+- POST /v1/files/upload and POST /v1/workflows/run like Dify, returning the
+  expected output of the matching dataset row (or of every packed post for
+  the batched workflow)
+- POST /oauth/access_token, GET /{venue_id}/posts, GET /images/{id}.jpg and
+  batch requests (POST / with a "batch" field) like the Graph API, with
+  paginated posts synthesized from video/dataset.csv
+
+Latency and error rate of each endpoint family are configurable. With a
+Graph API quota, every Graph API response carries X-App-Usage and
+X-Business-Use-Case-Usage headers computed over a sliding window, and calls
+over the quota are rejected with error code 4 like the real API.
+"""
+
+import csv
+import json
+import math
+from collections import deque
+import random
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Dataset used to synthesize posts and workflow outputs
+DEFAULT_DATASET = "video/dataset.csv"
+
+# Window over which the stub Graph API quota is computed (seconds)
+META_QUOTA_WINDOW = 60.0
+
+# Bytes returned for every image
+STUB_IMAGE = b"\x89PNG\r\n\x1a\n" + b"\x00" * 2048
+
+
+class LatencyModel:
+    """
+    Random latency and error injection for one endpoint family.
+
+    The spec has the form "kind:a,b" where kind is one of:
+    - fixed:s           always s seconds
+    - uniform:lo,hi     uniformly between lo and hi seconds
+    - lognormal:med,sg  log-normal with median med seconds and sigma sg
+    """
+
+    def __init__(self, spec="fixed:0", error_rate=0.0, seed=None):
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",") if p]
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+        if kind not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample(self):
+        """
+        Draws one latency.
+
+        Returns:
+            float: Latency in seconds
+        """
+        with self.lock:
+            if self.kind == "fixed":
+                return self.params[0] if self.params else 0.0
+            if self.kind == "uniform":
+                return self.random.uniform(self.params[0], self.params[1])
+            median, sigma = self.params
+            return self.random.lognormvariate(0.0, sigma) * median
+
+    def should_fail(self):
+        """
+        Decides whether the current request fails.
+
+        Returns:
+            bool: True if the request must return an error
+        """
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+
+def load_dataset_rows(csv_path):
+    """
+    Loads the inputs and expected outputs of the dataset.
+
+    Args:
+        csv_path (str): Path to the CSV dataset
+
+    Returns:
+        list: List of (input dict, expected output) tuples
+    """
+    rows = []
+    with open(csv_path, 'r', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            rows.append((json.loads(row['input']), json.loads(row['expected_output'])))
+    return rows
+
+
+class StubState:
+    """
+    Configuration and counters shared by all requests to the stub server.
+    """
+
+    def __init__(self, dataset=DEFAULT_DATASET, posts_per_venue=25, dify_latency="fixed:0",
+                 dify_error_rate=0.0, meta_latency="fixed:0", meta_error_rate=0.0, seed=0, meta_quota=0):
+        self.rows = load_dataset_rows(dataset)
+        self.outputs_by_caption = {row[0]["caption"]: row[1] for row in self.rows}
+        self.posts_per_venue = posts_per_venue
+        self.dify = LatencyModel(dify_latency, dify_error_rate, seed)
+        self.meta = LatencyModel(meta_latency, meta_error_rate, seed + 1)
+        self.base_url = None
+        self.requests = {}
+        self.lock = threading.Lock()
+        self.meta_quota = meta_quota
+        self.meta_calls = deque()
+
+    def count(self, endpoint):
+        """
+        Counts one request to an endpoint.
+
+        Args:
+            endpoint (str): Endpoint name
+        """
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def meta_usage(self, cost=1):
+        """
+        Counts Graph API calls against the quota of the sliding window.
+
+        Args:
+            cost (int): Calls made (sub-requests of a batch count separately)
+
+        Returns:
+            tuple: (headers, throttled) where headers are the usage headers to
+                send (empty without a quota) and throttled tells whether the
+                quota is exhausted
+        """
+        if not self.meta_quota:
+            return {}, False
+        now = time.monotonic()
+        with self.lock:
+            while self.meta_calls and self.meta_calls[0] <= now - META_QUOTA_WINDOW:
+                self.meta_calls.popleft()
+            throttled = len(self.meta_calls) + cost > self.meta_quota
+            if not throttled:
+                self.meta_calls.extend([now] * cost)
+            percent = min(100, round(100 * len(self.meta_calls) / self.meta_quota))
+            oldest = self.meta_calls[0] if self.meta_calls else now
+        regain = math.ceil(max(0.0, oldest + META_QUOTA_WINDOW - now) / 60) if throttled else 0
+        usage = {"call_count": percent, "total_cputime": percent // 2, "total_time": percent // 2}
+        headers = {
+            "X-App-Usage": json.dumps(usage),
+            "X-Business-Use-Case-Usage": json.dumps({
+                "stub_business": [dict(usage, type="pages", estimated_time_to_regain_access=regain)]
+            }),
+        }
+        return headers, throttled
+
+    def graph_post(self, venue_id, index):
+        """
+        Synthesizes the index-th post of a venue in Graph API format.
+
+        Args:
+            venue_id (str): Venue ID
+            index (int): Position of the post, newest first
+
+        Returns:
+            dict: Post with id, message, created_time and attachments
+        """
+        post_input, _ = self.rows[(zlib.crc32(venue_id.encode()) + index) % len(self.rows)]
+        post_id = f"{venue_id}_{index}"
+        created = datetime(2025, 1, 1) - timedelta(hours=6 * index)
+        return {
+            "id": post_id,
+            "message": post_input["caption"],
+            "created_time": created.strftime("%Y-%m-%dT%H:%M:%S+0000"),
+            "attachments": {"data": [{"media": {"image": {"src": f"{self.base_url}/images/{post_id}.jpg"}}}]}
+        }
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    """
+    Routes the requests of the Dify and Graph API stand-ins.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # Keep the benchmark output clean
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def send_json(self, status, payload, headers=None):
+        """
+        Sends a JSON response.
+
+        Args:
+            status (int): HTTP status code
+            payload (dict): Response body
+            headers (dict): Extra response headers
+        """
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        """
+        Reads the request body.
+
+        Returns:
+            bytes: Request body
+        """
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else b""
+
+    def send_throttled(self, headers):
+        """
+        Rejects a Graph API call like Meta does when the app quota is exhausted.
+
+        Args:
+            headers (dict): Usage headers of the response
+        """
+        self.state.count("meta_throttled")
+        error = {"message": "(#4) Application request limit reached", "type": "OAuthException", "code": 4}
+        return self.send_json(403, {"error": error}, headers)
+
+    def simulate(self, model):
+        """
+        Waits for the sampled latency and decides whether to fail.
+
+        Args:
+            model (LatencyModel): Latency model of the endpoint family
+
+        Returns:
+            bool: True if the request must return an error
+        """
+        time.sleep(model.sample())
+        return model.should_fail()
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        body = self.read_body()
+
+        if path == "/v1/files/upload":
+            self.state.count("dify_upload")
+            if self.simulate(self.state.dify):
+                return self.send_json(503, {"code": "s3_connection_failed"})
+            return self.send_json(201, {
+                "id": str(uuid.uuid4()),
+                "name": "image.jpg",
+                "size": len(body),
+                "extension": "jpg",
+                "mime_type": "image/jpeg",
+                "created_by": "benchmark",
+                "created_at": int(time.time())
+            })
+
+        if path == "/v1/workflows/run":
+            self.state.count("dify_workflow")
+            if self.simulate(self.state.dify):
+                return self.send_json(500, {"code": "internal_server_error"})
+            inputs = json.loads(body or b"{}").get("inputs", {})
+            empty = {"artistas": [], "fecha": [], "ubicacion": []}
+
+            # Batched workflow: one result per packed post
+            if "posts" in inputs:
+                posts = json.loads(inputs["posts"])
+                results = [
+                    dict(self.state.outputs_by_caption.get(post.get("post", ""), empty), id=post.get("id"))
+                    for post in posts
+                ]
+                return self.send_json(200, {
+                    "workflow_run_id": str(uuid.uuid4()),
+                    "data": {
+                        "status": "succeeded",
+                        "outputs": {"results": json.dumps(results, ensure_ascii=False)},
+                        "elapsed_time": 0.0,
+                        "total_tokens": sum(len(post.get("post", "")) for post in posts) // 4
+                    }
+                })
+
+            output = self.state.outputs_by_caption.get(
+                inputs.get("post", ""), empty
+            )
+            return self.send_json(200, {
+                "workflow_run_id": str(uuid.uuid4()),
+                "data": {
+                    "status": "succeeded",
+                    "outputs": {"result": output},
+                    "elapsed_time": 0.0,
+                    "total_tokens": len(inputs.get("post", "")) // 4
+                }
+            })
+
+        if path == "/":
+            return self.graph_batch(body)
+
+        if path == "/oauth/access_token":
+            self.state.count("meta_auth")
+            usage, throttled = self.state.meta_usage()
+            if throttled:
+                return self.send_throttled(usage)
+            return self.send_json(200, {"access_token": "STUB_ACCESS_TOKEN", "token_type": "bearer"}, usage)
+
+        self.send_json(404, {"error": "not found"})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split("/") if p]
+
+        if len(parts) == 2 and parts[0] == "images":
+            self.state.count("meta_image")
+            if self.simulate(self.state.meta):
+                return self.send_json(500, {"error": {"message": "image unavailable"}})
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(STUB_IMAGE)))
+            self.end_headers()
+            self.wfile.write(STUB_IMAGE)
+            return
+
+        if len(parts) == 2 and parts[1] == "posts":
+            self.state.count("meta_posts")
+            usage, throttled = self.state.meta_usage()
+            if throttled:
+                return self.send_throttled(usage)
+            if self.simulate(self.state.meta):
+                return self.send_json(500, {"error": {"message": "An unknown error occurred", "code": 1}}, usage)
+            return self.send_json(200, self.graph_posts(parts[0], parse_qs(url.query)), usage)
+
+        self.send_json(404, {"error": "not found"})
+
+    def graph_posts(self, venue_id, query):
+        """
+        Builds a page of posts of a venue.
+
+        Args:
+            venue_id (str): Venue ID
+            query (dict): Parsed query string (limit, after)
+
+        Returns:
+            dict: Graph API response with data and paging
+        """
+        limit = int(query.get("limit", ["25"])[0])
+        start = int(query.get("after", ["0"])[0])
+        end = min(start + limit, self.state.posts_per_venue)
+        data = [self.state.graph_post(venue_id, i) for i in range(start, end)]
+        paging = {"cursors": {"before": str(start), "after": str(end)}}
+        if end < self.state.posts_per_venue:
+            paging["next"] = f"{self.state.base_url}/{venue_id}/posts?limit={limit}&after={end}"
+        return {"data": data, "paging": paging}
+
+    def graph_batch(self, body):
+        """
+        Answers a Graph API batch request, one sub-response per sub-request.
+
+        Args:
+            body (bytes): Form-encoded request body with the "batch" field
+        """
+        self.state.count("meta_batch")
+        requests = json.loads(parse_qs(body.decode("utf-8")).get("batch", ["[]"])[0])
+        usage, throttled = self.state.meta_usage(len(requests))
+        if throttled:
+            return self.send_throttled(usage)
+        if self.simulate(self.state.meta):
+            return self.send_json(500, {"error": {"message": "An unknown error occurred", "code": 1}}, usage)
+
+        results = []
+        for request in requests:
+            url = urlparse(request.get("relative_url", ""))
+            parts = [p for p in url.path.split("/") if p]
+            if request.get("method", "GET") != "GET" or len(parts) != 2 or parts[1] != "posts":
+                results.append({"code": 404, "headers": [], "body": json.dumps({"error": {"message": "not found"}})})
+                continue
+            self.state.count("meta_posts")
+            if self.state.meta.should_fail():
+                error = {"error": {"message": "An unknown error occurred", "code": 1}}
+                results.append({"code": 500, "headers": [], "body": json.dumps(error)})
+                continue
+            payload = self.graph_posts(parts[0], parse_qs(url.query))
+            results.append({"code": 200, "headers": [], "body": json.dumps(payload, ensure_ascii=False)})
+        return self.send_json(200, results, usage)
+
+
+def start_stub_server(state, host="127.0.0.1", port=0):
+    """
+    Starts the stub server on a background thread.
+
+    Args:
+        state (StubState): Configuration and counters of the server
+        host (str): Listening address
+        port (int): Listening port (0 picks a free one)
+
+    Returns:
+        ThreadingHTTPServer: Running server; call shutdown() to stop it
+    """
+    server = ThreadingHTTPServer((host, port), StubRequestHandler)
+    server.daemon_threads = True
+    server.state = state
+    state.base_url = f"http://{host}:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, name="benchmark-stub", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    # Run the stubs on their own, e.g. to point a manual run at them
+    stub_state = StubState()
+    stub_server = start_stub_server(stub_state, port=8089)
+    print(f"Stub server listening on {stub_state.base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        stub_server.shutdown()
@@ -0,0 +1,442 @@
+"""
+Local pre-filter deciding which posts are worth sending to the extraction workflow.
+
+Many venue posts are not event announcements (photo credits, thank-yous,
+closures). Each caption gets a probability of announcing an event from a
+small logistic model over keyword and date features. The default weights are
+hand-set heuristics; they can be refined by training on labeled rows and
+saved to a JSON file. Posts scoring under the threshold skip the LLM.
+
+Report precision/recall on the dataset at several thresholds:
+
+    python caption_filter.py --dataset video/dataset.csv [--train model.json]
+
+With --train the figures are out-of-fold scores from stratified k-fold
+cross-validation, so they are not measured on the rows the model was fit on.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import math
+import random
+import re
+import unicodedata
+import zlib
+
+from date_parser import date_mention_kinds, parse_event_dates
+from log_config import setup_logging, add_logging_arguments
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Default probability under which a post is not sent to the workflow
+DEFAULT_THRESHOLD = 0.3
+
+# Number of hashed word features used by trained models
+HASHED_FEATURES = 4096
+
+# Training parameters of the logistic model
+TRAIN_EPOCHS = 200
+TRAIN_LEARNING_RATE = 0.05
+TRAIN_L2 = 0.001
+
+# Folds of the cross-validation reported when training
+CV_FOLDS = 5
+
+# Words announcing an event (es, gl, pt, ca, en), without accents
+EVENT_KEYWORDS = (
+    "concierto", "concerto", "concert", "directo", "en vivo", "ao vivo", "live", "actuacion", "actuacio",
+    "entradas", "entrada", "billetes", "bilhetes", "tickets", "entrades", "taquilla", "anticipada",
+    "gira", "tour", "festival", "fest", "dj", "jam", "sesion", "session", "presenta", "cartel", "cartaz",
+    "agenda", "programacion", "programacao", "puertas", "portas", "portes", "doors", "escenario",
+    "aforo", "show", "espectaculo", "banda", "grupo", "musica", "musicos", "a las", "as ", "a les",
+)
+
+# Words of posts that are not announcements, without accents
+NON_EVENT_KEYWORDS = (
+    "gracias", "grazas", "obrigado", "obrigada", "gracies", "thank",
+    "cerrado", "cerramos", "pechado", "pechamos", "fechado", "nao abrimos", "no abrimos", "tancat", "tanquem",
+    "fotos", "foto", "fotografias", "reportaje", "reportagem", "credito", "creditos", "photo",
+    "sorteo", "sorteio", "sorteig", "vacaciones", "ferias", "vacances",
+    "pasado", "passado", "pasada", "ayer", "onte", "ontem", "ahir",
+)
+
+# Hand-set weights of the heuristic model
+HEURISTIC_WEIGHTS = {
+    "bias": -1.5,
+    "date_numeric": 1.6,
+    "date_text": 1.4,
+    "date_weekday": 0.8,
+    "date_relative": 0.6,
+    "time": 1.0,
+    "event_keywords": 1.1,
+    "non_event_keywords": -1.2,
+    "handles": 0.4,
+    "link": 0.3,
+    "short": -0.8,
+}
+
+# Captions used as negatives when training, since the dataset only holds announcements
+SEED_NEGATIVES = (
+    "Moitas grazas a todas as persoas que viñestes onte! Foi unha noite incrible 🙏",
+    "Gracias a todos por venir el sábado pasado, ¡fue increíble! Fotos de @fotografo",
+    "📸 Fotos do concerto do pasado venres por @creditofoto",
+    "Aviso: no último fim de semana do mês não abrimos. Obrigado pela compreensão",
+    "Cerrado por vacaciones hasta septiembre. ¡Nos vemos a la vuelta!",
+    "Tancat per vacances. Gràcies per un any increïble!",
+    "Reportaje fotográfico del concierto de ayer. ¡Gracias por llenar la sala!",
+    "Feliz Navidad y próspero año nuevo a toda nuestra gente ❤️",
+    "Buscamos camarero/a para fines de semana. Enviad CV por privado",
+    "Sorteo: gana dos camisetas de la sala. Menciona a dos amigos y síguenos",
+    "Hoy pechamos por obras. Grazas pola paciencia",
+    "Qué bonito fue. Gracias de corazón a la banda y al público",
+)
+
+PREFILTER_DECISIONS = REGISTRY.counter(
+    "prefilter_decisions_total", "Posts sent to or kept from the workflow by the caption pre-filter", ("decision",)
+)
+
+_WORD = re.compile(r"[0-9a-z]+")
+_HANDLE = re.compile(r"@\w+")
+_LINK = re.compile(r"https?://|www\.")
+
+
+def _fold(text):
+    """
+    Lowercases a text and removes its accents.
+
+    Args:
+        text (str): Text as written
+
+    Returns:
+        str: Folded text
+    """
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def _count_keywords(folded, keywords):
+    padded = f" {' '.join(_WORD.findall(folded))} "
+    return sum(1 for keyword in keywords if f" {keyword.strip()} " in padded)
+
+
+def caption_features(caption, hashed=False):
+    """
+    Extracts the features of a caption.
+
+    Args:
+        caption (str): Post caption
+        hashed (bool): Also add hashed word features (used by trained models)
+
+    Returns:
+        dict: Feature name to value
+    """
+    caption = caption or ""
+    folded = _fold(caption)
+    kinds = date_mention_kinds(caption)
+
+    features = {
+        "bias": 1.0,
+        "date_numeric": float("numeric" in kinds),
+        "date_text": float("text" in kinds),
+        "date_weekday": float("weekday" in kinds),
+        "date_relative": float("relative" in kinds),
+        "time": float("time" in kinds),
+        "event_keywords": math.log1p(_count_keywords(folded, EVENT_KEYWORDS)),
+        "non_event_keywords": math.log1p(_count_keywords(folded, NON_EVENT_KEYWORDS)),
+        "handles": math.log1p(len(_HANDLE.findall(caption))),
+        "link": float(bool(_LINK.search(folded))),
+        "short": float(len(caption) < 40),
+    }
+
+    if hashed:
+        for word in set(_WORD.findall(folded)):
+            features[f"w{zlib.crc32(word.encode()) % HASHED_FEATURES}"] = 1.0
+    return features
+
+
+def _sigmoid(value):
+    if value < -30:
+        return 0.0
+    return 1.0 / (1.0 + math.exp(-value))
+
+
+class CaptionFilter:
+    """
+    Logistic model scoring how likely a caption announces an event.
+    """
+
+    def __init__(self, weights=None, threshold=DEFAULT_THRESHOLD):
+        """
+        Creates the filter.
+
+        Args:
+            weights (dict): Feature weights (default: HEURISTIC_WEIGHTS)
+            threshold (float): Minimum probability to send a post to the workflow
+        """
+        self.weights = dict(weights or HEURISTIC_WEIGHTS)
+        self.threshold = threshold
+        # Hashed word features are only used once the model has been trained
+        self.hashed = any(name.startswith("w") for name in self.weights)
+
+    def score(self, caption):
+        """
+        Computes the probability that a caption announces an event.
+
+        Args:
+            caption (str): Post caption
+
+        Returns:
+            float: Probability between 0 and 1
+        """
+        features = caption_features(caption, self.hashed)
+        return _sigmoid(sum(self.weights.get(name, 0.0) * value for name, value in features.items()))
+
+    def should_extract(self, post):
+        """
+        Decides whether a post is worth sending to the workflow.
+
+        Args:
+            post (dict or str): Post with a caption, or the caption itself
+
+        Returns:
+            bool: True if the score reaches the threshold
+        """
+        caption = post.get("caption", "") if isinstance(post, dict) else str(post)
+        extract = self.score(caption) >= self.threshold
+        PREFILTER_DECISIONS.inc(decision="extract" if extract else "skip")
+        return extract
+
+    def train(self, captions, labels, epochs=TRAIN_EPOCHS, learning_rate=TRAIN_LEARNING_RATE, l2=TRAIN_L2, seed=0):
+        """
+        Fits the weights by stochastic gradient descent, starting from the current ones.
+
+        Classes are weighted so that a few negatives count as much as many positives.
+
+        Args:
+            captions (list): Captions
+            labels (list): 1 for event announcements, 0 otherwise
+            epochs (int): Passes over the data
+            learning_rate (float): Step size
+            l2 (float): L2 regularization
+            seed (int): Seed of the shuffling
+        """
+        self.hashed = True
+        samples = [(caption_features(caption, True), label) for caption, label in zip(captions, labels)]
+        positives = sum(labels) or 1
+        negatives = (len(labels) - sum(labels)) or 1
+        class_weight = {1: len(labels) / (2 * positives), 0: len(labels) / (2 * negatives)}
+
+        rng = random.Random(seed)
+        for _ in range(epochs):
+            rng.shuffle(samples)
+            for features, label in samples:
+                prediction = _sigmoid(sum(self.weights.get(name, 0.0) * value for name, value in features.items()))
+                gradient = (prediction - label) * class_weight[label]
+                for name, value in features.items():
+                    weight = self.weights.get(name, 0.0)
+                    self.weights[name] = weight - learning_rate * (gradient * value + l2 * weight)
+
+    def save(self, path):
+        """
+        Writes the weights and threshold to a JSON file.
+
+        Args:
+            path (str): Output file
+        """
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"threshold": self.threshold, "weights": self.weights}, f, indent=2)
+
+    @classmethod
+    def load(cls, path=None, threshold=None):
+        """
+        Creates a filter from a saved model, or with the heuristic weights.
+
+        Args:
+            path (str): JSON file written by save() (None for the heuristics)
+            threshold (float): Overrides the saved threshold
+
+        Returns:
+            CaptionFilter: Filter ready to use
+        """
+        if not path:
+            return cls(threshold=DEFAULT_THRESHOLD if threshold is None else threshold)
+        with open(path, 'r', encoding='utf-8') as f:
+            model = json.load(f)
+        return cls(model["weights"], model["threshold"] if threshold is None else threshold)
+
+
+def load_labeled_captions(csv_path):
+    """
+    Loads the captions of the dataset labeled as event announcements or not.
+
+    A row is an announcement if its expected output has at least one artist
+    and one valid date. An optional "is_event" column overrides that.
+
+    Args:
+        csv_path (str): Path to the CSV dataset
+
+    Returns:
+        tuple: (captions, labels)
+    """
+    captions, labels = [], []
+    with open(csv_path, 'r', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            post = json.loads(row['input'])
+            if row.get("is_event") not in (None, ""):
+                label = int(row["is_event"] in ("1", "true", "True"))
+            else:
+                expected = json.loads(row['expected_output'])
+                artists = expected.get("artistas") or expected.get("artista")
+                dates = parse_event_dates(expected.get("fecha", []), post.get("date"))
+                label = int(bool(artists) and bool(dates))
+            captions.append(post.get("caption", ""))
+            labels.append(label)
+    return captions, labels
+
+
+def cross_validate(captions, labels, weights=None, folds=CV_FOLDS, seed=0):
+    """
+    Scores every caption with a model trained on the other folds.
+
+    Folds are stratified, so the few negatives are spread over all of them.
+
+    Args:
+        captions (list): Captions
+        labels (list): 1 for event announcements, 0 otherwise
+        weights (dict): Starting weights of every fold (default: HEURISTIC_WEIGHTS)
+        folds (int): Number of folds
+        seed (int): Seed of the fold assignment and of the training
+
+    Returns:
+        list: Out-of-fold probability of each caption, in order
+    """
+    rng = random.Random(seed)
+    fold_of = [0] * len(captions)
+    for label in (0, 1):
+        members = [i for i, l in enumerate(labels) if l == label]
+        rng.shuffle(members)
+        for position, i in enumerate(members):
+            fold_of[i] = position % folds
+
+    scores = [0.0] * len(captions)
+    for fold in range(folds):
+        train = [i for i in range(len(captions)) if fold_of[i] != fold]
+        held_out = [i for i in range(len(captions)) if fold_of[i] == fold]
+        if not held_out:
+            continue
+        caption_filter = CaptionFilter(weights)
+        caption_filter.train([captions[i] for i in train], [labels[i] for i in train], seed=seed)
+        for i in held_out:
+            scores[i] = caption_filter.score(captions[i])
+    return scores
+
+
+def evaluate_filter(caption_filter, captions, labels, threshold=None, scores=None):
+    """
+    Measures the filter against labeled captions.
+
+    Args:
+        caption_filter (CaptionFilter): Filter to evaluate
+        captions (list): Captions
+        labels (list): 1 for event announcements, 0 otherwise
+        threshold (float): Threshold to evaluate (default: the filter's)
+        scores (list): Precomputed probabilities of the captions, e.g. from
+            cross_validate (default: scored by the filter)
+
+    Returns:
+        dict: precision, recall, f1 and the fraction of workflow calls skipped
+    """
+    threshold = caption_filter.threshold if threshold is None else threshold
+    if scores is None:
+        scores = [caption_filter.score(caption) for caption in captions]
+    predictions = [int(score >= threshold) for score in scores]
+
+    true_positives = sum(1 for p, l in zip(predictions, labels) if p and l)
+    predicted = sum(predictions)
+    actual = sum(labels)
+    precision = true_positives / predicted if predicted else 0.0
+    recall = true_positives / actual if actual else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {
+        "threshold": threshold,
+        "precision": round(precision, 4),
+        "recall": round(recall, 4),
+        "f1": round(f1, 4),
+        "skipped": round(1 - predicted / len(captions), 4) if captions else 0.0,
+    }
+
+
+def add_prefilter_arguments(parser):
+    """
+    Adds the pre-filter options to a command line parser.
+
+    Args:
+        parser (argparse.ArgumentParser): Parser of the script
+    """
+    parser.add_argument('--prefilter-threshold', type=float, default=None,
+                    help='Skip the workflow for posts whose event probability is under this value (default: off)')
+    parser.add_argument('--prefilter-model', type=str, default=None,
+                    help='Weights trained with caption_filter.py --train (default: keyword heuristics)')
+
+
+def parse_arguments():
+    """
+    Parses the command line arguments.
+
+    Returns:
+        argparse.Namespace: Object with the processed arguments
+    """
+    parser = argparse.ArgumentParser(description='Evaluación del prefiltro de publicaciones')
+    parser.add_argument('--dataset', type=str, default='video/dataset.csv',
+                    help='Labeled CSV dataset (default: video/dataset.csv)')
+    parser.add_argument('--model', type=str, default=None,
+                    help='Weights to evaluate (default: keyword heuristics)')
+    parser.add_argument('--train', type=str, default=None,
+                    help='Train on the dataset plus the seed negatives and save the weights to this file '
+                         '(the report is then cross-validated)')
+    parser.add_argument('--folds', type=int, default=CV_FOLDS,
+                    help=f'Cross-validation folds reported with --train (default: {CV_FOLDS})')
+    parser.add_argument('--thresholds', type=str, default='0.1,0.2,0.3,0.4,0.5,0.6,0.7',
+                    help='Comma-separated thresholds to report')
+    add_logging_arguments(parser)
+    return parser.parse_args()
+
+
+def main():
+    """
+    Reports precision/recall of the filter on the dataset, optionally training it first.
+    """
+    args = parse_arguments()
+    setup_logging(level=args.log_level, log_format=args.log_format, quiet=args.quiet)
+
+    captions, labels = load_labeled_captions(args.dataset)
+    caption_filter = CaptionFilter.load(args.model)
+
+    scores = None
+    if args.train:
+        # The seed negatives are evaluated too: the dataset has very few
+        captions = captions + list(SEED_NEGATIVES)
+        labels = labels + [0] * len(SEED_NEGATIVES)
+        scores = cross_validate(captions, labels, caption_filter.weights, args.folds)
+
+        caption_filter.train(captions, labels)
+        caption_filter.save(args.train)
+        logger.info("Model trained on all %d captions saved to %s", len(captions), args.train)
+
+    logger.info("%d captions, %d labeled as events", len(captions), sum(labels))
+    if scores is None:
+        print("Scores of the model on the dataset")
+    else:
+        print(f"Out-of-fold scores from {args.folds}-fold cross-validation (each caption scored by a model not trained on it)")
+    print(f"{'threshold':>9} {'precision':>9} {'recall':>7} {'f1':>7} {'skipped':>8}")
+    for threshold in (float(t) for t in args.thresholds.split(",")):
+        report = evaluate_filter(caption_filter, captions, labels, threshold, scores)
+        print(f"{threshold:>9.2f} {report['precision']:>9.3f} {report['recall']:>7.3f} "
+              f"{report['f1']:>7.3f} {report['skipped']:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,15 @@
 Pseudocode for creating the PostgreSQL database schema.
 """
 
-import psycopg2
+import logging
+from datetime import date
+
+from db_pool import get_pool, close_all_pools
+from event_queries import iter_events
+from event_changes import create_change_tables
+from log_config import setup_logging
+
+logger = logging.getLogger(__name__)
 
 # Database configuration
 DB_HOST = "localhost"
@@ -11,35 +19,70 @@ DB_NAME = "salas_acces"
 DB_USER = "userxxx"
 DB_PASSWORD = "xxxx"
 
+# Range partitioning of the events table by date: "month", "year" or None
+EVENTOS_PARTITION_BY = None
+
+# Natural key of an event; a missing time is stored as 24:00, which the
+# date parser never produces
+EVENT_KEY = "artista_id, sala_id, fecha, COALESCE(hora, '24:00'::time)"
+
+# Partitions known to be committed, so that ingestion only checks each one once
+_known_partitions = set()
 
-def connect_to_db():
+# Transaction (txid) that created each partition not yet known to be committed
+_created_partitions = {}
+
+# Partitioning of eventos detected in the database ("month", "year" or "")
+_eventos_partitioning = None
+
+
+def connect_to_db(minconn=None, maxconn=None):
     """
-    Establishes a connection to the PostgreSQL database.
+    Gets the shared connection pool for the PostgreSQL database.
+    
+    Connections are checked out per transaction with
+    ``with pool.connection() as connection:``.
     
+    Args:
+        minconn (int): Connections kept open in the pool
+        maxconn (int): Maximum number of simultaneous connections
+        
     Returns:
-        connection: Connection to the database
+        ConnectionPool: Pool of connections to the database
     """
     try:
-        connection = psycopg2.connect(
+        pool = get_pool(
+            minconn=minconn,
+            maxconn=maxconn,
             host=DB_HOST,
             port=DB_PORT,
             database=DB_NAME,
             user=DB_USER,
             password=DB_PASSWORD
         )
-        print("Database connection established")
-        return connection
+        logger.info("Database connection established")
+        return pool
     except Exception as e:
-        print(f"Error connecting to the database: {e}")
+        logger.error("Error connecting to the database: %s", e)
         return None
 
-def create_tables(connection):
+def create_tables(connection, partition_by=EVENTOS_PARTITION_BY):
     """
     Creates the necessary tables in the database.
     
+    With partition_by, eventos is created as a table partitioned by range of
+    fecha. Partitions are created on demand by ensure_event_partition. An
+    existing non-partitioned eventos table is left as it is.
+    
     Args:
         connection: Connection to the database
+        partition_by (str): "month", "year" or None for a plain table
     """
+    if partition_by not in (None, "month", "year"):
+        raise ValueError(f"Unsupported partitioning: {partition_by}")
+    
+    global _eventos_partitioning
+    
     try:
         cursor = connection.cursor()
         
@@ -47,7 +90,19 @@ def create_tables(connection):
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS artista (
             id SERIAL PRIMARY KEY,
-            nombre VARCHAR(255) NOT NULL
+            nombre VARCHAR(255) NOT NULL,
+            clave VARCHAR(255) UNIQUE
+        )
+        """)
+        # Folded name of the artists created by the resolver or the seed
+        cursor.execute("ALTER TABLE artista ADD COLUMN IF NOT EXISTS clave VARCHAR(255) UNIQUE")
+        
+        # Create artist aliases table (handles and spellings of the same artist)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS artista_alias (
+            clave VARCHAR(255) PRIMARY KEY,
+            alias VARCHAR(255) NOT NULL,
+            artista_id INTEGER NOT NULL REFERENCES artista(id) ON DELETE CASCADE
         )
         """)
         
@@ -58,140 +113,387 @@ def create_tables(connection):
             nombre VARCHAR(255) NOT NULL,
             ciudad VARCHAR(255),
             provincia VARCHAR(255),
-            aforo INTEGER
+            aforo INTEGER,
+            meta_page_id VARCHAR(64) UNIQUE,
+            clave VARCHAR(255) UNIQUE
         )
         """)
+        # Tables created before venues were linked to their Meta page
+        cursor.execute("ALTER TABLE sala ADD COLUMN IF NOT EXISTS meta_page_id VARCHAR(64) UNIQUE")
+        # Folded name of the venues created from a mention without a Meta page
+        cursor.execute("ALTER TABLE sala ADD COLUMN IF NOT EXISTS clave VARCHAR(255) UNIQUE")
         
         # Create events table
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS eventos (
-            id SERIAL PRIMARY KEY,
-            artista_id INTEGER REFERENCES artista(id),
-            sala_id INTEGER REFERENCES sala(id),
-            fecha DATE NOT NULL
-        )
-        """)
+        if partition_by:
+            # The partition key must be part of the primary key
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS eventos (
+                id SERIAL,
+                artista_id INTEGER REFERENCES artista(id),
+                sala_id INTEGER REFERENCES sala(id),
+                fecha DATE NOT NULL,
+                hora TIME,
+                PRIMARY KEY (id, fecha)
+            ) PARTITION BY RANGE (fecha)
+            """)
+            # Record the granularity so that ingestion knows which partitions to create
+            cursor.execute(f"COMMENT ON TABLE eventos IS 'partition_by={partition_by}'")
+        else:
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS eventos (
+                id SERIAL PRIMARY KEY,
+                artista_id INTEGER REFERENCES artista(id),
+                sala_id INTEGER REFERENCES sala(id),
+                fecha DATE NOT NULL,
+                hora TIME
+            )
+            """)
+        
+        # Tables created before the start time was stored separately
+        cursor.execute("ALTER TABLE eventos ADD COLUMN IF NOT EXISTS hora TIME")
+        
+        # Create indexes backing the filters in event_queries
+        create_indexes(cursor)
+        
+        # Create monthly summary tables used by event_stats
+        create_stats_tables(cursor)
+        
+        # Create the change log read by downstream consumers
+        create_change_tables(cursor)
+        
+        # Create the provenance tables linking events to their source posts
+        _eventos_partitioning = None
+        create_provenance_tables(cursor, partitioned=bool(get_event_partitioning(connection)))
         
         connection.commit()
-        print("Tables created successfully")
+        
+        # Detect the partitioning again on next use
+        _eventos_partitioning = None
+        logger.info("Tables created successfully")
     except Exception as e:
-        print(f"Error creating tables: {e}")
+        logger.error("Error creating tables: %s", e)
         connection.rollback()
 
-def insert_sample_data(connection):
+def create_indexes(cursor):
     """
-    Inserts sample data into the tables.
+    Creates the indexes used by the paginated event queries.
+    
+    Every index ends in (fecha, id) so that filtered pages can be read
+    directly in keyset order.
     
     Args:
-        connection: Connection to the database
+        cursor: Cursor of the connection to the database
     """
+    # Date range filter and default ordering
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_eventos_fecha_id ON eventos (fecha, id)")
+    
+    # Venue filter (also used for city/province through sala)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_eventos_sala_fecha_id ON eventos (sala_id, fecha, id)")
+    
+    # Artist filter
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_eventos_artista_fecha_id ON eventos (artista_id, fecha, id)")
+    
+    # One event per artist, venue, date and time, so concurrent writers can
+    # insert with ON CONFLICT DO NOTHING (fecha is the partition key)
+    cursor.execute("SAVEPOINT idx_eventos_clave")
     try:
+        cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_eventos_clave ON eventos ({EVENT_KEY})")
+        cursor.execute("RELEASE SAVEPOINT idx_eventos_clave")
+    except Exception as e:
+        # Existing duplicates (e.g. from before the key) must be merged first
+        cursor.execute("ROLLBACK TO SAVEPOINT idx_eventos_clave")
+        logger.warning("Unique event key not created, events may be duplicated: %s", e)
+    
+    # Lookups of venues by city/province and of names
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sala_ciudad ON sala (ciudad)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sala_provincia ON sala (provincia)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sala_nombre ON sala (nombre)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_artista_nombre ON artista (nombre)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_artista_alias_artista ON artista_alias (artista_id)")
+
+def create_stats_tables(cursor):
+    """
+    Creates the monthly summary tables refreshed by event_stats.
+    
+    Args:
+        cursor: Cursor of the connection to the database
+    """
+    # Events per venue and month
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS stats_sala_mes (
+        sala_id INTEGER REFERENCES sala(id),
+        mes DATE NOT NULL,
+        eventos INTEGER NOT NULL,
+        artistas INTEGER NOT NULL,
+        PRIMARY KEY (sala_id, mes)
+    )
+    """)
+    
+    # Touring frequency per artist and month
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS stats_artista_mes (
+        artista_id INTEGER REFERENCES artista(id),
+        mes DATE NOT NULL,
+        eventos INTEGER NOT NULL,
+        salas INTEGER NOT NULL,
+        ciudades INTEGER NOT NULL,
+        PRIMARY KEY (artista_id, mes)
+    )
+    """)
+    
+    # Event density per city and month
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS stats_ciudad_mes (
+        ciudad VARCHAR(255) NOT NULL,
+        provincia VARCHAR(255) NOT NULL,
+        mes DATE NOT NULL,
+        eventos INTEGER NOT NULL,
+        salas INTEGER NOT NULL,
+        artistas INTEGER NOT NULL,
+        PRIMARY KEY (ciudad, provincia, mes)
+    )
+    """)
+    
+    # Month-first indexes for date range reads across all keys
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_stats_sala_mes_mes ON stats_sala_mes (mes)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_stats_artista_mes_mes ON stats_artista_mes (mes)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_stats_ciudad_mes_mes ON stats_ciudad_mes (mes)")
+
+def create_provenance_tables(cursor, partitioned=False):
+    """
+    Creates the tables recording which post and extraction produced each event.
+    
+    evento_fuente references eventos by (id, fecha), which is the primary key
+    of a partitioned eventos; a plain eventos gets a unique index on those
+    columns so that the same reference works for both.
+    
+    Args:
+        cursor: Cursor of the connection to the database
+        partitioned (bool): Whether eventos is partitioned
+    """
+    # Source posts with their input and the version and result of their last extraction
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS post (
+        id VARCHAR(64) PRIMARY KEY,
+        meta_page_id VARCHAR(64),
+        entrada JSONB NOT NULL,
+        extraccion JSONB,
+        extraccion_version INTEGER NOT NULL,
+        puntuacion REAL,
+        extraido TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+    """)
+    
+    if not partitioned:
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_eventos_id_fecha ON eventos (id, fecha)")
+    
+    # Events produced by each post
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS evento_fuente (
+        evento_id INTEGER NOT NULL,
+        evento_fecha DATE NOT NULL,
+        post_id VARCHAR(64) NOT NULL REFERENCES post(id) ON DELETE CASCADE,
+        extraccion_version INTEGER NOT NULL,
+        PRIMARY KEY (evento_id, post_id),
+        FOREIGN KEY (evento_id, evento_fecha) REFERENCES eventos (id, fecha) ON DELETE CASCADE
+    )
+    """)
+    
+    # Selection of the posts to re-extract and lookup of the events of a post
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_post_extraccion_version ON post (extraccion_version)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_post_puntuacion ON post (puntuacion)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_evento_fuente_post ON evento_fuente (post_id)")
+
+def get_event_partitioning(connection):
+    """
+    Detects whether eventos is partitioned and with which granularity.
+    
+    The result is cached for the whole process.
+    
+    Args:
+        connection: Connection to the database
+        
+    Returns:
+        str: "month", "year" or "" when eventos is not partitioned
+    """
+    global _eventos_partitioning
+    
+    if _eventos_partitioning is None:
         cursor = connection.cursor()
+        try:
+            cursor.execute("""
+            SELECT obj_description(c.oid, 'pg_class')
+            FROM pg_partitioned_table p
+            JOIN pg_class c ON p.partrelid = c.oid
+            WHERE c.relname = 'eventos' AND c.relnamespace = 'public'::regnamespace
+            """)
+            result = cursor.fetchone()
+        finally:
+            cursor.close()
         
-        # Insert sample artists
-        artistas = [
-            "javierturnes",
-            "tulsamireniza",
-            "freedoniasoul",
-            "madmartintrio",
-            "nubiyantwist",
-            "insaniam",
-            "nodropforus",
-            "frequency"
-        ]
+        if result is None:
+            _eventos_partitioning = ""
+        else:
+            comment = result[0] or ""
+            _eventos_partitioning = "year" if comment == "partition_by=year" else "month"
+    
+    return _eventos_partitioning
+
+def get_partition_bounds(event_date, partition_by):
+    """
+    Computes the partition that holds a date.
+    
+    Args:
+        event_date (date): Event date
+        partition_by (str): "month" or "year"
         
-        for artista in artistas:
-            cursor.execute(
-                "INSERT INTO artista (nombre) VALUES (%s) ON CONFLICT DO NOTHING",
-                (artista,)
-            )
+    Returns:
+        tuple: Partition name, first date included and first date excluded
+    """
+    if partition_by == "year":
+        start = date(event_date.year, 1, 1)
+        end = date(event_date.year + 1, 1, 1)
+        return f"eventos_p{start.year}", start, end
+    
+    start = date(event_date.year, event_date.month, 1)
+    if start.month == 12:
+        end = date(start.year + 1, 1, 1)
+    else:
+        end = date(start.year, start.month + 1, 1)
+    return f"eventos_p{start.year}_{start.month:02d}", start, end
+
+def ensure_event_partition(connection, event_date):
+    """
+    Creates the partition of eventos for a date if it does not exist yet.
+    
+    Does nothing when eventos is not partitioned. The partition is created
+    in the caller's transaction, under an advisory lock so that concurrent
+    workers do not race on the same partition, and is only remembered as
+    existing once it has been committed.
+    
+    Args:
+        connection: Connection to the database
+        event_date (date or str): Event date, as a date or as text accepted by PostgreSQL
+    """
+    partition_by = get_event_partitioning(connection)
+    if not partition_by:
+        return
+    
+    cursor = connection.cursor()
+    try:
+        # Let PostgreSQL interpret text dates exactly as the INSERT will
+        if not isinstance(event_date, date):
+            cursor.execute("SELECT %s::date", (event_date,))
+            event_date = cursor.fetchone()[0]
         
-        # Insert sample venues
+        name, start, end = get_partition_bounds(event_date, partition_by)
+        if name in _known_partitions:
+            return
+        
+        # A partition created by this same transaction is visible but may
+        # still be rolled back, so it is only cached once a later
+        # transaction finds it
+        cursor.execute("SELECT txid_current(), to_regclass(%s) IS NOT NULL", (name,))
+        txid, exists = cursor.fetchone()
+        if exists and _created_partitions.get(name) != txid:
+            _known_partitions.add(name)
+            _created_partitions.pop(name, None)
+            return
+        
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('eventos_partitions'))")
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF eventos FOR VALUES FROM (%s) TO (%s)",
+            (start, end)
+        )
+        _created_partitions[name] = txid
+    finally:
+        cursor.close()
+
+def insert_sample_data(connection):
+    """
+    Inserts sample data into the tables.
+    
+    Rows are matched by natural key (artist name, Meta page id, event
+    artist/venue/date), so this can be run on a database that already has
+    data and running it again inserts nothing.
+    
+    Args:
+        connection: Connection to the database
+    """
+    # seed_data uses the partition helpers of this module
+    from seed_data import seed_database
+    
+    try:
+        # Sample venues
         salas = [
-            ("Riquela Club", "Santiago de Compostela", "A Coruña", 200),
-            ("Clandestino", "A Coruña", "A Coruña", 150),
-            ("Sala Malatesta", "Vigo", "Pontevedra", 300)
+            {"nombre": "Riquela Club", "ciudad": "Santiago de Compostela", "provincia": "A Coruña", "aforo": 200, "meta_page_id": "123456789"},
+            {"nombre": "Clandestino", "ciudad": "A Coruña", "provincia": "A Coruña", "aforo": 150, "meta_page_id": "987654321"},
+            {"nombre": "Sala Malatesta", "ciudad": "Vigo", "provincia": "Pontevedra", "aforo": 300, "meta_page_id": "456789123"}
         ]
         
-        for sala in salas:
-            cursor.execute(
-                "INSERT INTO sala (nombre, ciudad, provincia, aforo) VALUES (%s, %s, %s, %s) ON CONFLICT DO NOTHING",
-                sala
-            )
-        
-        # Insert sample events
+        # Sample events (their artists are created by the seed)
         eventos = [
-            (1, 1, "2024-04-12"),  # javierturnes en Riquela Club
-            (2, 1, "2024-04-19"),  # tulsamireniza en Riquela Club
-            (3, 1, "2024-04-20"),  # freedoniasoul en Riquela Club
-            (4, 1, "2024-04-26"),  # madmartintrio en Riquela Club
-            (5, 1, "2024-04-28"),  # nubiyantwist en Riquela Club
-            (6, 2, "2024-05-10"),  # insaniam en Clandestino
-            (7, 2, "2024-05-10"),  # nodropforus en Clandestino
-            (8, 2, "2024-05-10")   # frequency en Clandestino
+            {"artista": "javierturnes", "meta_page_id": "123456789", "fecha": "2024-04-12"},
+            {"artista": "tulsamireniza", "meta_page_id": "123456789", "fecha": "2024-04-19"},
+            {"artista": "freedoniasoul", "meta_page_id": "123456789", "fecha": "2024-04-20"},
+            {"artista": "madmartintrio", "meta_page_id": "123456789", "fecha": "2024-04-26"},
+            {"artista": "nubiyantwist", "meta_page_id": "123456789", "fecha": "2024-04-28"},
+            {"artista": "insaniam", "meta_page_id": "987654321", "fecha": "2024-05-10"},
+            {"artista": "nodropforus", "meta_page_id": "987654321", "fecha": "2024-05-10"},
+            {"artista": "frequency", "meta_page_id": "987654321", "fecha": "2024-05-10"}
         ]
         
-        for evento in eventos:
-            cursor.execute(
-                "INSERT INTO eventos (artista_id, sala_id, fecha) VALUES (%s, %s, %s) ON CONFLICT DO NOTHING",
-                evento
-            )
+        seed_database(connection, venues=salas, events=eventos)
         
         connection.commit()
-        print("Sample data inserted successfully")
+        logger.info("Sample data inserted successfully")
     except Exception as e:
-        print(f"Error inserting sample data: {e}")
+        logger.error("Error inserting sample data: %s", e)
         connection.rollback()
 
-def query_events(connection):
+def query_events(connection, **filters):
     """
     Queries events from the database.
     
+    Events are streamed through a server-side cursor instead of being
+    loaded with fetchall().
+    
     Args:
         connection: Connection to the database
+        **filters: Filters accepted by event_queries.build_event_filters
     """
     try:
-        cursor = connection.cursor()
-        
-        # Query events with artist and venue information
-        cursor.execute("""
-        SELECT e.id, a.nombre as artista, s.nombre as sala, s.ciudad, e.fecha
-        FROM eventos e
-        JOIN artista a ON e.artista_id = a.id
-        JOIN sala s ON e.sala_id = s.id
-        ORDER BY e.fecha
-        """)
-        
-        events = cursor.fetchall()
-        
         print("\nEvents in the database:")
         print("-----------------------------")
-        for event in events:
-            event_id, artista, sala, ciudad, fecha = event
-            print(f"ID: {event_id}, Artista: {artista}, Sala: {sala} ({ciudad}), Fecha: {fecha}")
+        for event in iter_events(connection, **filters):
+            print(f"ID: {event.id}, Artista: {event.artista}, Sala: {event.sala} ({event.ciudad}), Fecha: {event.fecha}{f' {event.hora:%H:%M}' if event.hora else ''}")
     except Exception as e:
-        print(f"Error querying events: {e}")
+        logger.error("Error querying events: %s", e)
+        connection.rollback()
 
 def main():
     """
     Main function that creates the database schema.
     """
+    setup_logging()
+    
     # Connect to the database
-    connection = connect_to_db()
+    pool = connect_to_db()
     
-    if connection:
-        # Create tables
-        create_tables(connection)
-        
-        # Insert sample data
-        insert_sample_data(connection)
-        
-        # Query events
-        query_events(connection)
+    if pool:
+        with pool.connection() as connection:
+            # Create tables
+            create_tables(connection)
+            
+            # Insert sample data
+            insert_sample_data(connection)
+            
+            # Query events
+            query_events(connection)
         
-        # Close connection
-        connection.close()
-        print("Database connection closed")
+        # Close connections
+        close_all_pools()
+        logger.info("Database connection closed")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,308 @@
+"""
+Streaming reader of CSV and JSONL evaluation datasets.
+
+Datasets are read one record at a time and the JSON of each record is only
+decoded when its fields are used, so large corpora do not need to fit in
+memory and records of other shards are never decoded. Records are assigned
+to shards by position (record k belongs to shard k % n), which splits a file
+across processes or machines without reading it first.
+
+Random access by item id goes through a sidecar index next to the dataset
+(<dataset>.idx) holding the byte offset of every record. The index is
+rebuilt whenever the dataset changes.
+
+CSV files have the columns id, input and expected_output (JSON text).
+JSONL files hold one object per line with "id", "input" and
+"expected_output"; files like requests.jsonl, without those keys, use the
+first "*_id" key as id and the rest of the object as input.
+"""
+
+import csv
+import io
+import json
+import os
+from typing import NamedTuple
+
+# Suffix of the sidecar offset index
+INDEX_SUFFIX = ".idx"
+
+# Extensions read as JSON Lines (anything else is read as CSV)
+JSONL_EXTENSIONS = (".jsonl", ".ndjson")
+
+
+class Shard(NamedTuple):
+    """
+    Part of a dataset processed by one worker: records k with k % count == index.
+    """
+    index: int
+    count: int
+
+
+def parse_shard(text):
+    """
+    Parses a shard given as "i/n", with i between 0 and n - 1.
+
+    Args:
+        text (str): Shard specification
+
+    Returns:
+        Shard: Parsed shard
+
+    Raises:
+        ValueError: If the text is not a valid shard
+    """
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard must be i/n, got {text!r}") from None
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Shard index must be between 0 and {count - 1}, got {text!r}")
+    return Shard(index, count)
+
+
+class LazyItem:
+    """
+    Dataset record whose JSON is decoded on first access.
+    """
+
+    __slots__ = ("_id", "_input", "_expected_output", "_metadata", "_record", "_decoded")
+
+    def __init__(self, item_id=None, input_text=None, expected_text=None, metadata_text=None, record_text=None):
+        """
+        Creates a record from its raw text.
+
+        Args:
+            item_id (str): Item ID (None for JSONL records, read from the record)
+            input_text (str): JSON text of the input (CSV)
+            expected_text (str): JSON text of the expected output (CSV)
+            metadata_text (str): JSON text of the metadata (CSV, optional)
+            record_text (str): Whole JSON line (JSONL)
+        """
+        self._id = item_id
+        self._input = input_text
+        self._expected_output = expected_text
+        self._metadata = metadata_text
+        self._record = record_text
+        self._decoded = False
+
+    def _decode(self):
+        """
+        Decodes the record, once: decoded values may be strings themselves.
+        """
+        if self._decoded:
+            return
+        self._decoded = True
+
+        if self._record is not None:
+            record = json.loads(self._record)
+            self._record = None
+            item_id = record.get("id")
+            if item_id is None:
+                key = next((key for key in record if key.endswith("_id")), None)
+                item_id = record.get(key) if key else None
+            else:
+                key = "id"
+            self._id = None if item_id is None else str(item_id)
+            self._expected_output = record.get("expected_output")
+            self._metadata = record.get("metadata")
+            if "input" in record:
+                self._input = record["input"]
+            else:
+                self._input = {k: v for k, v in record.items() if k not in (key, "expected_output", "metadata")}
+            return
+
+        for name in ("_input", "_expected_output", "_metadata"):
+            value = getattr(self, name)
+            if isinstance(value, str):
+                setattr(self, name, json.loads(value) if value else None)
+
+    @property
+    def id(self):
+        # CSV ids are plain text, only JSONL records need decoding
+        if self._record is not None:
+            self._decode()
+        return self._id
+
+    @property
+    def input(self):
+        self._decode()
+        return self._input
+
+    @property
+    def expected_output(self):
+        self._decode()
+        return self._expected_output
+
+    @property
+    def metadata(self):
+        self._decode()
+        return self._metadata
+
+
+class DatasetFile:
+    """
+    CSV or JSONL dataset read as a stream, with random access by id.
+    """
+
+    def __init__(self, path):
+        """
+        Opens a dataset file (nothing is read until it is iterated).
+
+        Args:
+            path (str): Path to the .csv or .jsonl file
+        """
+        self.path = path
+        self.format = "jsonl" if path.lower().endswith(JSONL_EXTENSIONS) else "csv"
+        self.index_path = path + INDEX_SUFFIX
+        self._offsets = None
+
+    def _iter_raw(self, start=0):
+        """
+        Iterates the raw records of the file with their byte offsets.
+
+        CSV records may span several lines when a quoted field holds newlines;
+        lines are joined until the quotes are balanced.
+
+        Args:
+            start (int): Byte offset to start from (0 reads the header first)
+
+        Yields:
+            tuple: (offset, text) per record
+        """
+        with open(self.path, 'rb') as f:
+            if start:
+                f.seek(start)
+            offset = f.tell()
+            pending, quotes = [], 0
+            for line in iter(f.readline, b""):
+                if self.format == "csv":
+                    pending.append(line)
+                    quotes += line.count(b'"')
+                    if quotes % 2:
+                        continue
+                    text = b"".join(pending).decode("utf-8-sig" if offset == 0 else "utf-8")
+                    pending, quotes = [], 0
+                else:
+                    text = line.decode("utf-8-sig" if offset == 0 else "utf-8")
+                if text.strip():
+                    yield offset, text
+                offset = f.tell()
+
+    def _header(self):
+        for _, text in self._iter_raw():
+            return next(csv.reader(io.StringIO(text)))
+        return []
+
+    def _item(self, text, header):
+        """
+        Builds the lazy item of a raw record.
+
+        Args:
+            text (str): Raw record
+            header (list): CSV column names (unused for JSONL)
+
+        Returns:
+            LazyItem: The record
+        """
+        if self.format == "jsonl":
+            return LazyItem(record_text=text)
+        row = dict(zip(header, next(csv.reader(io.StringIO(text)))))
+        return LazyItem(row.get("id"), row.get("input"), row.get("expected_output"), row.get("metadata"))
+
+    def iter_items(self, shard=None):
+        """
+        Streams the records of the dataset.
+
+        Args:
+            shard (Shard): Only yield the records of this shard (default: all)
+
+        Yields:
+            LazyItem: Records in file order
+        """
+        header = None
+        position = 0
+        for offset, text in self._iter_raw():
+            if self.format == "csv" and header is None:
+                header = next(csv.reader(io.StringIO(text)))
+                continue
+            if shard is None or position % shard.count == shard.index:
+                yield self._item(text, header)
+            position += 1
+
+    def __iter__(self):
+        return self.iter_items()
+
+    def _index_is_current(self):
+        if not os.path.exists(self.index_path):
+            return False
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            signature = f.readline().rstrip("\n")
+        stat = os.stat(self.path)
+        return signature == f"{stat.st_size}\t{stat.st_mtime_ns}"
+
+    def build_index(self):
+        """
+        Writes the sidecar index with the byte offset of every record.
+
+        Returns:
+            dict: Offset per item id
+        """
+        stat = os.stat(self.path)
+        header = None
+        offsets = {}
+        for offset, text in self._iter_raw():
+            if self.format == "csv" and header is None:
+                header = next(csv.reader(io.StringIO(text)))
+                continue
+            item_id = self._item(text, header).id
+            if item_id is not None:
+                offsets.setdefault(item_id, offset)
+
+        # Write next to the dataset and rename, so readers never see a partial index
+        temporary_path = self.index_path + ".tmp"
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            f.write(f"{stat.st_size}\t{stat.st_mtime_ns}\n")
+            for item_id, offset in offsets.items():
+                f.write(f"{item_id}\t{offset}\n")
+        os.replace(temporary_path, self.index_path)
+        return offsets
+
+    def offsets(self):
+        """
+        Gets the offset of every record, from the sidecar index (rebuilt if stale).
+
+        Returns:
+            dict: Offset per item id, in file order
+        """
+        if self._offsets is None:
+            if self._index_is_current():
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    f.readline()
+                    self._offsets = {
+                        item_id: int(offset)
+                        for item_id, offset in (line.rstrip("\n").rsplit("\t", 1) for line in f)
+                    }
+            else:
+                self._offsets = self.build_index()
+        return self._offsets
+
+    def __len__(self):
+        return len(self.offsets())
+
+    def get(self, item_id):
+        """
+        Reads one record by id through the sidecar index.
+
+        Args:
+            item_id (str): Item ID
+
+        Returns:
+            LazyItem: The record, or None if the id is not in the dataset
+        """
+        offset = self.offsets().get(str(item_id))
+        if offset is None:
+            return None
+        header = self._header() if self.format == "csv" else None
+        for _, text in self._iter_raw(offset):
+            return self._item(text, header)
+        return None
@@ -0,0 +1,367 @@
+"""
+Local SQLite mirror of the Langfuse evaluation datasets.
+
+Downloading a whole Langfuse dataset on every evaluation run makes startup
+depend on the network and on the dataset size. The store keeps a copy of
+each dataset in a SQLite file and refreshes it at most once every
+DATASET_SYNC_TTL seconds. A refresh pages through the dataset items and only
+writes the items whose updatedAt changed (the Langfuse API cannot filter by
+updatedAt, so the comparison is done locally); items removed from Langfuse
+are removed from the mirror.
+
+Evaluation scripts read CSV/JSONL files and mirrored datasets through the
+same loader, iter_dataset_items, with "langfuse:<name>" selecting a dataset:
+
+    python evaluation.py --dataset langfuse:posts_db
+    python dataset_store.py --dataset posts_db --refresh
+"""
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import NamedTuple, Optional
+
+from dataset_loader import DatasetFile
+from log_config import setup_logging, add_logging_arguments
+
+logger = logging.getLogger(__name__)
+
+# SQLite file holding the mirrored datasets
+DATASET_STORE_PATH = os.environ.get("DATASET_STORE_PATH", "datasets.sqlite")
+
+# Seconds a mirrored dataset is used without asking Langfuse for changes
+DATASET_SYNC_TTL = 15 * 60
+
+# Items requested per page when syncing
+DATASET_SYNC_PAGE_SIZE = 100
+
+# Prefix of dataset sources that refer to a Langfuse dataset
+LANGFUSE_SOURCE_PREFIX = "langfuse:"
+
+# Tables of the mirror
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dataset_item (
+    dataset TEXT NOT NULL,
+    id TEXT NOT NULL,
+    input TEXT,
+    expected_output TEXT,
+    metadata TEXT,
+    status TEXT NOT NULL DEFAULT 'ACTIVE',
+    updated_at TEXT,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (dataset, id)
+);
+CREATE INDEX IF NOT EXISTS idx_dataset_item_position ON dataset_item (dataset, position);
+CREATE TABLE IF NOT EXISTS dataset_sync (
+    dataset TEXT PRIMARY KEY,
+    synced_at REAL NOT NULL,
+    last_updated_at TEXT
+);
+"""
+
+
+class StoredItem(NamedTuple):
+    """
+    Dataset item as read from the mirror.
+    """
+    id: str
+    input: object
+    expected_output: object
+    metadata: Optional[dict]
+
+
+def _dumps(value):
+    return None if value is None else json.dumps(value, ensure_ascii=False)
+
+
+def _loads(text):
+    return None if text is None else json.loads(text)
+
+
+def _timestamp(value):
+    # The SDK returns datetimes; keep them as ISO strings so that they compare in order
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+class DatasetStore:
+    """
+    SQLite mirror of Langfuse datasets.
+    """
+
+    def __init__(self, path=DATASET_STORE_PATH):
+        """
+        Opens (and creates if needed) the mirror.
+
+        Args:
+            path (str): SQLite file
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(STORE_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def last_sync(self, dataset):
+        """
+        Gets when a dataset was last synced.
+
+        Args:
+            dataset (str): Langfuse dataset name
+
+        Returns:
+            float: Unix time of the last sync, or None if never synced
+        """
+        row = self.connection.execute(
+            "SELECT synced_at FROM dataset_sync WHERE dataset = ?", (dataset,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def is_fresh(self, dataset, ttl=DATASET_SYNC_TTL):
+        """
+        Tells whether a dataset was synced less than ttl seconds ago.
+
+        Args:
+            dataset (str): Langfuse dataset name
+            ttl (float): Maximum age in seconds
+
+        Returns:
+            bool: True if the mirror can be used without syncing
+        """
+        synced_at = self.last_sync(dataset)
+        return synced_at is not None and time.time() - synced_at < ttl
+
+    def sync(self, langfuse, dataset, ttl=DATASET_SYNC_TTL, force=False):
+        """
+        Brings a dataset up to date with Langfuse, unless it was synced recently.
+
+        Args:
+            langfuse (Langfuse): Langfuse client
+            dataset (str): Langfuse dataset name
+            ttl (float): Seconds a sync stays valid
+            force (bool): Sync even if the mirror is fresh
+
+        Returns:
+            dict: fetched, updated and deleted item counts (all 0 if skipped)
+        """
+        stats = {"fetched": 0, "updated": 0, "deleted": 0}
+        if not force and self.is_fresh(dataset, ttl):
+            logger.debug("Dataset %s synced less than %ss ago, using the mirror", dataset, ttl)
+            return stats
+
+        known = dict(self.connection.execute(
+            "SELECT id, updated_at FROM dataset_item WHERE dataset = ?", (dataset,)
+        ))
+        seen = set()
+        last_updated_at = None
+
+        # Page through the items, writing only those changed since the last sync
+        page = 1
+        with self.connection:
+            while True:
+                response = langfuse.client.dataset_items.list(
+                    dataset_name=dataset, page=page, limit=DATASET_SYNC_PAGE_SIZE
+                )
+                for item in response.data:
+                    stats["fetched"] += 1
+                    updated_at = _timestamp(item.updated_at)
+                    last_updated_at = max(filter(None, (last_updated_at, updated_at)), default=None)
+                    seen.add(item.id)
+                    if item.id in known and known[item.id] == updated_at:
+                        continue
+                    stats["updated"] += 1
+                    self.connection.execute(
+                        """
+                        INSERT INTO dataset_item (dataset, id, input, expected_output, metadata, status, updated_at, position)
+                        VALUES (?, ?, ?, ?, ?, ?, ?,
+                                (SELECT COALESCE(MAX(position), 0) + 1 FROM dataset_item WHERE dataset = ?))
+                        ON CONFLICT (dataset, id) DO UPDATE SET
+                            input = excluded.input,
+                            expected_output = excluded.expected_output,
+                            metadata = excluded.metadata,
+                            status = excluded.status,
+                            updated_at = excluded.updated_at
+                        """,
+                        (dataset, item.id, _dumps(item.input), _dumps(item.expected_output),
+                         _dumps(item.metadata), str(getattr(item.status, "value", item.status) or "ACTIVE"),
+                         updated_at, dataset)
+                    )
+                if page >= response.meta.total_pages:
+                    break
+                page += 1
+
+            # Items no longer in Langfuse are dropped from the mirror
+            for item_id in set(known) - seen:
+                self.connection.execute(
+                    "DELETE FROM dataset_item WHERE dataset = ? AND id = ?", (dataset, item_id)
+                )
+                stats["deleted"] += 1
+
+            self.connection.execute(
+                """
+                INSERT INTO dataset_sync (dataset, synced_at, last_updated_at) VALUES (?, ?, ?)
+                ON CONFLICT (dataset) DO UPDATE SET
+                    synced_at = excluded.synced_at,
+                    last_updated_at = COALESCE(excluded.last_updated_at, dataset_sync.last_updated_at)
+                """,
+                (dataset, time.time(), last_updated_at)
+            )
+
+        logger.info(
+            "Dataset %s synced: %d items fetched, %d updated, %d deleted",
+            dataset, stats["fetched"], stats["updated"], stats["deleted"]
+        )
+        return stats
+
+    def count(self, dataset):
+        """
+        Counts the active items of a mirrored dataset.
+
+        Args:
+            dataset (str): Langfuse dataset name
+
+        Returns:
+            int: Number of active items
+        """
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM dataset_item WHERE dataset = ? AND status = 'ACTIVE'", (dataset,)
+        ).fetchone()[0]
+
+    def iter_items(self, dataset, shard=None):
+        """
+        Iterates the active items of a mirrored dataset, decoding one row at a time.
+
+        Items are assigned to shards by their mirror position, which does not
+        change between syncs, and rows of other shards are never read.
+
+        Args:
+            dataset (str): Langfuse dataset name
+            shard (Shard): Only yield the items of this shard (default: all)
+
+        Yields:
+            StoredItem: Items in the order they were first mirrored
+        """
+        query = "SELECT id, input, expected_output, metadata FROM dataset_item WHERE dataset = ? AND status = 'ACTIVE'"
+        params = [dataset]
+        if shard is not None:
+            query += " AND position % ? = ?"
+            params += [shard.count, shard.index]
+        cursor = self.connection.execute(query + " ORDER BY position", params)
+        for item_id, input_data, expected_output, metadata in cursor:
+            yield StoredItem(item_id, _loads(input_data), _loads(expected_output), _loads(metadata))
+
+    def get_item(self, dataset, item_id):
+        """
+        Reads one item of a mirrored dataset.
+
+        Args:
+            dataset (str): Langfuse dataset name
+            item_id (str): Item ID
+
+        Returns:
+            StoredItem: The item, or None if it is not in the mirror
+        """
+        row = self.connection.execute(
+            "SELECT id, input, expected_output, metadata FROM dataset_item WHERE dataset = ? AND id = ?",
+            (dataset, item_id)
+        ).fetchone()
+        if not row:
+            return None
+        return StoredItem(row[0], _loads(row[1]), _loads(row[2]), _loads(row[3]))
+
+
+def langfuse_dataset_name(source):
+    """
+    Gets the Langfuse dataset a source refers to.
+
+    Args:
+        source (str): Dataset source, a CSV path or "langfuse:<name>"
+
+    Returns:
+        str: Dataset name, or None if the source is a file
+    """
+    if source.startswith(LANGFUSE_SOURCE_PREFIX):
+        return source[len(LANGFUSE_SOURCE_PREFIX):]
+    return None
+
+
+def iter_dataset_items(source, langfuse=None, store_path=DATASET_STORE_PATH, refresh=False, offline=False, shard=None):
+    """
+    Iterates the items of a dataset, from a CSV/JSONL file or from the Langfuse mirror.
+
+    Files are streamed (see dataset_loader). Mirrored datasets are synced
+    first if they are older than DATASET_SYNC_TTL (or always with refresh).
+    If Langfuse cannot be reached the mirror is used as it is.
+
+    Args:
+        source (str): CSV/JSONL path or "langfuse:<name>"
+        langfuse (Langfuse): Client used to sync (not needed for files or offline)
+        store_path (str): SQLite file of the mirror
+        refresh (bool): Sync even if the mirror is fresh
+        offline (bool): Never contact Langfuse
+        shard (Shard): Only yield the items of this shard (default: all)
+
+    Yields:
+        StoredItem or LazyItem: Items of the dataset, with id, input,
+            expected_output and metadata
+    """
+    dataset = langfuse_dataset_name(source)
+    if dataset is None:
+        yield from DatasetFile(source).iter_items(shard)
+        return
+
+    with DatasetStore(store_path) as store:
+        if not offline and langfuse is not None:
+            try:
+                store.sync(langfuse, dataset, force=refresh)
+            except Exception as e:
+                if store.last_sync(dataset) is None:
+                    raise
+                logger.warning("Could not sync dataset %s, using the local mirror: %s", dataset, e)
+        yield from store.iter_items(dataset, shard)
+
+
+def parse_arguments():
+    """
+    Configures and processes command line arguments of the store.
+
+    Returns:
+        argparse.Namespace: Object with the processed arguments
+    """
+    parser = argparse.ArgumentParser(description='Local mirror of Langfuse datasets')
+    parser.add_argument('--dataset', type=str, required=True,
+                    help='Langfuse dataset name')
+    parser.add_argument('--store', type=str, default=DATASET_STORE_PATH,
+                    help=f'SQLite file of the mirror (default: {DATASET_STORE_PATH})')
+    parser.add_argument('--refresh', action='store_true',
+                    help='Sync even if the mirror was synced recently')
+    add_logging_arguments(parser)
+    return parser.parse_args()
+
+
+def main():
+    """
+    Syncs a dataset and reports the size of the mirror.
+    """
+    args = parse_arguments()
+    setup_logging(level=args.log_level, log_format=args.log_format, quiet=args.quiet)
+
+    from evaluation import langfuse
+
+    with DatasetStore(args.store) as store:
+        stats = store.sync(langfuse, args.dataset, force=args.refresh)
+        print(f"{args.dataset}: {store.count(args.dataset)} active items "
+              f"({stats['fetched']} fetched, {stats['updated']} updated, {stats['deleted']} deleted)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+"""
+Normalization of extracted event dates in Spanish, Galician, Portuguese and Catalan.
+
+The model returns dates as "12-04-2024", "3-1-2024", "14-12-2024 20:30",
+"2025-03-08 21:00:00", "12.04.24", "3 de janeiro", "este viernes" or even a
+bare "23:30" (or "a las 21.00") meaning the same day as the previous date. Every format is
+handled by a few precompiled regular expressions and lookup tables built
+once at import time, and the results for a given text and reference date
+are memoized, so a batch costs one dictionary lookup per repeated value.
+
+Relative dates ("mañana", "este viernes", "o próximo sábado") are resolved
+against the date of the post, and dates without a year get the year that
+puts them closest after the post date.
+"""
+
+import re
+import unicodedata
+from datetime import date, time, timedelta, datetime
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+# Days before the post date still accepted when inferring a missing year
+# (posts often recap events of the previous days)
+YEAR_INFERENCE_GRACE_DAYS = 60
+
+# Two-digit years are read as 20YY
+TWO_DIGIT_YEAR_BASE = 2000
+
+# Month names and abbreviations (es, gl, pt, ca), without accents
+MONTHS = {
+    1: ("enero", "ene", "xaneiro", "xan", "janeiro", "jan", "gener", "gen"),
+    2: ("febrero", "feb", "febreiro", "fevereiro", "fev", "febrer"),
+    3: ("marzo", "mar", "marzal", "marco", "marc"),
+    4: ("abril", "abr"),
+    5: ("mayo", "may", "maio", "mai", "maig"),
+    6: ("junio", "jun", "xuno", "xun", "junho", "juny"),
+    7: ("julio", "jul", "xullo", "xul", "julho", "juliol"),
+    8: ("agosto", "ago", "agost"),
+    9: ("septiembre", "setiembre", "sep", "sept", "set", "setembro", "setembre"),
+    10: ("octubre", "oct", "outubro", "out"),
+    11: ("noviembre", "nov", "novembro", "novembre"),
+    12: ("diciembre", "dic", "decembro", "dec", "dezembro", "dez", "desembre", "des"),
+}
+
+# Weekday names (Monday is 0), without accents
+WEEKDAYS = {
+    0: ("lunes", "luns", "segunda", "segunda feira", "dilluns"),
+    1: ("martes", "terca", "terca feira", "dimarts"),
+    2: ("miercoles", "mercores", "quarta", "quarta feira", "dimecres"),
+    3: ("jueves", "xoves", "quinta", "quinta feira", "dijous"),
+    4: ("viernes", "venres", "sexta", "sexta feira", "divendres"),
+    5: ("sabado", "dissabte"),
+    6: ("domingo", "diumenge"),
+}
+
+# Relative days, as offsets from the post date
+RELATIVE_DAYS = {
+    "pasado manana": 2, "pasado mana": 2, "depois de amanha": 2, "dema passat": 2,
+    "hoy": 0, "hoxe": 0, "hoje": 0, "avui": 0, "esta noche": 0, "esta noite": 0, "aquesta nit": 0,
+    "manana": 1, "mana": 1, "amanha": 1, "dema": 1,
+}
+
+# Words around a weekday meaning its next occurrence, never the post day itself
+NEXT_WEEK_WORDS = ("proximo", "proxima", "vindeiro", "proper", "que ven", "que vem", "seguinte")
+
+
+class EventDate(NamedTuple):
+    """
+    Normalized event date; either part may be missing.
+    """
+    fecha: Optional[date]
+    hora: Optional[time]
+
+
+def _fold(text):
+    """
+    Lowercases a text and removes its accents.
+
+    Args:
+        text (str): Text as written
+
+    Returns:
+        str: Folded text
+    """
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def _alternation(words):
+    # Longest first so that "septiembre" wins over "sep"
+    return "|".join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+
+
+_MONTH_NUMBERS = {name: number for number, names in MONTHS.items() for name in names}
+_WEEKDAY_NUMBERS = {name: number for number, names in WEEKDAYS.items() for name in names}
+
+_ISO_DATE = re.compile(r"\b(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})\b")
+_NUMERIC_DATE = re.compile(r"\b(\d{1,2})[-/.](\d{1,2})(?:[-/.](\d{4}|\d{2}))?\b(?![:.]\d)")
+_TEXT_DATE = re.compile(
+    r"\b(\d{1,2})(?:\s*(?:de|do|da|d')\s*|\s+|\s*-\s*)(" + _alternation(_MONTH_NUMBERS) + r")\.?\b"
+    r"(?:\s*(?:de|del|do|,)?\s*(\d{4}))?"
+)
+_WEEKDAY = re.compile(
+    r"\b(?:(" + _alternation(NEXT_WEEK_WORDS) + r")\s+)?(" + _alternation(_WEEKDAY_NUMBERS) + r")\b"
+    r"(?:\s+(" + _alternation(NEXT_WEEK_WORDS) + r")\b)?"
+)
+_RELATIVE = re.compile(r"\b(" + _alternation(RELATIVE_DAYS) + r")\b")
+# "21.00" after "a las" or followed by "h" is a time; otherwise "12.04" is a date
+_DOTTED_TIME = re.compile(r"\b((?:a\s+las|a\s+la|a\s+les|as)\s+\d{1,2})\.(\d{2})(?!\.?\d)")
+_DOTTED_TIME_H = re.compile(r"\b([01]?\d|2[0-3])\.([0-5]\d)(\s*h)\b")
+_TIME = re.compile(r"\b(\d{1,2})(?:[:.h](\d{2})(?::(\d{2}))?\s*h?|\s*h)(?![\d:a-z-])")
+
+
+def _valid_date(year, month, day):
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+def _infer_year(month, day, reference):
+    """
+    Chooses the year of a date written without one.
+
+    Args:
+        month (int): Month
+        day (int): Day
+        reference (date): Post date
+
+    Returns:
+        date: First valid date on or after the reference minus the grace period
+    """
+    earliest = reference - timedelta(days=YEAR_INFERENCE_GRACE_DAYS)
+    for year in (reference.year - 1, reference.year, reference.year + 1):
+        candidate = _valid_date(year, month, day)
+        if candidate and candidate >= earliest:
+            return candidate
+    return None
+
+
+def _parse_time(text):
+    """
+    Finds a time of day in a text.
+
+    Args:
+        text (str): Folded text with the date already removed
+
+    Returns:
+        time: Time found, or None
+    """
+    match = _TIME.search(text)
+    if not match:
+        return None
+    hour, minute = int(match.group(1)), int(match.group(2) or 0)
+    if hour == 24 and minute == 0:
+        hour = 0
+    if hour > 23 or minute > 59:
+        return None
+    return time(hour, minute)
+
+
+@lru_cache(maxsize=4096)
+def _parse(text, reference):
+    """
+    Parses one extracted date (memoized).
+
+    Args:
+        text (str): Date as extracted
+        reference (date): Post date, or None
+
+    Returns:
+        tuple: (fecha, hora, has_date) where has_date tells whether the text
+            contained a date at all, even an invalid one
+    """
+    folded = _fold(text).strip()
+    if not folded:
+        return None, None, False
+    folded = _DOTTED_TIME_H.sub(r"\1:\2\3", _DOTTED_TIME.sub(r"\1:\2", folded))
+
+    fecha = None
+    match = _ISO_DATE.search(folded)
+    if match:
+        fecha = _valid_date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+    else:
+        match = _NUMERIC_DATE.search(folded)
+        if match:
+            day, month, year = int(match.group(1)), int(match.group(2)), match.group(3)
+            if year:
+                year = int(year) + (TWO_DIGIT_YEAR_BASE if len(year) == 2 else 0)
+                fecha = _valid_date(year, month, day)
+            elif month <= 12 and reference:
+                fecha = _infer_year(month, day, reference)
+            elif month > 12:
+                # "20.30" is a time, not a date
+                match = None
+
+        if not match:
+            match = _TEXT_DATE.search(folded)
+            if match:
+                day, month, year = int(match.group(1)), _MONTH_NUMBERS[match.group(2)], match.group(3)
+                if year:
+                    fecha = _valid_date(int(year), month, day)
+                elif reference:
+                    fecha = _infer_year(month, day, reference)
+
+        if not match and reference:
+            match = _RELATIVE.search(folded)
+            if match:
+                fecha = reference + timedelta(days=RELATIVE_DAYS[match.group(1)])
+            else:
+                match = _WEEKDAY.search(folded)
+                if match:
+                    ahead = (_WEEKDAY_NUMBERS[match.group(2)] - reference.weekday()) % 7
+                    if (match.group(1) or match.group(3)) and ahead == 0:
+                        ahead = 7
+                    fecha = reference + timedelta(days=ahead)
+
+    # Look for the time in the rest of the text so that date digits are not mistaken for it
+    rest = folded[:match.start()] + " " + folded[match.end():] if match else folded
+    return fecha, _parse_time(rest), match is not None
+
+
+def parse_event_date(text, reference=None):
+    """
+    Normalizes one extracted date.
+
+    Args:
+        text (str): Date as extracted ("14-12-2024 20:30", "3 de janeiro", "este viernes", "23:30")
+        reference (date): Post date, used for relative dates and missing years
+
+    Returns:
+        EventDate: Date and time found (each None if absent or invalid)
+    """
+    fecha, hora, _ = _parse(str(text), reference)
+    return EventDate(fecha, hora)
+
+
+def parse_reference_date(value):
+    """
+    Reads the publication date of a post.
+
+    Args:
+        value: Post date as a date, "YYYY-MM-DD" or "DD-MM-YYYY" (with an optional time)
+
+    Returns:
+        date: Post date, or None if it cannot be read
+    """
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if not value:
+        return None
+    return parse_event_date(str(value)).fecha
+
+
+def parse_event_dates(values, reference=None):
+    """
+    Normalizes the list of dates extracted from one post.
+
+    A value may hold several dates separated by commas, and a bare time
+    ("23:30", "a las 21.00", "22.30h") belongs to the previous date: it fills in the
+    time of that date if it had none, or adds another session of that day.
+
+    Args:
+        values (list): Dates as extracted (a single string is also accepted)
+        reference: Post date (see parse_reference_date)
+
+    Returns:
+        list: EventDate of every date found, in order, without duplicates
+
+    Examples (python -m doctest date_parser.py):
+        >>> parse_event_dates(["12-04-2024", "23:30"])
+        [EventDate(fecha=datetime.date(2024, 4, 12), hora=datetime.time(23, 30))]
+        >>> parse_event_dates(["12-04-2024 20:00", "23:30"])[1]
+        EventDate(fecha=datetime.date(2024, 4, 12), hora=datetime.time(23, 30))
+        >>> parse_event_dates(["12-04-2024 20.10"])
+        [EventDate(fecha=datetime.date(2024, 4, 12), hora=datetime.time(20, 10))]
+        >>> parse_event_dates(["12-04-2024 a las 21.00"])
+        [EventDate(fecha=datetime.date(2024, 4, 12), hora=datetime.time(21, 0))]
+        >>> parse_event_dates(["12-04-2024", "22.30h"])
+        [EventDate(fecha=datetime.date(2024, 4, 12), hora=datetime.time(22, 30))]
+        >>> parse_event_dates(["12.04"], "2024-04-01")
+        [EventDate(fecha=datetime.date(2024, 4, 12), hora=None)]
+        >>> parse_event_dates(["10.05"], "2024-04-01")
+        [EventDate(fecha=datetime.date(2024, 5, 10), hora=None)]
+        >>> parse_event_dates(["20.10.2024"])
+        [EventDate(fecha=datetime.date(2024, 10, 20), hora=None)]
+    """
+    if isinstance(values, str):
+        values = [values]
+    reference = parse_reference_date(reference)
+
+    results = []
+    last_date = None
+    for value in values or []:
+        for part in str(value).split(","):
+            fecha, hora, has_date = _parse(part, reference)
+            if not has_date and hora is not None:
+                fecha = last_date
+                # Complete the previous date rather than adding a second entry
+                if fecha is not None and EventDate(fecha, None) in results:
+                    position = results.index(EventDate(fecha, None))
+                    if EventDate(fecha, hora) in results:
+                        del results[position]
+                    else:
+                        results[position] = EventDate(fecha, hora)
+                    continue
+            if fecha is None:
+                continue
+            last_date = fecha
+            event_date = EventDate(fecha, hora)
+            if event_date not in results:
+                results.append(event_date)
+    return results
+
+
+def parse_event_dates_batch(items):
+    """
+    Normalizes the dates of many posts at once.
+
+    Args:
+        items (iterable): (values, reference) pairs, one per post
+
+    Returns:
+        list: List of EventDate per post, in the same order
+    """
+    return [parse_event_dates(values, reference) for values, reference in items]
+
+
+def date_mention_kinds(text):
+    """
+    Tells which kinds of date expressions a text contains, without resolving them.
+
+    Args:
+        text (str): Free text, e.g. a post caption
+
+    Returns:
+        set: Subset of {"numeric", "text", "weekday", "relative", "time"}
+    """
+    folded = _fold(text or "")
+    kinds = set()
+    if _ISO_DATE.search(folded) or _NUMERIC_DATE.search(folded):
+        kinds.add("numeric")
+    if _TEXT_DATE.search(folded):
+        kinds.add("text")
+    if _WEEKDAY.search(folded):
+        kinds.add("weekday")
+    if _RELATIVE.search(folded):
+        kinds.add("relative")
+    if _TIME.search(folded):
+        kinds.add("time")
+    return kinds
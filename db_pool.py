@@ -0,0 +1,205 @@
+"""
+Pooled PostgreSQL connections shared by the ingestion workers.
+
+Every DB function receives its connection from a ConnectionPool checkout, so
+parallel workers each work on their own connection without opening a new one
+per call. Each checkout is one transaction: it is committed when the block
+ends and rolled back if it raises.
+"""
+
+import threading
+import logging
+import time
+from contextlib import contextmanager
+
+from psycopg2.pool import ThreadedConnectionPool
+
+logger = logging.getLogger(__name__)
+
+# Default pool size
+DB_POOL_MIN = 1
+DB_POOL_MAX = 10
+
+# Seconds a connection may stay idle before it is checked on checkout
+DB_POOL_HEALTH_CHECK_AFTER = 30
+
+# Seconds to wait for a free connection before giving up
+DB_POOL_TIMEOUT = 30
+
+# Pools shared by the whole process, one per database
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PoolTimeoutError(Exception):
+    """
+    Raised when no connection becomes free within the pool timeout.
+    """
+
+
+class ConnectionPool:
+    """
+    Thread-safe PostgreSQL connection pool with health checks.
+
+    psycopg2's ThreadedConnectionPool raises as soon as all connections are
+    in use; this wrapper makes callers wait for a free connection instead.
+    """
+
+    def __init__(self, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX,
+                 health_check_after=DB_POOL_HEALTH_CHECK_AFTER, timeout=DB_POOL_TIMEOUT, **dsn):
+        """
+        Opens the pool.
+
+        Args:
+            minconn (int): Connections kept open in the pool
+            maxconn (int): Maximum number of simultaneous connections
+            health_check_after (float): Idle seconds after which a connection is
+                checked with a query before being handed out
+            timeout (float): Seconds to wait for a free connection
+            **dsn: Connection parameters for psycopg2.connect
+        """
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.health_check_after = health_check_after
+        self.timeout = timeout
+        self._pool = ThreadedConnectionPool(minconn, maxconn, **dsn)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._idle_since = {}
+        self._lock = threading.Lock()
+
+    def _is_healthy(self, connection):
+        """
+        Checks that a connection can still be used.
+
+        Args:
+            connection: Connection taken from the pool
+
+        Returns:
+            bool: True if the connection is usable
+        """
+        if connection.closed:
+            return False
+
+        with self._lock:
+            idle_since = self._idle_since.pop(id(connection), None)
+
+        # Only ping connections that have been idle for a while
+        if idle_since is not None and time.monotonic() - idle_since < self.health_check_after:
+            return True
+
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            connection.rollback()
+            return True
+        except Exception as e:
+            logger.warning("Discarding broken pooled connection: %s", e)
+            return False
+
+    def getconn(self):
+        """
+        Checks out a healthy connection, waiting if all of them are in use.
+
+        Returns:
+            connection: Connection to the database
+
+        Raises:
+            PoolTimeoutError: If no connection is freed within the timeout
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeoutError(f"No database connection available after {self.timeout}s")
+
+        try:
+            connection = self._pool.getconn()
+            while not self._is_healthy(connection):
+                self._pool.putconn(connection, close=True)
+                connection = self._pool.getconn()
+            return connection
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, connection, discard=False):
+        """
+        Returns a connection to the pool.
+
+        Args:
+            connection: Connection obtained with getconn
+            discard (bool): Close the connection instead of reusing it
+        """
+        try:
+            close = discard or connection.closed
+            if not close:
+                with self._lock:
+                    self._idle_since[id(connection)] = time.monotonic()
+            self._pool.putconn(connection, close=bool(close))
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """
+        Checks out a connection for the duration of one transaction.
+
+        The transaction is committed when the block ends normally and rolled
+        back if it raises. The connection always goes back to the pool.
+
+        Yields:
+            connection: Connection to the database
+        """
+        connection = self.getconn()
+        discard = False
+        try:
+            yield connection
+            connection.commit()
+        except Exception:
+            try:
+                connection.rollback()
+            except Exception:
+                discard = True
+            raise
+        finally:
+            self.putconn(connection, discard=discard)
+
+    def closeall(self):
+        """
+        Closes every connection of the pool.
+        """
+        self._pool.closeall()
+
+
+def get_pool(minconn=None, maxconn=None, **dsn):
+    """
+    Gets the shared pool for a database, creating it on first use.
+
+    Args:
+        minconn (int): Connections kept open (only used when creating the pool)
+        maxconn (int): Maximum connections (only used when creating the pool)
+        **dsn: Connection parameters for psycopg2.connect
+
+    Returns:
+        ConnectionPool: Pool shared by every caller using the same parameters
+    """
+    key = tuple(sorted(dsn.items()))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(
+                minconn=minconn if minconn is not None else DB_POOL_MIN,
+                maxconn=maxconn if maxconn is not None else DB_POOL_MAX,
+                **dsn
+            )
+            _pools[key] = pool
+            logger.info("Database connection pool created (%d-%d connections)", pool.minconn, pool.maxconn)
+        return pool
+
+
+def close_all_pools():
+    """
+    Closes every shared pool.
+    """
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.closeall()
+        _pools.clear()
@@ -4,15 +4,36 @@ Pseudocode for evaluating the extraction of information from social media posts.
 
 from datetime import datetime
 import json
-import csv
+import os
+import sys
+import logging
 from langfuse import Langfuse
 from langfuse.decorators import observe, langfuse_context
 import requests
 import argparse
-import psycopg2
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import islice
 
 # Import our Meta API connector
 from meta_api_connector import get_posts_with_images
+from database_schema import ensure_event_partition
+from db_pool import get_pool, close_all_pools, DB_POOL_MIN, DB_POOL_MAX
+from metrics import REGISTRY, timed, stage_timer, collect_stage_timings, current_stage_timings, start_metrics_server, dump_metrics, merge_snapshots
+from event_stats import refresh_event_stats_for_events
+from event_changes import record_event_changes
+from log_config import setup_logging, add_logging_arguments
+from venue_resolver import get_venue_resolver
+from artist_resolver import get_artist_resolver
+from date_parser import parse_event_dates
+from extraction_schema import parse_extraction, parse_batch_extraction, ExtractionError, EXTRACTION_REASKS, BATCH_SPLITS, EXTRACTION_FIELDS
+from profiling import RunProfiler, profile_dir_for_run, PROFILE_MODES, PROFILE_TOP_N, PROFILE_SAMPLE_INTERVAL
+from caption_filter import CaptionFilter, add_prefilter_arguments
+from dataset_store import iter_dataset_items
+from dataset_loader import Shard, parse_shard
+
+logger = logging.getLogger(__name__)
 
 # ==========================
 # MANUAL CONFIGURATION
@@ -29,8 +50,25 @@ LLM_MODEL_DEFAULT = "gemma3:27b"  # Default model
 
 # Dify API configuration for queries
 DIFY_WORKFLOW_URL = "http://localhost:8080/v1/workflows/run"
+DIFY_UPLOAD_URL = "http://localhost:8080/v1/files/upload"
 DIFY_AUTH_TOKEN = "app-xxxx"
 
+# Extra workflow runs when the output cannot be repaired locally
+EXTRACTION_MAX_REASKS = 1
+
+# Version of the extraction (workflow prompt and model) stored with every post;
+# increase it when either changes so that reprocess.py re-extracts older posts
+EXTRACTION_VERSION = 1
+
+# Workflow app that extracts several posts per run (--batch-size > 1)
+DIFY_BATCH_AUTH_TOKEN = "app-xxxx"
+
+# Maximum caption characters packed into one batched run
+BATCH_MAX_CHARS = 4000
+
+# Dataset items read and decoded at once while streaming the dataset
+DATASET_WINDOW = 1000
+
 # PostgreSQL database configuration
 DB_HOST = "localhost"
 DB_PORT = 5432
@@ -39,10 +77,13 @@ DB_USER = "userxxx"
 DB_PASSWORD = "xxxx"
 # ==========================
 
-def parse_arguments():
+def parse_arguments(argv=None):
     """
     Configures and processes command line arguments to parameterize the script.
     
+    Args:
+        argv (list): Arguments to parse (default: sys.argv)
+        
     Returns:
         argparse.Namespace: Object with the processed arguments
     """
@@ -56,20 +97,74 @@ def parse_arguments():
     parser.add_argument('--metrics', type=str, default='distancia JSON',
                     help='Metrics to evaluate, separated by commas')
     parser.add_argument('--dataset', type=str, default='dataset.csv',
-                    help='Path to the CSV dataset file (default: dataset.csv)')
+                    help='Path to the CSV/JSONL dataset file, or langfuse:<name> for a mirrored Langfuse dataset (default: dataset.csv)')
+    parser.add_argument('--refresh-dataset', action='store_true',
+                    help='Sync the mirrored Langfuse dataset even if it was synced recently')
+    parser.add_argument('--shard', type=parse_shard, default=None,
+                    help='Only evaluate shard i of n of the dataset, given as i/n with 0 <= i < n')
+    parser.add_argument('--workers', type=int, default=1,
+                    help='Evaluate the dataset in this many processes, one shard each, merged into one run (default: 1; ignored with --profile)')
     parser.add_argument('--save-to-db', action='store_true',
                     help='Save results to the database')
+    parser.add_argument('--db-pool-min', type=int, default=DB_POOL_MIN,
+                    help=f'Minimum pooled database connections (default: {DB_POOL_MIN})')
+    parser.add_argument('--db-pool-max', type=int, default=DB_POOL_MAX,
+                    help=f'Maximum pooled database connections (default: {DB_POOL_MAX})')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                    help='Serve stage latency metrics on http://127.0.0.1:PORT/metrics during the run')
+    parser.add_argument('--metrics-file', type=str, default=None,
+                    help='Write stage latency metrics to this file at the end of the run (.json or Prometheus text)')
+    parser.add_argument('--batch-size', type=int, default=1,
+                    help='Posts extracted per workflow run with the batched workflow (default: 1, no batching)')
+    parser.add_argument('--profile', nargs='?', const='sampling', default=None, choices=PROFILE_MODES,
+                    help='Profile the run: sampling (default), cprofile or alloc; output goes to profiles/<run-name>/')
+    parser.add_argument('--profile-top', type=int, default=PROFILE_TOP_N,
+                    help=f'Hotspots reported in the profile summary (default: {PROFILE_TOP_N})')
+    parser.add_argument('--profile-interval', type=float, default=PROFILE_SAMPLE_INTERVAL,
+                    help=f'Seconds between samples in sampling mode (default: {PROFILE_SAMPLE_INTERVAL})')
+    parser.add_argument('--profile-baseline', type=str, default=None,
+                    help='allocations.snapshot of a previous alloc run to compare memory against')
+    add_prefilter_arguments(parser)
+    add_logging_arguments(parser)
 
-    return parser.parse_args()
+    parsed = parser.parse_args(argv)
+    # --workers shards the whole dataset itself
+    if parsed.shard is not None and parsed.workers > 1:
+        parser.error("--shard cannot be combined with --workers; start one process per shard or drop --shard")
+    return parsed
 
-# Get command line arguments
-args = parse_arguments()
-EVALUATOR_MODEL = args.evaluator_model
-RUN_NAME = args.run_name
-RUN_DESCRIPTION = args.run_description
-METRICS = [metric.strip() for metric in args.metrics.split(',')]
-DATASET_PATH = args.dataset
-SAVE_TO_DB = args.save_to_db
+# Function to set the run configuration from the command line arguments
+def apply_arguments(parsed):
+    """
+    Sets the module configuration from the parsed arguments.
+    
+    Args:
+        parsed (argparse.Namespace): Arguments returned by parse_arguments
+    """
+    global args, EVALUATOR_MODEL, RUN_NAME, RUN_DESCRIPTION, METRICS, DATASET_PATH, REFRESH_DATASET, SHARD, WORKERS
+    global SAVE_TO_DB, DB_POOL_MIN_CONNECTIONS, DB_POOL_MAX_CONNECTIONS, METRICS_PORT, METRICS_FILE, PROFILE_MODE
+    global BATCH_SIZE, PREFILTER_THRESHOLD, PREFILTER_MODEL
+    args = parsed
+    EVALUATOR_MODEL = args.evaluator_model
+    RUN_NAME = args.run_name
+    RUN_DESCRIPTION = args.run_description
+    METRICS = [metric.strip() for metric in args.metrics.split(',')]
+    DATASET_PATH = args.dataset
+    REFRESH_DATASET = args.refresh_dataset
+    SHARD = args.shard
+    WORKERS = max(1, args.workers)
+    SAVE_TO_DB = args.save_to_db
+    DB_POOL_MIN_CONNECTIONS = args.db_pool_min
+    DB_POOL_MAX_CONNECTIONS = args.db_pool_max
+    METRICS_PORT = args.metrics_port
+    METRICS_FILE = args.metrics_file
+    PROFILE_MODE = args.profile
+    BATCH_SIZE = max(1, args.batch_size)
+    PREFILTER_THRESHOLD = args.prefilter_threshold
+    PREFILTER_MODEL = args.prefilter_model
+
+# Get command line arguments (defaults when imported by another script)
+apply_arguments(parse_arguments(None if __name__ == "__main__" else []))
 
 # Initialize Langfuse client for experiment tracking
 langfuse = Langfuse(
@@ -119,8 +214,37 @@ class DatasetItem:
 
 # Class to represent a dataset
 class Dataset:
-    def __init__(self, items):
+    def __init__(self, items, size=None):
         self.items = items
+        self.size = len(items) if size is None and isinstance(items, list) else size
+
+# Function to load a dataset from a file or from the Langfuse mirror
+def load_dataset(source, refresh=False, shard=None):
+    """
+    Opens a CSV/JSONL dataset or the local mirror of a Langfuse dataset as a stream.
+    
+    Items are read and decoded as they are iterated, so the dataset does
+    not need to fit in memory; iterate it once.
+    
+    Args:
+        source (str): Path to the CSV/JSONL file, or "langfuse:<name>"
+        refresh (bool): Sync the mirrored dataset even if it was synced recently
+        shard (Shard): Only read the items of this shard (default: all)
+        
+    Returns:
+        Dataset: Dataset object whose items are a generator of DatasetItem
+    """
+    items = (
+        DatasetItem(
+            id=item.id,
+            input_data=item.input,
+            expected_output=item.expected_output,
+            metadata=item.metadata
+        )
+        for item in iter_dataset_items(source, langfuse, refresh=refresh, shard=shard)
+    )
+    logger.info("Dataset opened: %s%s", source, f" (shard {shard.index}/{shard.count})" if shard else "")
+    return Dataset(items)
 
 # Function to load dataset from CSV
 def load_dataset_from_csv(csv_path):
@@ -133,23 +257,12 @@ def load_dataset_from_csv(csv_path):
     Returns:
         Dataset: Dataset object with loaded items
     """
-    items = []
-    
-    with open(csv_path, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            # Create dataset item
-            dataset_item = DatasetItem(
-                id=row['id'],
-                input_data=json.loads(row['input']),
-                expected_output=json.loads(row['expected_output'])
-            )
-            items.append(dataset_item)
-    
-    print(f"Dataset loaded: {len(items)} items")
+    items = list(load_dataset(csv_path).items)
+    logger.info("Dataset loaded: %d items", len(items))
     return Dataset(items)
 
 # Function to calculate the distance between two JSON objects
+@timed("scoring")
 def calculate_json_distance(json1, json2):
     """
     Calculates the distance between two JSON objects.
@@ -183,100 +296,96 @@ def calculate_json_distance(json1, json2):
 # Function to connect to the database
 def connect_to_db():
     """
-    Establishes a connection to the PostgreSQL database.
+    Gets the shared connection pool for the PostgreSQL database.
+    
+    Every DB function below runs on a connection checked out with
+    ``with pool.connection() as connection:``, which is one transaction.
     
     Returns:
-        connection: Connection to the database
+        ConnectionPool: Pool of connections to the database
     """
     try:
-        connection = psycopg2.connect(
+        pool = get_pool(
+            minconn=DB_POOL_MIN_CONNECTIONS,
+            maxconn=DB_POOL_MAX_CONNECTIONS,
             host=DB_HOST,
             port=DB_PORT,
             database=DB_NAME,
             user=DB_USER,
             password=DB_PASSWORD
         )
-        print("Database connection established")
-        return connection
+        logger.info("Database connection established")
+        return pool
     except Exception as e:
-        print(f"Error connecting to the database: {e}")
+        logger.error("Error connecting to the database: %s", e)
         return None
 
 # Function to save artists to the database
+@timed("db_save_artist")
 def save_artist_to_db(connection, artist_name):
     """
-    Saves an artist to the database.
+    Resolves an artist to its row in the database, creating it if it is new.
+    
+    Handles and display names of the same artist ("@juan_castro_musica",
+    "Juan Castro") resolve to the same row through the artista_alias table.
     
     Args:
         connection: Connection to the database
-        artist_name (str): Artist name
+        artist_name (str): Artist name or handle
         
     Returns:
-        int: ID of the artist in the database
+        int: ID of the artist in the database, or None if the name is empty
     """
     try:
-        cursor = connection.cursor()
-        
-        # Check if the artist already exists
-        cursor.execute("SELECT id FROM artista WHERE nombre = %s", (artist_name,))
-        result = cursor.fetchone()
-        
-        if result:
-            # If the artist already exists, return its ID
-            return result[0]
-        else:
-            # If the artist doesn't exist, create it
-            cursor.execute(
-                "INSERT INTO artista (nombre) VALUES (%s) RETURNING id",
-                (artist_name,)
+        match = get_artist_resolver(connection).resolve(connection, artist_name)
+        if match is None:
+            return None
+        if match.method != "exact":
+            logger.debug(
+                "Artist '%s' resolved to '%s' (%s, %.2f)", artist_name, match.nombre, match.method, match.score,
+                extra={"per_item": True}
             )
-            artist_id = cursor.fetchone()[0]
-            connection.commit()
-            return artist_id
+        return match.artista_id
     except Exception as e:
-        print(f"Error saving artist to the database: {e}")
-        connection.rollback()
-        return None
+        logger.error("Error saving artist to the database: %s", e)
+        raise
 
 # Function to save venue to the database
-def save_venue_to_db(connection, venue_name):
+@timed("db_save_venue")
+def save_venue_to_db(connection, venue_name, post=None):
     """
-    Saves a venue to the database.
+    Resolves a venue to its row in the database, creating it if it is new.
+    
+    Names are matched against the known venues ignoring accents, case,
+    spacing and small misspellings, so "Riquelaclub" and "Riquela Club" are
+    the same row. Without a name, the venue is taken from the caption
+    hashtags or the page that published the post.
     
     Args:
         connection: Connection to the database
-        venue_name (str): Venue name
+        venue_name (str): Venue name (may be empty)
+        post (dict): Post the venue was extracted from
         
     Returns:
-        int: ID of the venue in the database
+        int: ID of the venue in the database, or None if it is unknown
     """
     try:
-        cursor = connection.cursor()
-        
-        # Check if the venue already exists
-        cursor.execute("SELECT id FROM sala WHERE nombre = %s", (venue_name,))
-        result = cursor.fetchone()
-        
-        if result:
-            # If the venue already exists, return its ID
-            return result[0]
-        else:
-            # If the venue doesn't exist, create it
-            # In a real case, more data would be added here such as city, capacity, etc.
-            cursor.execute(
-                "INSERT INTO sala (nombre) VALUES (%s) RETURNING id",
-                (venue_name,)
+        match = get_venue_resolver(connection).resolve(connection, venue_name, post)
+        if match is None:
+            return None
+        if match.method != "exact":
+            logger.debug(
+                "Venue '%s' resolved to '%s' (%s, %.2f)", venue_name, match.nombre, match.method, match.score,
+                extra={"per_item": True}
             )
-            venue_id = cursor.fetchone()[0]
-            connection.commit()
-            return venue_id
+        return match.sala_id
     except Exception as e:
-        print(f"Error saving venue to the database: {e}")
-        connection.rollback()
-        return None
+        logger.error("Error saving venue to the database: %s", e)
+        raise
 
 # Function to save event to the database
-def save_event_to_db(connection, artist_id, venue_id, event_date):
+@timed("db_save_event")
+def save_event_to_db(connection, artist_id, venue_id, event_date, event_time=None):
     """
     Saves an event to the database.
     
@@ -284,7 +393,8 @@ def save_event_to_db(connection, artist_id, venue_id, event_date):
         connection: Connection to the database
         artist_id (int): Artist ID
         venue_id (int): Venue ID
-        event_date (str): Event date
+        event_date (date): Event date
+        event_time (time): Start time, if known
         
     Returns:
         int: ID of the event in the database
@@ -292,102 +402,233 @@ def save_event_to_db(connection, artist_id, venue_id, event_date):
     try:
         cursor = connection.cursor()
         
-        # Check if the event already exists
+        # Insert it unless it exists; a concurrent insert of the same event
+        # is waited for instead of duplicated (unique key idx_eventos_clave)
+        ensure_event_partition(connection, event_date)
         cursor.execute(
-            "SELECT id FROM eventos WHERE artista_id = %s AND sala_id = %s AND fecha = %s",
-            (artist_id, venue_id, event_date)
+            """
+            INSERT INTO eventos (artista_id, sala_id, fecha, hora) VALUES (%s, %s, %s, %s)
+            ON CONFLICT DO NOTHING
+            RETURNING id
+            """,
+            (artist_id, venue_id, event_date, event_time)
         )
         result = cursor.fetchone()
         
-        if result:
-            # If the event already exists, return its ID
-            return result[0]
-        else:
-            # If the event doesn't exist, create it
+        if result is None:
+            # The event already exists: return its ID
             cursor.execute(
-                "INSERT INTO eventos (artista_id, sala_id, fecha) VALUES (%s, %s, %s) RETURNING id",
-                (artist_id, venue_id, event_date)
+                "SELECT id FROM eventos WHERE artista_id = %s AND sala_id = %s AND fecha = %s AND hora IS NOT DISTINCT FROM %s",
+                (artist_id, venue_id, event_date, event_time)
             )
-            event_id = cursor.fetchone()[0]
-            connection.commit()
-            return event_id
+            return cursor.fetchone()[0]
+        
+        # Append the new event to the change log in the same transaction
+        event_id = result[0]
+        record_event_changes(connection, "insert", [(event_id, artist_id, venue_id, event_date, event_time)])
+        return event_id
     except Exception as e:
-        print(f"Error saving event to the database: {e}")
-        connection.rollback()
-        return None
+        logger.error("Error saving event to the database: %s", e)
+        raise
+
+# Function to save the source post of an extraction to the database
+def save_post_to_db(connection, post, output, score=None):
+    """
+    Records a post with the version and result of its extraction.
+    
+    Args:
+        connection: Connection to the database
+        post (dict): Source post, with its Meta id
+        output (dict): Extraction results
+        score (float): Quality score of the extraction (e.g. the evaluation
+            similarity), or None to keep the score already stored
+    """
+    # The local image path is not kept: it is downloaded again from image_url
+    entrada = {key: value for key, value in post.items() if key != "image_path"}
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            """
+            INSERT INTO post (id, meta_page_id, entrada, extraccion, extraccion_version, puntuacion, extraido)
+            VALUES (%s, %s, %s, %s, %s, %s, now())
+            ON CONFLICT (id) DO UPDATE SET
+                meta_page_id = excluded.meta_page_id,
+                entrada = excluded.entrada,
+                extraccion = excluded.extraccion,
+                extraccion_version = excluded.extraccion_version,
+                puntuacion = COALESCE(excluded.puntuacion, post.puntuacion),
+                extraido = excluded.extraido
+            """,
+            (
+                str(post["id"]), post.get("venue_id"),
+                json.dumps(entrada, ensure_ascii=False, default=str), json.dumps(output, ensure_ascii=False),
+                EXTRACTION_VERSION, score
+            )
+        )
+    finally:
+        cursor.close()
+
+# Function to link events to the post they were extracted from
+def link_events_to_post(connection, post_id, events):
+    """
+    Records which post produced each event, with the extraction version.
+    
+    Args:
+        connection: Connection to the database
+        post_id (str): Meta id of the post
+        events (list): (event id, event date) of every event extracted from the post
+    """
+    # The same event can come from several dates of the caption; link it once
+    events = list(dict.fromkeys(events))
+    if not events:
+        return
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            """
+            INSERT INTO evento_fuente (evento_id, evento_fecha, post_id, extraccion_version)
+            SELECT evento_id, evento_fecha, %s, %s FROM unnest(%s::integer[], %s::date[]) AS t(evento_id, evento_fecha)
+            ON CONFLICT (evento_id, post_id) DO UPDATE SET extraccion_version = excluded.extraccion_version
+            """,
+            (str(post_id), EXTRACTION_VERSION, [event[0] for event in events], [event[1] for event in events])
+        )
+    finally:
+        cursor.close()
 
 # Function to save results to the database
-def save_results_to_db(connection, output):
+@timed("db_save_results")
+def save_results_to_db(connection, output, post=None, score=None):
     """
     Saves the extraction results to the database.
     
+    All rows of a post are written in the caller's transaction; if any of
+    them fails, the whole post is rolled back. Posts with an id are recorded
+    in the post table and linked to their events through evento_fuente.
+    
     Args:
         connection: Connection to the database
         output (dict): Extraction results
+        post (dict): Source post, used to resolve the venue and relative dates
+        score (float): Quality score of the extraction, stored with the post
+        
+    Returns:
+        list: IDs of the events of the post, or None if saving failed
     """
     try:
+        # Remember the post and the extraction version even if it yields no events
+        if post and post.get("id"):
+            save_post_to_db(connection, post, output, score)
+        
         # Extract artists, dates and locations
         artistas = output.get("artistas", [])
-        fechas = output.get("fecha", [])
         ubicaciones = output.get("ubicacion", [])
         
+        # Normalize the dates ("este viernes", "3-1", "23:30") against the post date
+        fechas = parse_event_dates(output.get("fecha", []), (post or {}).get("date"))
+        
+        # Without an extracted venue, fall back to the venue that published the post
+        if not ubicaciones and post and post.get("venue_id"):
+            ubicaciones = [""]
+        
         # If there are no artists, dates or locations, there's nothing to save
         if not artistas or not fechas or not ubicaciones:
-            print("Not enough data to save to the database")
-            return
+            logger.info("Not enough data to save to the database")
+            return []
         
         # For each artist, save to the database
+        event_ids = []
+        sources = []
         for artista in artistas:
             artist_id = save_artist_to_db(connection, artista)
+            if artist_id is None:
+                continue
             
             # For each location, save to the database
             for ubicacion in ubicaciones:
-                venue_id = save_venue_to_db(connection, ubicacion)
+                venue_id = save_venue_to_db(connection, ubicacion, post)
+                if venue_id is None:
+                    continue
                 
                 # For each date, save to the database
-                for fecha in fechas:
-                    event_id = save_event_to_db(connection, artist_id, venue_id, fecha)
-                    print(f"Event saved to the database with ID {event_id}")
+                for fecha, hora in fechas:
+                    event_id = save_event_to_db(connection, artist_id, venue_id, fecha, hora)
+                    event_ids.append(event_id)
+                    sources.append((event_id, fecha))
+                    logger.debug("Event saved to the database with ID %s", event_id, extra={"per_item": True})
+        
+        # Record which post and extraction version produced the events
+        if post and post.get("id"):
+            link_events_to_post(connection, post["id"], sources)
+        
+        # Refresh the monthly summary tables for the months touched by this batch
+        refresh_event_stats_for_events(connection, event_ids)
+        return event_ids
     except Exception as e:
-        print(f"Error saving results to the database: {e}")
+        logger.error("Error saving results to the database: %s", e)
+        connection.rollback()
+        return None
 
-@observe()  # Decorator for tracking this function in Langfuse
-def process_post(input_data, **kwargs):
+# Function to upload a post image to Dify
+@timed("dify_upload")
+def upload_image_to_dify(image_path):
     """
-    Processes a post using the Dify service and returns the generated response.
+    Uploads an image to Dify so that the workflow can read it.
     
     Args:
-        input_data (dict or str): The post data to process. Can be:
-            - A string with the post text
-            - A dictionary with keys like "caption", "date", "image_path"
-            - A dictionary with the post text directly
-        **kwargs: Additional arguments for Langfuse
+        image_path (str): Path to the image
         
     Returns:
-        dict: Generated response
+        str: ID of the uploaded file, or None if the upload failed
     """
-    # Prepare inputs for the Dify API according to the input_data type
-    dify_inputs = {}
-    
-    if isinstance(input_data, dict):
-        if "caption" in input_data:
-            print("Input received as dictionary with standard format")
-            dify_inputs = {
-                "post": input_data.get("caption", ""),
-                "date": input_data.get("date", "")
-            }
-            
-            # If there's an image, add it to the inputs
-            if "image_path" in input_data and input_data["image_path"]:
-                print(f"Post has image: {input_data['image_path']}")
+    mime_types = {
+        '.png': 'image/png',
+        '.jpg': 'image/jpeg',
+        '.jpeg': 'image/jpeg',
+        '.webp': 'image/webp',
+        '.gif': 'image/gif'
+    }
+    mime_type = mime_types.get(os.path.splitext(image_path)[1].lower(), 'application/octet-stream')
     
     try:
-        # Make the call to the Dify API to get a response
-        print(f"Calling the Dify API at {DIFY_WORKFLOW_URL}...")
+        with open(image_path, 'rb') as f:
+            response = requests.post(
+                DIFY_UPLOAD_URL,
+                headers={"Authorization": f"Bearer {DIFY_AUTH_TOKEN}"},
+                files={'file': (os.path.basename(image_path), f, mime_type)},
+                data={'user': "Langfuse"},
+                timeout=10
+            )
+        if response.status_code != 201:
+            logger.warning("Error uploading image to Dify: %s", response.status_code)
+            return None
+        return response.json()["id"]
+    except Exception as e:
+        logger.warning("Error uploading image to Dify: %s", e)
+        return None
+
+# Function to run the extraction workflow in Dify
+def call_dify_workflow(dify_inputs, auth_token=None, usage=None):
+    """
+    Runs the Dify workflow once.
+    
+    Args:
+        dify_inputs (dict): Inputs of the workflow
+        auth_token (str): API key of the workflow app (default: DIFY_AUTH_TOKEN)
+        usage (dict): If given, the run's total_tokens, elapsed_time (seconds
+            reported by Dify) and runs are added to it
+        
+    Returns:
+        dict: Outputs of the workflow
+        
+    Raises:
+        requests.RequestException: If the call fails or returns an error status
+    """
+    logger.debug("Calling the Dify API at %s", DIFY_WORKFLOW_URL, extra={"per_item": True})
+    with stage_timer("dify_workflow"):
         response = requests.post(
             DIFY_WORKFLOW_URL,
             headers={
-                "Authorization": f"Bearer {DIFY_AUTH_TOKEN}",
+                "Authorization": f"Bearer {auth_token or DIFY_AUTH_TOKEN}",
                 "Content-Type": "application/json"
             },
             json={
@@ -397,137 +638,535 @@ def process_post(input_data, **kwargs):
             },
             timeout=10  # Timeout de 10 segundos
         )
+    response.raise_for_status()
+    
+    json_data = response.json()["data"]
+    logger.debug("Dify response: %s", json_data, extra={"per_item": True})
+    if usage is not None:
+        usage["total_tokens"] = usage.get("total_tokens", 0) + (json_data.get("total_tokens") or 0)
+        usage["elapsed_time"] = usage.get("elapsed_time", 0.0) + (json_data.get("elapsed_time") or 0.0)
+        usage["runs"] = usage.get("runs", 0) + 1
+    return json_data["outputs"]
+
+# Function to build the workflow inputs of a post
+def build_dify_inputs(input_data):
+    """
+    Builds the workflow inputs of a post, uploading its image if it has one.
+    
+    Args:
+        input_data (dict or str): The post data (see process_post)
         
-        # Process the response according to the status code
-        if response.status_code == 200:
-            try:
-                # Extract data from the response
-                json_data = response.json()["data"]
-                print(f"Dify response: {json_data}")
-                outputs = json_data["outputs"]
-                
-                # Determine the correct response key
-                if "result" in outputs:
-                    output = outputs["result"]
-                elif "artistas" in outputs:
-                    output = outputs
-                else:
-                    # Fallback: If the expected keys are not present, show all available ones
-                    available_keys = list(outputs.keys())
-                    if available_keys:
-                        first_key = available_keys[0]
-                        output = outputs[first_key]
-                    else:
-                        output = f"No response keys found in the output: {json_data}"
+    Returns:
+        dict: Inputs for the Dify workflow
+    """
+    dify_inputs = {}
+    
+    if isinstance(input_data, dict):
+        if "caption" in input_data:
+            logger.debug("Input received as dictionary with standard format", extra={"per_item": True})
+            dify_inputs = {
+                "post": input_data.get("caption", ""),
+                "date": input_data.get("date", "")
+            }
             
-            except Exception as e:
-                # Error processing the JSON response
-                print(f"Error processing the JSON response: {str(e)}")
-                output = f"Error processing response: {str(e)}"
-        else:
-            # Error in the API call (code different from 200)
-            print(f"Error in the API call: {response.status_code}")
-            output = f"API error: {response.status_code} - {response.text[:200]}"
-    except Exception as e:
-        print(f"Unexpected error calling the Dify API: {e}")
-        output = f"Error: {str(e)}"
+            # If there's an image, upload it and add it to the inputs
+            if "image_path" in input_data and input_data["image_path"]:
+                logger.debug("Post has image: %s", input_data["image_path"], extra={"per_item": True})
+                if os.path.exists(input_data["image_path"]):
+                    file_id = upload_image_to_dify(input_data["image_path"])
+                    if file_id:
+                        dify_inputs["image"] = [{
+                            "transfer_method": "local_file",
+                            "upload_file_id": file_id,
+                            "type": "image"
+                        }]
+    
+    return dify_inputs
+
+# Function to extract the data of a single post
+def extract_post(dify_inputs, auth_token=None, usage=None):
+    """
+    Runs the workflow for one post and validates its output.
+    
+    Only outputs that cannot be repaired locally are asked again, at most
+    EXTRACTION_MAX_REASKS times.
+    
+    Args:
+        dify_inputs (dict): Inputs for the Dify workflow
+        auth_token (str): API key of the workflow app (default: DIFY_AUTH_TOKEN)
+        usage (dict): Token usage of every run, see call_dify_workflow
+        
+    Returns:
+        dict: Validated extraction, or None if the workflow failed or its
+            output could not be repaired
+    """
+    for attempt in range(1 + EXTRACTION_MAX_REASKS):
+        try:
+            outputs = call_dify_workflow(dify_inputs, auth_token, usage)
+        except Exception as e:
+            logger.error("Error calling the Dify API: %s", e)
+            return None
+        
+        try:
+            output, repairs = parse_extraction(outputs)
+            if repairs:
+                logger.debug("Workflow output repaired: %s", repairs, extra={"per_item": True})
+            return output
+        except ExtractionError as e:
+            logger.warning("Invalid workflow output (attempt %d): %s", attempt + 1, e)
+            if attempt < EXTRACTION_MAX_REASKS:
+                EXTRACTION_REASKS.inc()
+    return None
+
+@observe()  # Decorator for tracking this function in Langfuse
+def process_post(input_data, **kwargs):
+    """
+    Processes a post using the Dify service and returns the generated response.
+    
+    Args:
+        input_data (dict or str): The post data to process. Can be:
+            - A string with the post text
+            - A dictionary with keys like "caption", "date", "image_path"
+            - A dictionary with the post text directly
+        **kwargs: Additional arguments for Langfuse
+        
+    Returns:
+        dict: Validated extraction with artistas, fecha and ubicacion, or
+            None if the workflow failed or its output could not be repaired
+    """
+    # Prepare inputs for the Dify API according to the input_data type
+    dify_inputs = build_dify_inputs(input_data)
+    
+    # Call the workflow; only outputs that cannot be repaired locally are asked again
+    output = extract_post(dify_inputs)
 
     # Update observation in Langfuse
     langfuse_context.update_current_observation(
         input=input_data,
         output=output,
         metadata={
-            "post_id": kwargs.get("post_id", "unknown")
+            "post_id": kwargs.get("post_id", "unknown"),
+            "stage_timings": current_stage_timings()
         }
     )
     
     return output
 
+# Function to group posts into workflow batches
+def build_batches(posts, max_posts=None, max_chars=None):
+    """
+    Groups consecutive posts into batches for the batched workflow.
+    
+    Args:
+        posts (list): Post data (see process_post)
+        max_posts (int): Maximum posts per batch (default: BATCH_SIZE)
+        max_chars (int): Maximum caption characters per batch (default: BATCH_MAX_CHARS)
+        
+    Returns:
+        list: Lists of indexes into posts, in order
+    """
+    max_posts = max_posts or BATCH_SIZE
+    max_chars = max_chars or BATCH_MAX_CHARS
+    
+    batches = []
+    current, chars = [], 0
+    for index, post in enumerate(posts):
+        caption = post.get("caption", "") if isinstance(post, dict) else str(post)
+        if current and (len(current) >= max_posts or chars + len(caption) > max_chars):
+            batches.append(current)
+            current, chars = [], 0
+        current.append(index)
+        chars += len(caption)
+    if current:
+        batches.append(current)
+    return batches
+
+# Function to stream dataset items in workflow batches
+def iter_item_batches(items, window=None):
+    """
+    Groups a stream of dataset items into workflow batches, reading a window of items at a time.
+    
+    Args:
+        items (iterable): DatasetItem objects
+        window (int): Items held in memory at once (default: DATASET_WINDOW)
+        
+    Yields:
+        tuple: (batch, window_items, start) where batch holds indexes into
+            window_items and start is the position of its first item in the dataset
+    """
+    window = window or DATASET_WINDOW
+    iterator = iter(items)
+    start = 0
+    while True:
+        window_items = list(islice(iterator, window))
+        if not window_items:
+            return
+        for batch in build_batches([item.input for item in window_items]):
+            yield batch, window_items, start
+        start += len(window_items)
+
+# Function to run the batched workflow, splitting the batch when it fails
+def _extract_batch(entries):
+    """
+    Extracts a batch of posts with one workflow run.
+    
+    Posts whose result is missing or invalid are retried in two halves,
+    down to single posts, which go through the regular workflow.
+    
+    Args:
+        entries (list): (key, dify_inputs) pairs, key being a unique str
+        
+    Returns:
+        dict: Extraction (or None) per key
+    """
+    if len(entries) == 1:
+        key, dify_inputs = entries[0]
+        return {key: extract_post(dify_inputs)}
+    
+    # Pack the posts; their images go in one file list referenced by position
+    posts, images = [], []
+    for key, dify_inputs in entries:
+        post = {"id": key, "post": dify_inputs.get("post", ""), "date": dify_inputs.get("date", "")}
+        if dify_inputs.get("image"):
+            post["images"] = list(range(len(images), len(images) + len(dify_inputs["image"])))
+            images.extend(dify_inputs["image"])
+        posts.append(post)
+    batch_inputs = {"posts": json.dumps(posts, ensure_ascii=False)}
+    if images:
+        batch_inputs["images"] = images
+    
+    results = {}
+    try:
+        with stage_timer("dify_batch"):
+            outputs = call_dify_workflow(batch_inputs, DIFY_BATCH_AUTH_TOKEN)
+        results = parse_batch_extraction(outputs, [key for key, _ in entries])
+    except ExtractionError as e:
+        logger.warning("Invalid batch output for %d posts: %s", len(entries), e)
+    except Exception as e:
+        logger.warning("Error calling the batched workflow for %d posts: %s", len(entries), e)
+    
+    # Split whatever did not come back valid
+    missing = [entry for entry in entries if entry[0] not in results]
+    if missing:
+        BATCH_SPLITS.inc()
+        middle = len(missing) // 2
+        for half in (missing[:middle], missing[middle:]):
+            if half:
+                results.update(_extract_batch(half))
+    return results
+
+def process_posts_batch(posts, post_ids, trace_ids=None):
+    """
+    Processes several posts with a single run of the batched workflow.
+    
+    Results are matched back to each post by id; posts missing from the
+    batch output are retried in smaller batches.
+    
+    Args:
+        posts (list): Post data (see process_post)
+        post_ids (list): ID of each post
+        trace_ids (list): Langfuse trace of each post, to record its result
+        
+    Returns:
+        list: Extraction (or None) of each post, in the same order
+    """
+    # Keys are positions, so repeated post ids cannot be confused
+    entries = [(str(position), build_dify_inputs(post)) for position, post in enumerate(posts)]
+    results = _extract_batch(entries)
+    outputs = [results.get(str(position)) for position in range(len(posts))]
+    
+    # Record the result of every post in its own trace
+    for post, post_id, trace_id, output in zip(posts, post_ids, trace_ids or [], outputs):
+        langfuse.span(
+            trace_id=trace_id,
+            name="process_post",
+            input=post,
+            output=output,
+            metadata={"post_id": post_id, "batch_size": len(posts)}
+        )
+    
+    return outputs
+
 def main():
     """
     Main function that executes the evaluation.
+    
+    Returns:
+        dict: Run summary (see merge_run_summaries)
     """
     # Generate timestamp to identify the execution
     timestamp = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
+    started = time.perf_counter()
     
     # Show execution information
-    print(f"Starting evaluation with:")
-    print(f"- Run name: {RUN_NAME}")
-    print(f"- Run description: {RUN_DESCRIPTION}")
-    print(f"- Evaluator model: {EVALUATOR_MODEL}")
-    print(f"- Metrics to evaluate: {', '.join(METRICS)}")
+    logger.info(
+        "Starting evaluation",
+        extra={
+            "run_name": RUN_NAME,
+            "run_description": RUN_DESCRIPTION,
+            "evaluator_model": EVALUATOR_MODEL,
+            "metrics": METRICS
+        }
+    )
     
-    # Load dataset from CSV
-    dataset = load_dataset_from_csv(DATASET_PATH)
+    # Open the dataset (file or Langfuse mirror) as a stream
+    dataset = load_dataset(DATASET_PATH, refresh=REFRESH_DATASET, shard=SHARD)
+    
+    # Serve stage metrics during the run if requested
+    if METRICS_PORT:
+        start_metrics_server(port=METRICS_PORT)
     
     # Connect to the database if necessary
-    connection = None
+    pool = None
     if SAVE_TO_DB:
-        connection = connect_to_db()
-    
-    # Process each item in the dataset
-    for idx, item in enumerate(dataset.items):
-        print(f"\nProcessing item {idx+1}/{len(dataset.items)}")
-        post_data = item.input
-        expected_output = item.expected_output
-        
-        # Extract the post ID according to the post_data format
-        if isinstance(post_data, dict):
-            post_id = post_data.get("id", idx)
-        else:
-            post_id = idx
-        
-        # Create trace in Langfuse for this item
-        trace_id = item.observe(
-            run_name=RUN_NAME,
-            run_description=RUN_DESCRIPTION,
-            run_metadata={
-                "evaluator_model": EVALUATOR_MODEL,
-                "post_id": post_id
-            }
-        )
+        pool = connect_to_db()
+    
+    # Load the caption pre-filter if requested
+    caption_filter = None
+    if PREFILTER_THRESHOLD is not None:
+        caption_filter = CaptionFilter.load(PREFILTER_MODEL, threshold=PREFILTER_THRESHOLD)
+    
+    # Process the dataset in batches (of one post unless --batch-size is given)
+    processed = failures = prefiltered = 0
+    similarity_sum = 0.0
+    for batch, items, start in iter_item_batches(dataset.items):
+        post_ids, trace_ids = [], []
+        for idx in batch:
+            logger.info("Processing item %d", start + idx + 1)
+            post_data = items[idx].input
+            processed += 1
+            
+            # Extract the post ID according to the post_data format
+            if isinstance(post_data, dict):
+                post_id = post_data.get("id", start + idx)
+            else:
+                post_id = start + idx
+            
+            # Create trace in Langfuse for this item
+            trace_id = items[idx].observe(
+                run_name=RUN_NAME,
+                run_description=RUN_DESCRIPTION,
+                run_metadata={
+                    "evaluator_model": EVALUATOR_MODEL,
+                    "post_id": post_id
+                }
+            )
+            post_ids.append(post_id)
+            trace_ids.append(trace_id)
         
-        # Get the response from the Dify service
-        output = process_post(post_data, langfuse_observation_id=trace_id, post_id=post_id)
-        print("Dify response:", output)
-        print("Expected output: ", expected_output)
+        # Get the responses from the Dify service, skipping the posts rejected by the pre-filter
+        with collect_stage_timings() as batch_timings:
+            with stage_timer("prefilter"):
+                skipped = {
+                    position for position, idx in enumerate(batch)
+                    if caption_filter and not caption_filter.should_extract(items[idx].input)
+                }
+            kept = [position for position in range(len(batch)) if position not in skipped]
+            outputs = [{field: [] for field in EXTRACTION_FIELDS} for _ in batch]
+            if len(kept) == 1:
+                position = kept[0]
+                outputs[position] = process_post(items[batch[position]].input, langfuse_observation_id=trace_ids[position], post_id=post_ids[position])
+            elif kept:
+                kept_outputs = process_posts_batch(
+                    [items[batch[position]].input for position in kept],
+                    [post_ids[position] for position in kept],
+                    [trace_ids[position] for position in kept]
+                )
+                for position, output in zip(kept, kept_outputs):
+                    outputs[position] = output
         
-        # Calculate the distance between the model output and the expected output
-        print("Calculating JSON distance between the output and the expected output...")
-        try:
-            distance, similarity = calculate_json_distance(output, expected_output)
-            print(f"Calculated JSON distance: {distance:.4f} (similarity: {similarity:.4f})")
-        except Exception as e:
-            print(f"Error calculating JSON distance: {e}")
-            distance = 1.0
-            similarity = 0.0
+        for position, (idx, post_id, trace_id, output) in enumerate(zip(batch, post_ids, trace_ids, outputs)):
+            post_data = items[idx].input
+            expected_output = items[idx].expected_output
+            
+            with collect_stage_timings() as stage_timings:
+                logger.debug("Dify response: %s", output, extra={"per_item": True})
+                logger.debug("Expected output: %s", expected_output, extra={"per_item": True})
+                
+                # Calculate the distance between the model output and the expected output
+                try:
+                    distance, similarity = calculate_json_distance(output, expected_output)
+                    logger.info("Calculated JSON distance: %.4f (similarity: %.4f)", distance, similarity, extra={"post_id": post_id})
+                except Exception as e:
+                    logger.warning("Error calculating JSON distance: %s", e)
+                    distance = 1.0
+                    similarity = 0.0
+                
+                similarity_sum += similarity
+                failures += output is None
+                prefiltered += position in skipped
+                
+                # Register the distance in Langfuse
+                langfuse.score(
+                    trace_id=trace_id,
+                    name="Similarity",
+                    value=similarity,
+                )
+                
+                # Save results to the database if necessary, scored with the similarity
+                if SAVE_TO_DB and pool and output is not None:
+                    with pool.connection() as connection:
+                        save_results_to_db(
+                            connection, output, post_data if isinstance(post_data, dict) else None, score=similarity
+                        )
+            
+            # Attach the time spent in each stage to the trace (extraction time is shared by the batch)
+            langfuse.trace(
+                id=trace_id,
+                metadata={
+                    "stage_timings": {**batch_timings, **stage_timings},
+                    "batch_size": len(kept),
+                    "prefiltered": position in skipped
+                }
+            )
+    
+    # Close database connections if necessary
+    if pool:
+        close_all_pools()
+    
+    # Finalize: Send all pending data to Langfuse
+    logger.info("Finalizing evaluation and sending data to Langfuse")
+    with stage_timer("langfuse_flush"):
+        langfuse_context.flush()
+        langfuse.flush()
+    
+    # Write the stage metrics if requested
+    if METRICS_FILE:
+        dump_metrics(METRICS_FILE)
+    logger.info("Evaluation completed: %d items processed", processed, extra={"timestamp": timestamp})
+    
+    return {
+        "run_name": RUN_NAME,
+        "shards": [f"{SHARD.index}/{SHARD.count}"] if SHARD else [],
+        "items": processed,
+        "failures": failures,
+        "prefiltered": prefiltered,
+        "similarity_sum": round(similarity_sum, 6),
+        "mean_similarity": round(similarity_sum / processed, 4) if processed else 0.0,
+        "seconds": round(time.perf_counter() - started, 3),
+        "metrics": REGISTRY.snapshot(),
+        "failed_shards": [],
+    }
+
+# Function to merge the summaries of several shards of a run
+def merge_run_summaries(summaries):
+    """
+    Merges the summaries returned by main() for the shards of one run.
+    
+    Args:
+        summaries (list): Summaries of the shards
         
-        # Register the distance in Langfuse
-        langfuse.score(
-            trace_id=trace_id,
-            name="Similarity",
-            value=similarity,
-        )
+    Returns:
+        dict: Run summary with summed counts, the mean similarity over all
+            items and merged stage metrics; seconds is the slowest shard
+    """
+    items = sum(summary["items"] for summary in summaries)
+    similarity_sum = sum(summary["similarity_sum"] for summary in summaries)
+    return {
+        "run_name": summaries[0]["run_name"] if summaries else RUN_NAME,
+        "shards": [shard for summary in summaries for shard in summary["shards"]],
+        "items": items,
+        "failures": sum(summary["failures"] for summary in summaries),
+        "prefiltered": sum(summary["prefiltered"] for summary in summaries),
+        "similarity_sum": round(similarity_sum, 6),
+        "mean_similarity": round(similarity_sum / items, 4) if items else 0.0,
+        "seconds": max((summary["seconds"] for summary in summaries), default=0.0),
+        "metrics": merge_snapshots([summary["metrics"] for summary in summaries]),
+        "failed_shards": [shard for summary in summaries for shard in summary["failed_shards"]],
+    }
+
+# Function run by each worker process of a sharded evaluation
+def run_worker(argv, shard, run_name):
+    """
+    Evaluates one shard of the dataset in a worker process.
+    
+    The process has its own Dify, database and Langfuse clients; traces go
+    to the run name of the parent process.
+    
+    Args:
+        argv (list): Command line arguments of the parent process
+        shard (Shard): Shard evaluated by this worker
+        run_name (str): Run name shared by every worker
         
-        # Save results to the database if necessary
-        if SAVE_TO_DB and connection:
-            save_results_to_db(connection, output)
+    Returns:
+        dict: Summary of the shard (see main)
+    """
+    global SHARD, RUN_NAME, METRICS_PORT, METRICS_FILE
+    apply_arguments(parse_arguments(argv))
+    SHARD = shard
+    RUN_NAME = run_name
+    # Each worker writes its own metrics file; the merged metrics go to the run summary
+    METRICS_PORT = None
+    if METRICS_FILE:
+        root, extension = os.path.splitext(METRICS_FILE)
+        METRICS_FILE = f"{root}.shard{shard.index}{extension}"
+    setup_logging(level=args.log_level, log_format=args.log_format, quiet=args.quiet)
+    return main()
+
+# Function to run the evaluation in several processes
+def run_workers(argv, workers):
+    """
+    Splits the dataset into one shard per worker process and merges their summaries.
     
-    # Close database connection if necessary
-    if connection:
-        connection.close()
+    Args:
+        argv (list): Command line arguments of the run
+        workers (int): Number of processes
+        
+    Returns:
+        dict: Merged run summary (see merge_run_summaries)
+    """
+    context = multiprocessing.get_context("spawn")
+    summaries, failed = [], []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = {
+            executor.submit(run_worker, argv, Shard(index, workers), RUN_NAME): index
+            for index in range(workers)
+        }
+        for future in as_completed(futures):
+            shard = f"{futures[future]}/{workers}"
+            try:
+                summaries.append(future.result())
+                logger.info("Shard %s completed", shard)
+            except Exception as e:
+                logger.error("Shard %s failed: %s", shard, e)
+                failed.append({"shard": shard, "error": str(e)})
     
-    # Finalize: Send all pending data to Langfuse
-    print("\nFinalizing evaluation and sending data to Langfuse...")
-    langfuse_context.flush()
-    print(f"Evaluation completed: {len(dataset.items)} items processed")
-    print(f"Timestamp: {timestamp}")
+    summary = merge_run_summaries(summaries)
+    summary["failed_shards"].extend(failed)
+    return summary
 
 if __name__ == "__main__":
     # Example of use: get posts from Meta and evaluate them
-    print("Getting posts from Meta...")
+    setup_logging(level=args.log_level, log_format=args.log_format, quiet=args.quiet)
+    logger.info("Getting posts from Meta...")
     posts = get_posts_with_images()
-    print(f"Obtained {len(posts)} posts")
+    logger.info("Obtained %d posts", len(posts))
     
-    # Execute the evaluation
-    main()
+    # Execute the evaluation, profiled if requested
+    if PROFILE_MODE:
+        profiler = RunProfiler(
+            mode=PROFILE_MODE,
+            output_dir=profile_dir_for_run(RUN_NAME),
+            top_n=args.profile_top,
+            interval=args.profile_interval,
+            baseline=args.profile_baseline
+        )
+        with profiler:
+            summary = main()
+        
+        # Attach the hotspot summary to the run in Langfuse
+        langfuse.trace(name=f"{RUN_NAME}-profile", metadata=profiler.summary, tags=["profile"])
+    elif WORKERS > 1:
+        # One process per shard, all reporting to the same run name
+        summary = run_workers(sys.argv[1:], WORKERS)
+    else:
+        summary = main()
+    
+    # Record the run summary (merged over the shards with --workers)
+    logger.info(
+        "Run summary: %d items, %d failures, mean similarity %.4f",
+        summary["items"], summary["failures"], summary["mean_similarity"],
+        extra={"run_name": RUN_NAME, "failed_shards": summary["failed_shards"]}
+    )
+    langfuse.trace(name=f"{RUN_NAME}-summary", metadata=summary, tags=["evaluation", "summary"])
+    langfuse.flush()
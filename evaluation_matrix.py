@@ -0,0 +1,285 @@
+"""
+Side-by-side evaluation of several workflow/model configurations.
+
+Every configuration is a Dify workflow app (its API key), usually the same
+workflow with a different model. The dataset is loaded and each image is
+uploaded once; the prepared inputs are then sent to every configuration
+concurrently, interleaved so that all configurations run under the same
+load. Accuracy, latency and tokens/s of each configuration are recorded in
+Langfuse and in a local report, which also names the fastest configuration
+that meets the accuracy bar.
+
+The configurations are read from a JSON file:
+
+    [
+        {"name": "gemma3-27b", "auth_token": "app-xxxx", "model": "gemma3:27b"},
+        {"name": "gemma3-4b", "auth_token": "app-yyyy", "model": "gemma3:4b",
+         "inputs": {"temperature": "0"}}
+    ]
+
+"inputs" are extra workflow inputs sent with every post. The apps must belong
+to the Dify workspace where images are uploaded (with DIFY_AUTH_TOKEN).
+
+Usage:
+    python evaluation_matrix.py --configs matrix.json --dataset video/dataset.csv --min-accuracy 0.8
+"""
+
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import NamedTuple
+
+from evaluation import (
+    langfuse, load_dataset, build_dify_inputs, extract_post, calculate_json_distance
+)
+from benchmark import summarize
+from metrics import REGISTRY
+from log_config import setup_logging, add_logging_arguments
+
+logger = logging.getLogger(__name__)
+
+# Directory where the reports of each run are saved
+RESULTS_DIR = "matrix_results"
+
+# Workflow runs in flight at the same time, across all configurations
+MATRIX_CONCURRENCY = 8
+
+# Mean similarity a configuration needs to be recommended
+MIN_ACCURACY = 0.8
+
+MATRIX_RUNS = REGISTRY.counter(
+    "matrix_workflow_runs_total", "Posts extracted by the evaluation matrix, by configuration and outcome",
+    ("config", "outcome")
+)
+
+
+class MatrixConfig(NamedTuple):
+    """
+    Workflow/model configuration evaluated by the matrix.
+    """
+    name: str
+    auth_token: str
+    model: str
+    inputs: dict
+
+
+def load_matrix_configs(path):
+    """
+    Loads the configurations to compare.
+
+    Args:
+        path (str): JSON file with a list of configurations
+
+    Returns:
+        list: MatrixConfig per configuration
+
+    Raises:
+        ValueError: If a configuration has no name or API key, or names repeat
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+
+    configs = []
+    for entry in entries:
+        if not entry.get("name") or not entry.get("auth_token"):
+            raise ValueError(f"Matrix configuration without name or auth_token: {entry}")
+        configs.append(MatrixConfig(
+            name=entry["name"],
+            auth_token=entry["auth_token"],
+            model=entry.get("model", entry["name"]),
+            inputs=entry.get("inputs") or {}
+        ))
+
+    names = [config.name for config in configs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Repeated matrix configuration names: {names}")
+    return configs
+
+
+def parse_arguments():
+    """
+    Configures and processes command line arguments of the matrix.
+
+    Returns:
+        argparse.Namespace: Object with the processed arguments
+    """
+    parser = argparse.ArgumentParser(description='Evaluación comparativa de varios modelos/workflows')
+    parser.add_argument('--configs', type=str, required=True,
+                    help='JSON file with the configurations to compare')
+    parser.add_argument('--dataset', type=str, default='dataset.csv',
+                    help='Path to the CSV/JSONL dataset, or langfuse:<name> (default: dataset.csv)')
+    parser.add_argument('--run-name', type=str, default=f"posts-matrix-{datetime.now().strftime('%d-%m-%Y %H:%M:%S')}",
+                    help='Name of the run in Langfuse')
+    parser.add_argument('--run-description', type=str, default='comparativa de modelos',
+                    help='Description of the run')
+    parser.add_argument('--concurrency', type=int, default=MATRIX_CONCURRENCY,
+                    help=f'Workflow runs in flight across all configurations (default: {MATRIX_CONCURRENCY})')
+    parser.add_argument('--min-accuracy', type=float, default=MIN_ACCURACY,
+                    help=f'Mean similarity required to recommend a configuration (default: {MIN_ACCURACY})')
+    parser.add_argument('--output-dir', type=str, default=RESULTS_DIR,
+                    help=f'Directory where the report is saved (default: {RESULTS_DIR})')
+    add_logging_arguments(parser)
+    return parser.parse_args()
+
+
+def prepare_inputs(items, concurrency):
+    """
+    Builds the workflow inputs of every item once, uploading each image a single time.
+
+    Args:
+        items (list): DatasetItem objects
+        concurrency (int): Uploads in flight at the same time
+
+    Returns:
+        list: Workflow inputs per item
+    """
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(lambda item: build_dify_inputs(item.input), items))
+
+
+def run_matrix(configs, items, concurrency, run_name, run_description):
+    """
+    Extracts every item with every configuration and scores the results.
+
+    Args:
+        configs (list): MatrixConfig to compare
+        items (list): DatasetItem objects
+        concurrency (int): Workflow runs in flight at the same time
+        run_name (str): Name of the run in Langfuse
+        run_description (str): Description of the run
+
+    Returns:
+        dict: Measurements per configuration name
+    """
+    prepared = prepare_inputs(items, concurrency)
+    measurements = {config.name: [] for config in configs}
+    lock = threading.Lock()
+
+    def evaluate(config, item, dify_inputs):
+        usage = {}
+        started = time.perf_counter()
+        output = extract_post({**dify_inputs, **config.inputs}, config.auth_token, usage)
+        latency = time.perf_counter() - started
+
+        # Failed extractions count as completely wrong
+        similarity = 0.0
+        if output is not None:
+            try:
+                _, similarity = calculate_json_distance(output, item.expected_output)
+            except Exception as e:
+                logger.warning("Error calculating JSON distance: %s", e)
+        MATRIX_RUNS.inc(config=config.name, outcome="valid" if output is not None else "invalid")
+
+        # One trace per configuration and item, scored like evaluation.py
+        trace_id = item.observe(
+            run_name=f"{run_name}/{config.name}",
+            run_description=run_description,
+            run_metadata={
+                "config": config.name,
+                "evaluator_model": config.model,
+                "latency_seconds": round(latency, 4),
+                "total_tokens": usage.get("total_tokens", 0),
+                "workflow_runs": usage.get("runs", 0),
+            }
+        )
+        langfuse.trace(id=trace_id, input=item.input, output=output)
+        langfuse.score(trace_id=trace_id, name="Similarity", value=similarity)
+
+        with lock:
+            measurements[config.name].append({
+                "item_id": item.id,
+                "valid": output is not None,
+                "similarity": similarity,
+                "latency": latency,
+                "total_tokens": usage.get("total_tokens", 0),
+                "workflow_seconds": usage.get("elapsed_time", 0.0),
+            })
+
+    # Interleave the configurations so that all of them see the same load over time
+    tasks = [(config, item, dify_inputs) for item, dify_inputs in zip(items, prepared) for config in configs]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(lambda task: evaluate(*task), tasks))
+    return measurements
+
+
+def build_report(configs, measurements, min_accuracy):
+    """
+    Summarizes the measurements of every configuration.
+
+    Args:
+        configs (list): MatrixConfig compared
+        measurements (dict): Measurements per configuration name (see run_matrix)
+        min_accuracy (float): Mean similarity required to recommend a configuration
+
+    Returns:
+        dict: Summary per configuration and the recommended one
+    """
+    summary = {}
+    for config in configs:
+        rows = measurements[config.name]
+        latencies = [row["latency"] for row in rows]
+        tokens = sum(row["total_tokens"] for row in rows)
+        # Prefer the time reported by Dify; fall back to the wall time of the calls
+        seconds = sum(row["workflow_seconds"] for row in rows) or sum(latencies)
+        summary[config.name] = {
+            "model": config.model,
+            "items": len(rows),
+            "valid": sum(1 for row in rows if row["valid"]),
+            "accuracy": round(sum(row["similarity"] for row in rows) / len(rows), 4) if rows else 0.0,
+            "latency": summarize(latencies),
+            "total_tokens": tokens,
+            "tokens_per_second": round(tokens / seconds, 2) if seconds else 0.0,
+        }
+
+    eligible = [name for name, stats in summary.items() if stats["accuracy"] >= min_accuracy]
+    recommended = min(eligible, key=lambda name: summary[name]["latency"]["p50_ms"]) if eligible else None
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "min_accuracy": min_accuracy,
+        "configs": summary,
+        "recommended": recommended,
+    }
+
+
+def main():
+    """
+    Main function that runs the matrix and saves the report.
+    """
+    args = parse_arguments()
+    setup_logging(level=args.log_level, log_format=args.log_format, quiet=args.quiet)
+
+    configs = load_matrix_configs(args.configs)
+    items = list(load_dataset(args.dataset).items)
+    logger.info("Evaluating %d configurations over %d items", len(configs), len(items))
+
+    measurements = run_matrix(configs, items, max(1, args.concurrency), args.run_name, args.run_description)
+    report = build_report(configs, measurements, args.min_accuracy)
+    report["run_name"] = args.run_name
+
+    # Record the comparison next to the per-item traces
+    langfuse.trace(name=f"{args.run_name}-matrix", metadata=report, tags=["evaluation", "matrix"])
+    langfuse.flush()
+
+    print(f"\n{'config':<24} {'model':<20} {'valid':>7} {'accuracy':>9} {'p50 ms':>9} {'p95 ms':>9} {'tok/s':>9}")
+    for name, stats in report["configs"].items():
+        print(f"{name:<24} {stats['model']:<20} {stats['valid']:>3}/{stats['items']:<3} {stats['accuracy']:>9.3f} "
+              f"{stats['latency']['p50_ms']:>9.1f} {stats['latency']['p95_ms']:>9.1f} {stats['tokens_per_second']:>9.1f}")
+    if report["recommended"]:
+        print(f"Fastest configuration with accuracy >= {args.min_accuracy}: {report['recommended']}")
+    else:
+        print(f"No configuration reaches accuracy {args.min_accuracy}")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    report_path = os.path.join(args.output_dir, f"matrix-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Report saved to {report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+"""
+Append-only change log of the events table for downstream consumers.
+
+Every write to eventos made by the ingestion path also appends a row to
+eventos_cambios in the same transaction (transactional outbox), so a change
+is visible in the log exactly when the event itself is committed. A NOTIFY
+on CHANGES_CHANNEL is sent with it; PostgreSQL delivers it at commit, so
+listeners wake up without polling.
+
+Consumers read the log with a keyset cursor (txid, id). Sequence values are
+not handed out in commit order, so reading by id alone could skip a change
+committed late by a slow transaction. Rows are therefore only returned once
+every transaction older than theirs has finished (txid below the xmin of the
+current snapshot), and ordered by the transaction that wrote them. Named
+consumers can keep their cursor in eventos_consumidor:
+
+    python event_changes.py --consumer dashboard --follow
+"""
+
+import argparse
+import json
+import logging
+import select
+from datetime import date, time
+from typing import NamedTuple, Optional
+
+from db_pool import close_all_pools
+from log_config import setup_logging, add_logging_arguments
+
+logger = logging.getLogger(__name__)
+
+# Channel notified when changes are committed
+CHANGES_CHANNEL = "eventos_cambios"
+
+# Default number of changes per page
+CHANGES_PAGE_SIZE = 500
+
+# Seconds a follower waits for a notification before checking the log anyway
+CHANGES_POLL_TIMEOUT = 30
+
+# Operations recorded in the log
+CHANGE_OPERATIONS = ("insert", "update", "delete")
+
+# Cursor before the first change
+START_CURSOR = (0, 0)
+
+
+class EventChange(NamedTuple):
+    """
+    Change of one event, with the values of the event after the change
+    (before it, for deletions).
+    """
+    txid: int
+    id: int
+    operacion: str
+    evento_id: int
+    artista_id: Optional[int]
+    sala_id: Optional[int]
+    fecha: date
+    hora: Optional[time]
+
+    @property
+    def cursor(self):
+        return (self.txid, self.id)
+
+
+def create_change_tables(cursor):
+    """
+    Creates the change log and the consumer cursor tables.
+
+    The log has no foreign key to eventos: it keeps the changes of events
+    that were deleted later.
+
+    Args:
+        cursor: Cursor of the connection to the database
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS eventos_cambios (
+        id BIGSERIAL PRIMARY KEY,
+        txid BIGINT NOT NULL DEFAULT txid_current(),
+        operacion VARCHAR(16) NOT NULL,
+        evento_id INTEGER NOT NULL,
+        artista_id INTEGER,
+        sala_id INTEGER,
+        fecha DATE NOT NULL,
+        hora TIME,
+        creado TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_eventos_cambios_txid_id ON eventos_cambios (txid, id)")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS eventos_consumidor (
+        nombre VARCHAR(255) PRIMARY KEY,
+        txid BIGINT NOT NULL,
+        cambio_id BIGINT NOT NULL,
+        actualizado TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+    """)
+
+
+def record_event_changes(connection, operation, events):
+    """
+    Appends changes to the log and notifies the listeners.
+
+    Runs in the caller's transaction and does not commit: the changes and
+    the notification become visible together with the events.
+
+    Args:
+        connection: Connection to the database
+        operation (str): "insert", "update" or "delete"
+        events (list): (id, artista_id, sala_id, fecha, hora) of each event
+
+    Returns:
+        int: Number of changes recorded
+    """
+    if operation not in CHANGE_OPERATIONS:
+        raise ValueError(f"Unsupported change operation: {operation}")
+    events = list(events)
+    if not events:
+        return 0
+
+    columns = list(zip(*events))
+    cursor = connection.cursor()
+    try:
+        # One statement per batch, however many events it has
+        cursor.execute(
+            """
+            INSERT INTO eventos_cambios (operacion, evento_id, artista_id, sala_id, fecha, hora)
+            SELECT %s, *
+            FROM unnest(%s::integer[], %s::integer[], %s::integer[], %s::date[], %s::time[])
+            """,
+            [operation] + [list(column) for column in columns]
+        )
+        cursor.execute("SELECT pg_notify(%s, %s)", (CHANGES_CHANNEL, json.dumps({"operacion": operation, "eventos": len(events)})))
+    finally:
+        cursor.close()
+    return len(events)
+
+
+def fetch_changes(connection, after=START_CURSOR, limit=CHANGES_PAGE_SIZE):
+    """
+    Fetches the changes committed after a cursor.
+
+    Changes of transactions that may still be followed by older, unfinished
+    ones are held back until those finish, so a cursor never skips a change.
+
+    Args:
+        connection: Connection to the database
+        after (tuple): Cursor (txid, id) of the last change already read
+        limit (int): Maximum number of changes
+
+    Returns:
+        tuple: List of EventChange and the cursor to continue from
+            (the same cursor when there are no new changes)
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            """
+            SELECT txid, id, operacion, evento_id, artista_id, sala_id, fecha, hora
+            FROM eventos_cambios
+            WHERE (txid, id) > (%s, %s) AND txid < txid_snapshot_xmin(txid_current_snapshot())
+            ORDER BY txid, id
+            LIMIT %s
+            """,
+            (after[0], after[1], limit)
+        )
+        changes = [EventChange(*row) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+    return changes, changes[-1].cursor if changes else tuple(after)
+
+
+def iter_changes(connection, after=START_CURSOR, page_size=CHANGES_PAGE_SIZE):
+    """
+    Iterates over the committed changes after a cursor until the log is caught up.
+
+    Args:
+        connection: Connection to the database
+        after (tuple): Cursor (txid, id) of the last change already read
+        page_size (int): Changes fetched per query
+
+    Yields:
+        EventChange: Changes in (txid, id) order
+    """
+    while True:
+        changes, after = fetch_changes(connection, after, page_size)
+        yield from changes
+        if len(changes) < page_size:
+            break
+
+
+def load_consumer_cursor(connection, consumer):
+    """
+    Reads the position of a named consumer.
+
+    Args:
+        connection: Connection to the database
+        consumer (str): Consumer name
+
+    Returns:
+        tuple: Cursor (txid, id), START_CURSOR for a new consumer
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT txid, cambio_id FROM eventos_consumidor WHERE nombre = %s", (consumer,))
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    return tuple(row) if row else START_CURSOR
+
+
+def save_consumer_cursor(connection, consumer, position):
+    """
+    Stores the position of a named consumer. Does not commit.
+
+    Args:
+        connection: Connection to the database
+        consumer (str): Consumer name
+        position (tuple): Cursor (txid, id) of the last change processed
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            """
+            INSERT INTO eventos_consumidor (nombre, txid, cambio_id) VALUES (%s, %s, %s)
+            ON CONFLICT (nombre) DO UPDATE SET
+                txid = excluded.txid, cambio_id = excluded.cambio_id, actualizado = now()
+            """,
+            (consumer, position[0], position[1])
+        )
+    finally:
+        cursor.close()
+
+
+def listen_for_changes(connection):
+    """
+    Subscribes a connection to the change notifications.
+
+    The connection is switched to autocommit, since notifications are only
+    delivered between transactions, and should be dedicated to listening.
+
+    Args:
+        connection: Connection to the database
+    """
+    connection.autocommit = True
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f"LISTEN {CHANGES_CHANNEL}")
+    finally:
+        cursor.close()
+
+
+def wait_for_changes(connection, timeout=CHANGES_POLL_TIMEOUT):
+    """
+    Blocks until a change is committed or the timeout expires.
+
+    Pending notifications are consumed.
+
+    Args:
+        connection: Connection subscribed with listen_for_changes
+        timeout (float): Maximum seconds to wait
+
+    Returns:
+        bool: True if a notification arrived
+    """
+    connection.poll()
+    if not connection.notifies:
+        if select.select([connection], [], [], timeout) == ([], [], []):
+            return False
+        connection.poll()
+    notified = bool(connection.notifies)
+    connection.notifies.clear()
+    return notified
+
+
+def follow_changes(pool, consumer, page_size=CHANGES_PAGE_SIZE, timeout=CHANGES_POLL_TIMEOUT):
+    """
+    Iterates over the changes forever, resuming from a named consumer's cursor.
+
+    The cursor is saved after every page, once its changes have been
+    consumed by the caller, so a restarted consumer continues where it left
+    off (changes of an interrupted page may be delivered twice).
+
+    Args:
+        pool (ConnectionPool): Pool of connections to the database
+        consumer (str): Consumer name
+        page_size (int): Changes fetched per query
+        timeout (float): Seconds between checks when no notification arrives
+
+    Yields:
+        EventChange: Changes in (txid, id) order
+    """
+    listener = pool.getconn()
+    try:
+        listen_for_changes(listener)
+        with pool.connection() as connection:
+            after = load_consumer_cursor(connection, consumer)
+        while True:
+            with pool.connection() as connection:
+                changes, position = fetch_changes(connection, after, page_size)
+            yield from changes
+            if changes:
+                with pool.connection() as connection:
+                    save_consumer_cursor(connection, consumer, position)
+                after = position
+            if len(changes) < page_size:
+                wait_for_changes(listener, timeout)
+    finally:
+        # Close it rather than hand a subscribed connection to other callers
+        pool.putconn(listener, discard=True)
+
+
+def parse_arguments():
+    """
+    Parses the command line arguments.
+
+    Returns:
+        argparse.Namespace: Object with the processed arguments
+    """
+    parser = argparse.ArgumentParser(description='Change log of the events table')
+    parser.add_argument('--consumer', type=str, default=None,
+                    help='Consumer name whose cursor is read and saved (default: read from the start, save nothing)')
+    parser.add_argument('--follow', action='store_true',
+                    help='Keep waiting for new changes (requires --consumer)')
+    parser.add_argument('--page-size', type=int, default=CHANGES_PAGE_SIZE,
+                    help=f'Changes fetched per query (default: {CHANGES_PAGE_SIZE})')
+    add_logging_arguments(parser)
+    return parser.parse_args()
+
+
+def main():
+    """
+    Prints the changes after a consumer's cursor as JSON lines.
+    """
+    args = parse_arguments()
+    setup_logging(level=args.log_level, log_format=args.log_format, quiet=args.quiet)
+
+    # database_schema creates the change tables, so it is imported here to avoid a cycle
+    from database_schema import connect_to_db
+
+    pool = connect_to_db()
+    if pool is None:
+        return
+    try:
+        if args.follow:
+            if not args.consumer:
+                logger.error("--follow requires --consumer")
+                return
+            changes = follow_changes(pool, args.consumer, args.page_size)
+            for change in changes:
+                print(json.dumps(change._asdict(), default=str), flush=True)
+            return
+
+        with pool.connection() as connection:
+            after = load_consumer_cursor(connection, args.consumer) if args.consumer else START_CURSOR
+            for change in iter_changes(connection, after, args.page_size):
+                print(json.dumps(change._asdict(), default=str))
+                after = change.cursor
+            if args.consumer:
+                save_consumer_cursor(connection, args.consumer, after)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close_all_pools()
+
+
+if __name__ == "__main__":
+    main()
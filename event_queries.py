@@ -0,0 +1,198 @@
+"""
+Paginated and streaming queries over the events table.
+
+Pages are addressed with a keyset cursor on (fecha, id) instead of OFFSET, so
+every page costs the same index range scan no matter how deep it is. Full
+scans go through a server-side cursor and are fetched in batches.
+"""
+
+from datetime import date, time
+from itertools import count
+from typing import NamedTuple, Optional
+
+# Default number of events per page
+DEFAULT_PAGE_SIZE = 100
+
+# Number of rows fetched per round-trip when streaming
+STREAM_BATCH_SIZE = 1000
+
+# Sequence used to give every server-side cursor a unique name
+_cursor_ids = count(1)
+
+
+class EventRow(NamedTuple):
+    """
+    Event joined with its artist and venue.
+    """
+    id: int
+    fecha: date
+    hora: Optional[time]
+    artista_id: int
+    artista: str
+    sala_id: int
+    sala: str
+    ciudad: Optional[str]
+    provincia: Optional[str]
+
+
+# Base query shared by pagination and streaming
+EVENTS_SELECT = """
+SELECT e.id, e.fecha, e.hora, a.id, a.nombre, s.id, s.nombre, s.ciudad, s.provincia
+FROM eventos e
+JOIN artista a ON e.artista_id = a.id
+JOIN sala s ON e.sala_id = s.id
+"""
+
+
+def build_event_filters(date_from=None, date_to=None, sala_id=None, ciudad=None,
+                        provincia=None, artista_id=None, artista=None):
+    """
+    Builds the WHERE conditions for the supported event filters.
+
+    Each filter maps onto one of the indexes created in
+    database_schema.create_tables: dates onto eventos (fecha, id), venue
+    and city/province onto eventos (sala_id, fecha, id) through sala, and
+    artist onto eventos (artista_id, fecha, id) through artista.
+
+    Args:
+        date_from (date): First event date included
+        date_to (date): Last event date included
+        sala_id (int): Venue ID
+        ciudad (str): Venue city
+        provincia (str): Venue province
+        artista_id (int): Artist ID
+        artista (str): Artist name
+
+    Returns:
+        tuple: List of SQL conditions and list of parameters
+    """
+    conditions = []
+    params = []
+
+    if date_from is not None:
+        conditions.append("e.fecha >= %s")
+        params.append(date_from)
+    if date_to is not None:
+        conditions.append("e.fecha <= %s")
+        params.append(date_to)
+    if sala_id is not None:
+        conditions.append("e.sala_id = %s")
+        params.append(sala_id)
+    if ciudad is not None:
+        conditions.append("e.sala_id IN (SELECT id FROM sala WHERE ciudad = %s)")
+        params.append(ciudad)
+    if provincia is not None:
+        conditions.append("e.sala_id IN (SELECT id FROM sala WHERE provincia = %s)")
+        params.append(provincia)
+    if artista_id is not None:
+        conditions.append("e.artista_id = %s")
+        params.append(artista_id)
+    if artista is not None:
+        conditions.append("e.artista_id IN (SELECT id FROM artista WHERE nombre = %s)")
+        params.append(artista)
+
+    return conditions, params
+
+
+def fetch_events_page(connection, after=None, page_size=DEFAULT_PAGE_SIZE, **filters):
+    """
+    Fetches one page of events ordered by date.
+
+    Args:
+        connection: Connection to the database
+        after (tuple): Cursor (fecha, id) returned with the previous page,
+            or None for the first page
+        page_size (int): Maximum number of events in the page
+        **filters: Filters accepted by build_event_filters
+
+    Returns:
+        tuple: List of EventRow and the cursor for the next page
+            (None when there are no more pages)
+    """
+    conditions, params = build_event_filters(**filters)
+
+    if after is not None:
+        conditions.append("(e.fecha, e.id) > (%s, %s)")
+        params.extend(after)
+
+    query = EVENTS_SELECT
+    if conditions:
+        query += "WHERE " + " AND ".join(conditions) + "\n"
+    query += "ORDER BY e.fecha, e.id\nLIMIT %s"
+
+    # Ask for one extra row to know whether another page exists
+    params.append(page_size + 1)
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute(query, params)
+        rows = [EventRow(*row) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = (rows[-1].fecha, rows[-1].id)
+
+    return rows, next_cursor
+
+
+def iter_events(connection, batch_size=STREAM_BATCH_SIZE, **filters):
+    """
+    Streams events ordered by date through a server-side cursor.
+
+    Only batch_size rows are held in memory at a time, so the whole table
+    can be walked without loading it.
+
+    Args:
+        connection: Connection to the database
+        batch_size (int): Rows fetched per round-trip
+        **filters: Filters accepted by build_event_filters
+
+    Yields:
+        EventRow: Events in (fecha, id) order
+    """
+    conditions, params = build_event_filters(**filters)
+
+    query = EVENTS_SELECT
+    if conditions:
+        query += "WHERE " + " AND ".join(conditions) + "\n"
+    query += "ORDER BY e.fecha, e.id"
+
+    # Named cursors are declared on the server and fetched incrementally
+    cursor = connection.cursor(name=f"iter_events_{next(_cursor_ids)}")
+    cursor.itersize = batch_size
+    try:
+        cursor.execute(query, params)
+        for row in cursor:
+            yield EventRow(*row)
+    finally:
+        cursor.close()
+
+
+def iter_event_pages(connection, page_size=DEFAULT_PAGE_SIZE, **filters):
+    """
+    Iterates over all pages of events using keyset pagination.
+
+    Unlike iter_events, each page is an independent short query and no
+    server-side cursor is held between pages. The queries still run on the
+    caller's connection, inside its transaction (e.g. the one of
+    pool.connection()) for the whole life of the generator; use a
+    connection in autocommit mode to avoid holding a transaction open.
+
+    Args:
+        connection: Connection to the database
+        page_size (int): Maximum number of events per page
+        **filters: Filters accepted by build_event_filters
+
+    Yields:
+        list: List of EventRow for each page
+    """
+    after = None
+    while True:
+        rows, after = fetch_events_page(connection, after=after, page_size=page_size, **filters)
+        if rows:
+            yield rows
+        if after is None:
+            break
@@ -0,0 +1,301 @@
+"""
+Monthly summary tables for venue, artist and city statistics.
+
+The summary tables (created in database_schema.create_tables) hold one row
+per month and key. They are refreshed incrementally: the ingestion path only
+recomputes the months touched by a batch, and reads never scan eventos.
+"""
+
+from datetime import date
+from typing import NamedTuple
+
+
+class VenueMonthStats(NamedTuple):
+    """
+    Events held by a venue in one month.
+    """
+    sala_id: int
+    sala: str
+    mes: date
+    eventos: int
+    artistas: int
+
+
+class ArtistMonthStats(NamedTuple):
+    """
+    Touring activity of an artist in one month.
+    """
+    artista_id: int
+    artista: str
+    mes: date
+    eventos: int
+    salas: int
+    ciudades: int
+
+
+class CityMonthStats(NamedTuple):
+    """
+    Event density of a city in one month.
+    """
+    ciudad: str
+    provincia: str
+    mes: date
+    eventos: int
+    salas: int
+    artistas: int
+
+
+# Statements recomputing every summary table for the month range [%s, %s)
+REFRESH_STATEMENTS = [
+    ("stats_sala_mes", """
+    INSERT INTO stats_sala_mes (sala_id, mes, eventos, artistas)
+    SELECT e.sala_id, date_trunc('month', e.fecha)::date, COUNT(*), COUNT(DISTINCT e.artista_id)
+    FROM eventos e
+    WHERE e.fecha >= %s AND e.fecha < %s
+    GROUP BY e.sala_id, date_trunc('month', e.fecha)
+    """),
+    ("stats_artista_mes", """
+    INSERT INTO stats_artista_mes (artista_id, mes, eventos, salas, ciudades)
+    SELECT e.artista_id, date_trunc('month', e.fecha)::date, COUNT(*),
+           COUNT(DISTINCT e.sala_id), COUNT(DISTINCT s.ciudad)
+    FROM eventos e
+    JOIN sala s ON e.sala_id = s.id
+    WHERE e.fecha >= %s AND e.fecha < %s
+    GROUP BY e.artista_id, date_trunc('month', e.fecha)
+    """),
+    ("stats_ciudad_mes", """
+    INSERT INTO stats_ciudad_mes (ciudad, provincia, mes, eventos, salas, artistas)
+    SELECT COALESCE(s.ciudad, ''), COALESCE(s.provincia, ''), date_trunc('month', e.fecha)::date,
+           COUNT(*), COUNT(DISTINCT e.sala_id), COUNT(DISTINCT e.artista_id)
+    FROM eventos e
+    JOIN sala s ON e.sala_id = s.id
+    WHERE e.fecha >= %s AND e.fecha < %s
+    GROUP BY COALESCE(s.ciudad, ''), COALESCE(s.provincia, ''), date_trunc('month', e.fecha)
+    """),
+]
+
+
+def next_month(month):
+    """
+    Returns the first day of the month following the given one.
+
+    Args:
+        month (date): First day of a month
+
+    Returns:
+        date: First day of the next month
+    """
+    if month.month == 12:
+        return date(month.year + 1, 1, 1)
+    return date(month.year, month.month + 1, 1)
+
+
+def refresh_event_stats(connection, months):
+    """
+    Recomputes the summary tables for the given months only.
+
+    The refresh runs in the caller's transaction and does not commit.
+
+    Args:
+        connection: Connection to the database
+        months (iterable): Dates inside the months to refresh
+    """
+    cursor = connection.cursor()
+    try:
+        for month in sorted({date(m.year, m.month, 1) for m in months}):
+            bounds = (month, next_month(month))
+            for table, insert in REFRESH_STATEMENTS:
+                cursor.execute(f"DELETE FROM {table} WHERE mes = %s", (month,))
+                cursor.execute(insert, bounds)
+    finally:
+        cursor.close()
+
+
+def refresh_event_stats_for_events(connection, event_ids):
+    """
+    Recomputes the summary tables for the months of the given events.
+
+    This is the hook used by the ingestion path after saving a batch.
+
+    Args:
+        connection: Connection to the database
+        event_ids (iterable): IDs of the events inserted or updated
+    """
+    event_ids = [event_id for event_id in event_ids if event_id is not None]
+    if not event_ids:
+        return
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            "SELECT DISTINCT date_trunc('month', fecha)::date FROM eventos WHERE id = ANY(%s)",
+            (event_ids,)
+        )
+        months = [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+    refresh_event_stats(connection, months)
+
+
+def refresh_all_event_stats(connection):
+    """
+    Rebuilds the summary tables from scratch.
+
+    Only needed once after creating the tables or after bulk changes made
+    outside the ingestion path.
+
+    Args:
+        connection: Connection to the database
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT DISTINCT date_trunc('month', fecha)::date FROM eventos")
+        months = [row[0] for row in cursor.fetchall()]
+        for table, _ in REFRESH_STATEMENTS:
+            cursor.execute(f"DELETE FROM {table}")
+    finally:
+        cursor.close()
+
+    refresh_event_stats(connection, months)
+
+
+def _fetch(connection, query, params, row_type):
+    """
+    Runs a summary query and wraps the rows in the given type.
+
+    Args:
+        connection: Connection to the database
+        query (str): SQL query
+        params (list): Query parameters
+        row_type (type): NamedTuple used for the rows
+
+    Returns:
+        list: Rows of row_type
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute(query, params)
+        return [row_type(*row) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def _month_conditions(alias, date_from, date_to):
+    """
+    Builds month range conditions on a summary table.
+
+    Args:
+        alias (str): Alias of the summary table in the query
+        date_from (date): First date included
+        date_to (date): Last date included
+
+    Returns:
+        tuple: List of SQL conditions and list of parameters
+    """
+    conditions = []
+    params = []
+    if date_from is not None:
+        conditions.append(f"{alias}.mes >= %s")
+        params.append(date(date_from.year, date_from.month, 1))
+    if date_to is not None:
+        conditions.append(f"{alias}.mes <= %s")
+        params.append(date_to)
+    return conditions, params
+
+
+def _where(conditions):
+    """
+    Joins SQL conditions into a WHERE clause.
+
+    Args:
+        conditions (list): SQL conditions
+
+    Returns:
+        str: WHERE clause, or an empty string without conditions
+    """
+    return "WHERE " + " AND ".join(conditions) + "\n" if conditions else ""
+
+
+def get_venue_monthly_stats(connection, sala_id=None, date_from=None, date_to=None):
+    """
+    Gets the number of events per venue and month.
+
+    Args:
+        connection: Connection to the database
+        sala_id (int): Restrict to one venue
+        date_from (date): First date included
+        date_to (date): Last date included
+
+    Returns:
+        list: VenueMonthStats rows ordered by venue and month
+    """
+    conditions, params = _month_conditions("st", date_from, date_to)
+    if sala_id is not None:
+        conditions.append("st.sala_id = %s")
+        params.append(sala_id)
+
+    query = f"""
+    SELECT st.sala_id, s.nombre, st.mes, st.eventos, st.artistas
+    FROM stats_sala_mes st
+    JOIN sala s ON st.sala_id = s.id
+    {_where(conditions)}ORDER BY st.sala_id, st.mes
+    """
+    return _fetch(connection, query, params, VenueMonthStats)
+
+
+def get_artist_touring_stats(connection, artista_id=None, date_from=None, date_to=None):
+    """
+    Gets the touring frequency of artists per month.
+
+    Args:
+        connection: Connection to the database
+        artista_id (int): Restrict to one artist
+        date_from (date): First date included
+        date_to (date): Last date included
+
+    Returns:
+        list: ArtistMonthStats rows ordered by artist and month
+    """
+    conditions, params = _month_conditions("st", date_from, date_to)
+    if artista_id is not None:
+        conditions.append("st.artista_id = %s")
+        params.append(artista_id)
+
+    query = f"""
+    SELECT st.artista_id, a.nombre, st.mes, st.eventos, st.salas, st.ciudades
+    FROM stats_artista_mes st
+    JOIN artista a ON st.artista_id = a.id
+    {_where(conditions)}ORDER BY st.artista_id, st.mes
+    """
+    return _fetch(connection, query, params, ArtistMonthStats)
+
+
+def get_city_density(connection, ciudad=None, provincia=None, date_from=None, date_to=None):
+    """
+    Gets the number of events, venues and artists per city and month.
+
+    Args:
+        connection: Connection to the database
+        ciudad (str): Restrict to one city
+        provincia (str): Restrict to one province
+        date_from (date): First date included
+        date_to (date): Last date included
+
+    Returns:
+        list: CityMonthStats rows ordered by month, busiest cities first
+    """
+    conditions, params = _month_conditions("st", date_from, date_to)
+    if ciudad is not None:
+        conditions.append("st.ciudad = %s")
+        params.append(ciudad)
+    if provincia is not None:
+        conditions.append("st.provincia = %s")
+        params.append(provincia)
+
+    query = f"""
+    SELECT st.ciudad, st.provincia, st.mes, st.eventos, st.salas, st.artistas
+    FROM stats_ciudad_mes st
+    {_where(conditions)}ORDER BY st.mes, st.eventos DESC
+    """
+    return _fetch(connection, query, params, CityMonthStats)
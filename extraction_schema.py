@@ -0,0 +1,249 @@
+"""
+Validation of the extraction returned by the Dify workflow.
+
+The workflow should return {"artistas": [...], "fecha": [...], "ubicacion": [...]},
+but LLM output often comes wrapped in a Markdown code fence, with trailing
+commas, with a single string where a list is expected or with "artista"
+instead of "artistas". These cheap defects are repaired locally; only output
+that cannot be turned into a valid extraction is rejected, so that the
+caller can re-ask the workflow.
+"""
+
+import json
+import re
+
+from metrics import REGISTRY
+
+# Fields of the extraction; every value is a list of strings
+EXTRACTION_FIELDS = ("artistas", "fecha", "ubicacion")
+
+# Alternative keys the model uses for each field
+FIELD_ALIASES = {
+    "artista": "artistas",
+    "artists": "artistas",
+    "fechas": "fecha",
+    "date": "fecha",
+    "dates": "fecha",
+    "ubicaciones": "ubicacion",
+    "lugar": "ubicacion",
+    "sala": "ubicacion",
+    "venue": "ubicacion",
+}
+
+# Keys under which the workflow may nest the extraction
+WRAPPER_KEYS = ("result", "output", "text")
+
+_CODE_FENCE = re.compile(r"^\s*```[a-zA-Z]*\s*\n?(.*?)\n?\s*```\s*$", re.DOTALL)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+EXTRACTION_REPAIRS = REGISTRY.counter(
+    "extraction_repairs_total", "Workflow outputs fixed locally, by kind of repair", ("repair",)
+)
+EXTRACTION_INVALID = REGISTRY.counter(
+    "extraction_invalid_total", "Workflow outputs that could not be repaired"
+)
+EXTRACTION_REASKS = REGISTRY.counter(
+    "extraction_reasks_total", "Workflow runs repeated because the output could not be repaired"
+)
+BATCH_SPLITS = REGISTRY.counter(
+    "extraction_batch_splits_total", "Batched workflow runs split because some posts came back invalid"
+)
+
+
+class ExtractionError(ValueError):
+    """
+    Raised when the workflow output is not a valid extraction.
+    """
+
+
+def _loads(text, repairs):
+    """
+    Parses JSON text, repairing code fences, surrounding prose and trailing commas.
+
+    Args:
+        text (str): Text returned by the model
+        repairs (list): Names of the repairs applied (appended to)
+
+    Returns:
+        object: Parsed JSON value
+
+    Raises:
+        ExtractionError: If the text is not JSON even after the repairs
+    """
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+
+    fenced = _CODE_FENCE.match(text)
+    if fenced:
+        text = fenced.group(1)
+        repairs.append("code_fence")
+
+    # Keep only the outermost object if the model added prose around it
+    text = text.strip()
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end < start:
+        raise ExtractionError("No JSON object in the output")
+    if start > 0 or end < len(text) - 1:
+        text = text[start:end + 1]
+        repairs.append("surrounding_text")
+
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+
+    repaired = _TRAILING_COMMA.sub(r"\1", text)
+    if repaired != text:
+        repairs.append("trailing_comma")
+    try:
+        return json.loads(repaired)
+    except ValueError as e:
+        raise ExtractionError(f"Invalid JSON: {e}") from e
+
+
+def _as_string_list(value, field, repairs):
+    """
+    Coerces a field value into a list of non-empty strings.
+
+    Args:
+        value: Value returned by the model
+        field (str): Field name (for error messages)
+        repairs (list): Names of the repairs applied (appended to)
+
+    Returns:
+        list: Strings of the field
+
+    Raises:
+        ExtractionError: If the value has an unusable type
+    """
+    if value is None:
+        return []
+    if isinstance(value, (str, int, float)):
+        repairs.append("scalar_to_list")
+        value = [value]
+    if not isinstance(value, list):
+        raise ExtractionError(f"'{field}' must be a list, got {type(value).__name__}")
+
+    items = []
+    for item in value:
+        if isinstance(item, (int, float)) and not isinstance(item, bool):
+            item = str(item)
+        if not isinstance(item, str):
+            raise ExtractionError(f"'{field}' must hold strings, got {type(item).__name__}")
+        item = item.strip()
+        if item:
+            items.append(item)
+    return items
+
+
+def parse_extraction(raw):
+    """
+    Validates the workflow output, repairing cheap defects.
+
+    Args:
+        raw: outputs of the workflow, the value of one of its keys, or JSON text
+
+    Returns:
+        tuple: (extraction, repairs) where extraction has exactly the
+            EXTRACTION_FIELDS as lists of strings and repairs lists the fixes applied
+
+    Raises:
+        ExtractionError: If the output cannot be turned into a valid extraction
+    """
+    repairs = []
+    try:
+        value = raw
+        for _ in range(3):
+            if isinstance(value, str):
+                value = _loads(value, repairs)
+            if not isinstance(value, dict):
+                raise ExtractionError(f"Expected a JSON object, got {type(value).__name__}")
+
+            # Unwrap {"result": ...} as returned by the workflow end node
+            fields = {FIELD_ALIASES.get(key, key) for key in value}
+            wrapper = next((key for key in WRAPPER_KEYS if key in value), None)
+            if not fields & set(EXTRACTION_FIELDS) and wrapper:
+                value = value[wrapper]
+                continue
+            break
+        if not isinstance(value, dict):
+            raise ExtractionError(f"Expected a JSON object, got {type(value).__name__}")
+
+        extraction = {}
+        for key, item in value.items():
+            field = FIELD_ALIASES.get(key, key)
+            if field not in EXTRACTION_FIELDS:
+                continue
+            if field != key:
+                repairs.append("renamed_field")
+            extraction.setdefault(field, []).extend(_as_string_list(item, field, repairs))
+
+        if not extraction:
+            raise ExtractionError(f"None of the fields {EXTRACTION_FIELDS} in the output")
+        for field in EXTRACTION_FIELDS:
+            if field not in extraction:
+                repairs.append("missing_field")
+                extraction[field] = []
+    except ExtractionError:
+        EXTRACTION_INVALID.inc()
+        raise
+
+    for repair in repairs:
+        EXTRACTION_REPAIRS.inc(repair=repair)
+    return {field: extraction[field] for field in EXTRACTION_FIELDS}, repairs
+
+
+def parse_batch_extraction(raw, post_ids):
+    """
+    Validates the output of a batched workflow run and splits it per post.
+
+    The batched workflow returns {"results": [{"id": ..., "artistas": [...],
+    "fecha": [...], "ubicacion": [...]}, ...]} (as JSON text or as a list),
+    or an object keyed by post id. Items that are missing, unknown or invalid
+    are left out so that the caller can retry only those posts.
+
+    Args:
+        raw: outputs of the batched workflow, or JSON text
+        post_ids (list): IDs of the posts sent in the batch
+
+    Returns:
+        dict: Extraction per post id (as str) for the items that validated
+
+    Raises:
+        ExtractionError: If the output is not a batch at all
+    """
+    expected = {str(post_id) for post_id in post_ids}
+
+    value = raw
+    if isinstance(value, dict) and "results" in value:
+        value = value["results"]
+    if isinstance(value, str):
+        text = value.strip()
+        fenced = _CODE_FENCE.match(text)
+        if fenced:
+            text = fenced.group(1).strip()
+        try:
+            value = json.loads(_TRAILING_COMMA.sub(r"\1", text))
+        except ValueError as e:
+            EXTRACTION_INVALID.inc()
+            raise ExtractionError(f"Invalid batch JSON: {e}") from e
+
+    # Accept an object keyed by post id as well as a list of items
+    if isinstance(value, dict):
+        value = [dict(item, id=key) if isinstance(item, dict) else item for key, item in value.items()]
+    if not isinstance(value, list):
+        EXTRACTION_INVALID.inc()
+        raise ExtractionError(f"Expected a list of results, got {type(value).__name__}")
+
+    results = {}
+    for item in value:
+        if not isinstance(item, dict) or str(item.get("id")) not in expected:
+            continue
+        try:
+            extraction, _ = parse_extraction({k: v for k, v in item.items() if k != "id"})
+        except ExtractionError:
+            continue
+        results.setdefault(str(item["id"]), extraction)
+    return results
@@ -0,0 +1,490 @@
+"""
+Long-running ingestion service for ACCES venues.
+
+Polls every venue through the Meta connector, sends new posts through the
+Dify extraction and saves the results in the database. Each venue has its own
+polling interval, derived from how often it posts, and all the work runs
+within a fixed budget of workers. Health and metrics are served locally over
+HTTP.
+"""
+
+import argparse
+import asyncio
+import heapq
+import json
+import logging
+import signal
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from meta_api_connector import authenticate_with_meta, get_acces_venues, get_posts_from_venue, download_image
+from evaluation import connect_to_db, process_post, save_results_to_db
+from db_pool import close_all_pools
+from metrics import REGISTRY
+from log_config import setup_logging, add_logging_arguments
+from caption_filter import CaptionFilter, add_prefilter_arguments
+
+logger = logging.getLogger(__name__)
+
+# ==========================
+# DAEMON CONFIGURATION
+# ==========================
+# Number of venues processed at the same time
+WORKER_BUDGET = 4
+
+# Bounds of the polling interval of a venue (seconds)
+POLL_MIN_INTERVAL = 5 * 60
+POLL_MAX_INTERVAL = 24 * 60 * 60
+POLL_DEFAULT_INTERVAL = 60 * 60
+
+# Expected number of new posts per poll used to derive the interval
+POLL_TARGET_NEW_POSTS = 1.0
+
+# Weight of the latest observation in the posting rate estimate
+POLL_RATE_SMOOTHING = 0.3
+
+# Post IDs remembered per venue to detect new posts
+SEEN_POSTS_PER_VENUE = 500
+
+# Local address of the health/metrics endpoint
+HEALTH_HOST = "127.0.0.1"
+HEALTH_PORT = 8765
+# ==========================
+
+
+def parse_post_time(post):
+    """
+    Gets the publication time of a post.
+
+    Args:
+        post (dict): Post returned by the Meta connector
+
+    Returns:
+        datetime: Publication time, or None if it cannot be parsed
+    """
+    value = post.get("created_time") or post.get("date")
+    if not value:
+        return None
+    for fmt in ("%Y-%m-%dT%H:%M:%S%z", "%Y-%m-%d", "%d-%m-%Y"):
+        try:
+            return datetime.strptime(value, fmt).replace(tzinfo=None)
+        except ValueError:
+            continue
+    return None
+
+
+def fetch_venue_posts(venue_id):
+    """
+    Gets the posts of a venue with the current access token.
+
+    The token is looked up on every poll, so tokens replaced by the
+    background refresher of the token manager are picked up.
+
+    Args:
+        venue_id (str): Venue ID in Meta
+
+    Returns:
+        list: Posts of the venue
+    """
+    return get_posts_from_venue(venue_id, authenticate_with_meta())
+
+
+class VenueSchedule:
+    """
+    Polling state of one venue.
+
+    The interval is the time in which the venue is expected to publish
+    POLL_TARGET_NEW_POSTS new posts, so active venues are polled often and
+    idle ones rarely.
+    """
+
+    def __init__(self, venue):
+        self.venue = venue
+        self.interval = POLL_DEFAULT_INTERVAL
+        self.next_poll = time.monotonic()
+        self.posts_per_second = None
+        self.seen = deque(maxlen=SEEN_POSTS_PER_VENUE)
+        self.seen_ids = set()
+        self.polls = 0
+        self.errors = 0
+        self.last_poll = None
+
+    def remember(self, post_id):
+        """
+        Marks a post as already processed.
+
+        Args:
+            post_id (str): Post ID
+        """
+        if len(self.seen) == self.seen.maxlen:
+            self.seen_ids.discard(self.seen[0])
+        self.seen.append(post_id)
+        self.seen_ids.add(post_id)
+
+    def update_rate(self, posts, new_posts, elapsed):
+        """
+        Updates the posting rate estimate after a poll.
+
+        On the first poll the rate comes from the publication times of the
+        returned posts; afterwards, from the number of new posts found since
+        the previous poll.
+
+        Args:
+            posts (list): Posts returned by the poll
+            new_posts (int): Number of posts not seen before
+            elapsed (float): Seconds since the previous poll (None on the first one)
+        """
+        if elapsed is None:
+            times = sorted(t for t in (parse_post_time(post) for post in posts) if t)
+            if len(times) < 2:
+                return
+            span = (times[-1] - times[0]).total_seconds()
+            if span <= 0:
+                return
+            observed = (len(times) - 1) / span
+        else:
+            observed = new_posts / max(elapsed, 1.0)
+
+        if self.posts_per_second is None:
+            self.posts_per_second = observed
+        else:
+            self.posts_per_second = (
+                POLL_RATE_SMOOTHING * observed
+                + (1 - POLL_RATE_SMOOTHING) * self.posts_per_second
+            )
+
+    def schedule_next(self, now):
+        """
+        Computes the interval and the time of the next poll.
+
+        Args:
+            now (float): Current monotonic time
+        """
+        if self.posts_per_second:
+            interval = POLL_TARGET_NEW_POSTS / self.posts_per_second
+        else:
+            # Nothing published recently: back off towards the maximum
+            interval = self.interval * 2
+        self.interval = min(max(interval, POLL_MIN_INTERVAL), POLL_MAX_INTERVAL)
+        self.next_poll = now + self.interval
+
+
+class IngestionDaemon:
+    """
+    Asyncio service that schedules venue polls over a fixed worker budget.
+    """
+
+    def __init__(self, workers=WORKER_BUDGET, host=HEALTH_HOST, port=HEALTH_PORT, caption_filter=None):
+        self.workers = workers
+        self.caption_filter = caption_filter
+        self.host = host
+        self.port = port
+        self.schedules = {}
+        self.queue = asyncio.Queue()
+        self.heap = []
+        self.wakeup = asyncio.Event()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingestion")
+        self.stopping = asyncio.Event()
+        self.started_at = time.time()
+        self.pool = None
+        self.counters = {
+            name: REGISTRY.counter(f"ingestion_{name}", description)
+            for name, description in (
+                ("polls_total", "Venue polls started"),
+                ("poll_errors_total", "Venue polls that failed"),
+                ("posts_seen_total", "New posts found"),
+                ("posts_processed_total", "Posts sent through the extraction"),
+                ("posts_saved_total", "Posts whose results were saved"),
+                ("post_errors_total", "Posts that failed and will be retried"),
+            )
+        }
+
+    async def run_blocking(self, function, *args):
+        """
+        Runs a blocking function on the worker thread pool.
+
+        Args:
+            function (callable): Function to run
+            *args: Arguments of the function
+
+        Returns:
+            Result of the function
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, function, *args)
+
+    def process_new_post(self, venue, post):
+        """
+        Extracts and saves a single post. Runs on a worker thread.
+
+        Args:
+            venue (dict): Venue that published the post
+            post (dict): Post returned by the Meta connector
+
+        Returns:
+            bool: True if results were saved to the database, False if the
+                post was skipped on purpose
+
+        Raises:
+            RuntimeError: If the post could not be extracted or saved, so
+                that it is retried on the next poll
+        """
+        post["venue_id"] = venue["id"]
+
+        # Posts that do not look like announcements skip the image download and the workflow
+        if self.caption_filter and not self.caption_filter.should_extract(post):
+            logger.debug("Post %s skipped by the caption pre-filter", post["id"], extra={"per_item": True})
+            return False
+
+        if post.get("image_url"):
+            post["image_path"] = download_image(post["image_url"], f"img/{post['id']}.jpg")
+
+        output = process_post(post, post_id=post["id"])
+        if not isinstance(output, dict):
+            raise RuntimeError(f"Post {post['id']} could not be extracted")
+
+        if self.pool is None:
+            return False
+
+        with self.pool.connection() as connection:
+            if save_results_to_db(connection, output, post) is None:
+                raise RuntimeError(f"Could not save the results of post {post['id']}")
+        return True
+
+    async def poll_venue(self, schedule):
+        """
+        Polls one venue and processes its new posts.
+
+        Args:
+            schedule (VenueSchedule): Schedule of the venue
+        """
+        venue = schedule.venue
+        now = time.monotonic()
+        elapsed = None if schedule.last_poll is None else now - schedule.last_poll
+        schedule.last_poll = now
+        schedule.polls += 1
+        self.counters["polls_total"].inc()
+
+        try:
+            posts = await self.run_blocking(fetch_venue_posts, venue["id"])
+        except Exception as e:
+            logger.warning("Error polling venue %s: %s", venue["name"], e)
+            schedule.errors += 1
+            self.counters["poll_errors_total"].inc()
+            schedule.schedule_next(time.monotonic())
+            return
+
+        new_posts = [post for post in posts if post["id"] not in schedule.seen_ids]
+        self.counters["posts_seen_total"].inc(len(new_posts))
+
+        for post in new_posts:
+            try:
+                saved = await self.run_blocking(self.process_new_post, venue, post)
+                self.counters["posts_processed_total"].inc()
+                if saved:
+                    self.counters["posts_saved_total"].inc()
+                schedule.remember(post["id"])
+            except Exception as e:
+                # Not remembered, so the post is retried on the next poll
+                logger.warning("Error processing post %s of %s: %s", post["id"], venue["name"], e)
+                self.counters["post_errors_total"].inc()
+
+        schedule.update_rate(posts, len(new_posts), elapsed)
+        schedule.schedule_next(time.monotonic())
+        logger.info(
+            "Polled %s: %d new posts, next poll in %.0fs", venue["name"], len(new_posts), schedule.interval,
+            extra={"venue_id": venue["id"], "new_posts": len(new_posts), "interval_seconds": round(schedule.interval)}
+        )
+
+    async def worker(self):
+        """
+        Takes due venues from the queue, polls them and schedules them again.
+        """
+        while True:
+            schedule = await self.queue.get()
+            try:
+                await self.poll_venue(schedule)
+            finally:
+                heapq.heappush(self.heap, (schedule.next_poll, schedule.venue["id"]))
+                self.wakeup.set()
+                self.queue.task_done()
+
+    async def scheduler(self):
+        """
+        Queues every venue when its next poll is due.
+
+        A venue is only in the heap while it is not being polled, so it is
+        never queued twice.
+        """
+        while not self.stopping.is_set():
+            now = time.monotonic()
+            while self.heap and self.heap[0][0] <= now:
+                _, venue_id = heapq.heappop(self.heap)
+                await self.queue.put(self.schedules[venue_id])
+
+            timeout = self.heap[0][0] - now if self.heap else POLL_MAX_INTERVAL
+            self.wakeup.clear()
+            waiters = [asyncio.ensure_future(self.stopping.wait()), asyncio.ensure_future(self.wakeup.wait())]
+            await asyncio.wait(waiters, timeout=max(timeout, 0.05), return_when=asyncio.FIRST_COMPLETED)
+            for waiter in waiters:
+                waiter.cancel()
+
+    def health(self):
+        """
+        Builds the health report.
+
+        Returns:
+            dict: Service status, uptime and per-venue schedule
+        """
+        now = time.monotonic()
+        return {
+            "status": "stopping" if self.stopping.is_set() else "ok",
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "workers": self.workers,
+            "queued": self.queue.qsize(),
+            "venues": [
+                {
+                    "id": schedule.venue["id"],
+                    "name": schedule.venue["name"],
+                    "interval_seconds": round(schedule.interval),
+                    "next_poll_in_seconds": round(max(schedule.next_poll - now, 0)),
+                    "polls": schedule.polls,
+                    "errors": schedule.errors,
+                }
+                for schedule in self.schedules.values()
+            ],
+        }
+
+    def metrics(self):
+        """
+        Builds the metrics in Prometheus text format.
+
+        Includes the daemon counters and the pipeline stage latencies of the
+        shared metrics registry.
+
+        Returns:
+            str: Metrics exposition
+        """
+        lines = [REGISTRY.render().rstrip("\n")]
+        lines.append("# TYPE ingestion_poll_interval_seconds gauge")
+        for schedule in self.schedules.values():
+            lines.append(f'ingestion_poll_interval_seconds{{venue="{schedule.venue["id"]}"}} {schedule.interval:.0f}')
+        lines.append("# TYPE ingestion_queue_size gauge")
+        lines.append(f"ingestion_queue_size {self.queue.qsize()}")
+        return "\n".join(lines) + "\n"
+
+    async def handle_http(self, reader, writer):
+        """
+        Serves GET /health and GET /metrics.
+
+        Args:
+            reader (asyncio.StreamReader): Request stream
+            writer (asyncio.StreamWriter): Response stream
+        """
+        try:
+            request_line = await reader.readline()
+            # Skip the request headers
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+
+            parts = request_line.decode("latin-1").split()
+            path = parts[1] if len(parts) > 1 else "/"
+
+            if path == "/health":
+                status, content_type, body = "200 OK", "application/json", json.dumps(self.health())
+            elif path == "/metrics":
+                status, content_type, body = "200 OK", "text/plain; version=0.0.4", self.metrics()
+            else:
+                status, content_type, body = "404 Not Found", "text/plain", "Not found\n"
+
+            payload = body.encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode("latin-1")
+                + payload
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    def stop(self):
+        """
+        Asks the service to stop after the polls in progress.
+        """
+        logger.info("Stopping ingestion daemon...")
+        self.stopping.set()
+
+    async def run(self):
+        """
+        Runs the service until stop() is called.
+        """
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except NotImplementedError:
+                pass
+
+        # Fail early if Meta rejects the credentials
+        await self.run_blocking(authenticate_with_meta)
+        self.pool = connect_to_db()
+        for venue in get_acces_venues():
+            schedule = VenueSchedule(venue)
+            self.schedules[venue["id"]] = schedule
+            heapq.heappush(self.heap, (schedule.next_poll, venue["id"]))
+
+        server = await asyncio.start_server(self.handle_http, self.host, self.port)
+        logger.info("Health and metrics available at http://%s:%d/health and /metrics", self.host, self.port)
+
+        workers = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+        logger.info("Ingestion daemon started: %d venues, %d workers", len(self.schedules), self.workers)
+
+        try:
+            await self.scheduler()
+            # Let the polls already queued finish
+            await self.queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            server.close()
+            await server.wait_closed()
+            self.executor.shutdown(wait=True)
+            if self.pool:
+                close_all_pools()
+            logger.info("Ingestion daemon stopped")
+
+
+def parse_arguments():
+    """
+    Configures and processes command line arguments of the daemon.
+
+    Returns:
+        argparse.Namespace: Object with the processed arguments
+    """
+    parser = argparse.ArgumentParser(description='Continuous ingestion of ACCES venue posts')
+    parser.add_argument('--workers', type=int, default=WORKER_BUDGET,
+                    help=f'Venues processed at the same time (default: {WORKER_BUDGET})')
+    parser.add_argument('--host', type=str, default=HEALTH_HOST,
+                    help=f'Address of the health/metrics endpoint (default: {HEALTH_HOST})')
+    parser.add_argument('--port', type=int, default=HEALTH_PORT,
+                    help=f'Port of the health/metrics endpoint (default: {HEALTH_PORT})')
+    parser.add_argument('--min-interval', type=float, default=POLL_MIN_INTERVAL,
+                    help=f'Minimum seconds between polls of a venue (default: {POLL_MIN_INTERVAL})')
+    parser.add_argument('--max-interval', type=float, default=POLL_MAX_INTERVAL,
+                    help=f'Maximum seconds between polls of a venue (default: {POLL_MAX_INTERVAL})')
+    add_prefilter_arguments(parser)
+    add_logging_arguments(parser)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    setup_logging(level=args.log_level, log_format=args.log_format, quiet=args.quiet)
+    POLL_MIN_INTERVAL = args.min_interval
+    POLL_MAX_INTERVAL = args.max_interval
+    caption_filter = None
+    if args.prefilter_threshold is not None:
+        caption_filter = CaptionFilter.load(args.prefilter_model, threshold=args.prefilter_threshold)
+    asyncio.run(IngestionDaemon(workers=args.workers, host=args.host, port=args.port, caption_filter=caption_filter).run())
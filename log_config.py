@@ -0,0 +1,174 @@
+"""
+Logging setup shared by every script of the system.
+
+Library modules only create their logger with logging.getLogger(__name__) and
+log with lazy %-style arguments. The entry points call setup_logging(), which
+routes every record through a queue to a background thread, so the caller
+never blocks on stdout/stderr. Records are emitted as one JSON object per line
+(or as plain text for local debugging). Per-item debug messages can be
+sampled, and quiet mode only lets warnings and errors through.
+
+Environment variables LOG_LEVEL, LOG_FORMAT (json/text), LOG_QUIET (1) and
+LOG_SAMPLE_RATE provide the defaults of setup_logging().
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+
+# Default configuration (overridable with environment variables)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+LOG_QUIET = os.environ.get("LOG_QUIET", "0") == "1"
+
+# Fraction of per-item debug records that are kept
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.1"))
+
+# Maximum records waiting in the queue; beyond it new records are dropped
+LOG_QUEUE_SIZE = 10000
+
+# Attributes present in every LogRecord, not emitted as extra fields
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+# Listener draining the queue, started by setup_logging
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as single-line JSON objects.
+
+    Fields passed with extra={...} are added to the object.
+    """
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and key != "per_item":
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps one out of every N per-item debug records.
+
+    Records are marked as per-item with extra={"per_item": True}; every
+    other record passes untouched.
+    """
+
+    def __init__(self, rate=LOG_SAMPLE_RATE):
+        super().__init__()
+        self.every = max(1, round(1 / rate)) if rate > 0 else 0
+        self.seen = 0
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if not getattr(record, "per_item", False) or record.levelno > logging.DEBUG:
+            return True
+        if not self.every:
+            return False
+        with self.lock:
+            self.seen += 1
+            return self.seen % self.every == 1 or self.every == 1
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that drops records instead of blocking when the queue is full.
+    """
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+def setup_logging(level=None, log_format=None, quiet=None, sample_rate=None, stream=None):
+    """
+    Configures the root logger with a non-blocking queue handler.
+
+    Calling it again replaces the previous configuration.
+
+    Args:
+        level (str): Minimum level (default: LOG_LEVEL)
+        log_format (str): "json" or "text" (default: LOG_FORMAT)
+        quiet (bool): Only emit warnings and errors (default: LOG_QUIET)
+        sample_rate (float): Fraction of per-item debug records kept (default: LOG_SAMPLE_RATE)
+        stream: Output stream (default: sys.stderr)
+    """
+    global _listener
+
+    level = level or LOG_LEVEL
+    log_format = log_format or LOG_FORMAT
+    quiet = LOG_QUIET if quiet is None else quiet
+    sample_rate = LOG_SAMPLE_RATE if sample_rate is None else sample_rate
+
+    if _listener is not None:
+        _listener.stop()
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    if log_format == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    # Filtering happens before the record is queued, so dropped records are never formatted
+    records = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    handler = DroppingQueueHandler(records)
+    handler.addFilter(SamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(logging.WARNING if quiet else level.upper())
+
+    # Third-party clients are only interesting when something goes wrong
+    for noisy in ("urllib3", "httpx", "langfuse"):
+        logging.getLogger(noisy).setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """
+    Flushes the pending records and stops the background thread.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
+
+
+def add_logging_arguments(parser):
+    """
+    Adds the common logging options to a command line parser.
+
+    Args:
+        parser (argparse.ArgumentParser): Parser of the script
+    """
+    parser.add_argument('--log-level', type=str, default=LOG_LEVEL,
+                    help=f'Minimum log level (default: {LOG_LEVEL})')
+    parser.add_argument('--log-format', choices=['json', 'text'], default=LOG_FORMAT,
+                    help=f'Log output format (default: {LOG_FORMAT})')
+    parser.add_argument('--quiet', action='store_true', default=LOG_QUIET,
+                    help='Production mode: only log warnings and errors')
@@ -5,41 +5,227 @@ Page Public Content Access.
 """
 
 import json
+import logging
+import os
+import threading
 import requests
 from datetime import datetime
+from urllib.parse import urlencode
+
+from metrics import REGISTRY, timed, stage_timer
+from rate_limiter import RateLimiter, throttle_error_code
+from token_manager import TokenManager
+from log_config import setup_logging
+
+logger = logging.getLogger(__name__)
 
 # Meta API Configuration
 META_API_KEY = "YOUR_META_API_KEY"
 META_API_SECRET = "YOUR_META_API_SECRET"
 META_API_BASE_URL = "https://graph.facebook.com/v18.0"
 
-def authenticate_with_meta():
+# Long-lived user token of a page admin, exchanged for page tokens (optional)
+META_USER_ACCESS_TOKEN = os.environ.get("META_USER_ACCESS_TOKEN")
+
+# When True, the connector returns the sample data below instead of calling the API
+META_API_SIMULATED = True
+
+# Timeout of the requests to the Meta API (seconds)
+META_API_TIMEOUT = 10
+
+# Fields requested for each post; attachments are projected down to the image URL
+META_POST_FIELDS = "id,message,created_time,attachments{media{image{src}}}"
+
+# Maximum sub-requests per Graph API batch call (limit set by Meta)
+META_BATCH_SIZE = 50
+
+# Headers where Meta reports the quota used, as percentages
+META_USAGE_HEADERS = ("X-App-Usage", "X-Business-Use-Case-Usage")
+
+META_API_CALLS = REGISTRY.counter(
+    "meta_api_calls_total", "HTTP calls made to the Graph API", ("endpoint",)
+)
+META_API_SUBREQUESTS = REGISTRY.counter(
+    "meta_api_batch_subrequests_total", "Sub-requests sent inside Graph API batch calls, by status code", ("status",)
+)
+
+# Attempts of a Graph API call rejected for exceeding the rate limits
+META_THROTTLE_RETRIES = 3
+
+# Pacing shared by every thread that calls the Graph API
+META_RATE_LIMITER = RateLimiter()
+
+# Access tokens cached on disk and shared by every crawler process
+TOKEN_MANAGER = TokenManager()
+
+# Last quota usage reported by Meta, per header
+_api_usage = {}
+_api_usage_lock = threading.Lock()
+
+def record_api_usage(response, endpoint):
     """
-    Pseudocode for authenticating with the Meta API.
+    Counts a Graph API call and keeps the quota usage reported in its headers.
     
+    Args:
+        response (requests.Response): Response of the call
+        endpoint (str): Name of the endpoint, used as metric label
+    """
+    META_API_CALLS.inc(endpoint=endpoint)
+    for header in META_USAGE_HEADERS:
+        value = response.headers.get(header)
+        if not value:
+            continue
+        try:
+            usage = json.loads(value)
+        except ValueError:
+            logger.debug("Unreadable %s header: %s", header, value)
+            continue
+        with _api_usage_lock:
+            _api_usage[header] = usage
+        logger.debug("Meta API usage (%s): %s", header, usage, extra={"per_item": True})
+    META_RATE_LIMITER.update(response.headers)
+
+def graph_request(method, url, endpoint, cost=1, **kwargs):
+    """
+    Makes a Graph API call paced by the shared rate limiter.
+    
+    Calls rejected for exceeding the rate limits pause the limiter and are
+    retried once it lets calls through again, up to META_THROTTLE_RETRIES times.
+    
+    Args:
+        method (str): HTTP method
+        url (str): URL of the call
+        endpoint (str): Name of the endpoint, used as metric label
+        cost (int): Calls counted by Meta (the sub-requests of a batch)
+        **kwargs: Arguments for requests.request
+        
     Returns:
-        str: Access token for the Meta API
+        requests.Response: Response of the call (the last one if it kept being throttled)
+    """
+    for attempt in range(META_THROTTLE_RETRIES):
+        META_RATE_LIMITER.acquire(cost)
+        response = requests.request(method, url, timeout=META_API_TIMEOUT, **kwargs)
+        record_api_usage(response, endpoint)
+        if response.ok:
+            return response
+        try:
+            code = throttle_error_code(response.json())
+        except ValueError:
+            code = None
+        if code is None:
+            return response
+        logger.warning("Graph API call throttled (code %s, attempt %d)", code, attempt + 1)
+        META_RATE_LIMITER.throttled(response.headers, code)
+    return response
+
+def get_api_usage():
     """
-    # In a real case, OAuth authentication would be done here
-    # and an access token would be obtained
-    print("Authenticating with the Meta API...")
+    Gets the calls made so far and the last quota usage reported by Meta.
     
-    # Pseudocode for authentication
+    Returns:
+        dict: calls per endpoint, batch sub-requests per status and the last
+            value of each usage header
+    """
+    snapshot = REGISTRY.snapshot()
+    with _api_usage_lock:
+        usage = dict(_api_usage)
+    return {
+        "calls": snapshot.get("meta_api_calls_total", {}),
+        "batch_subrequests": snapshot.get("meta_api_batch_subrequests_total", {}),
+        "usage": usage,
+    }
+
+def _request_app_token():
+    """
+    Requests an app access token from Meta.
+    
+    Returns:
+        tuple: (access token, seconds until it expires or None if it does not)
+    """
+    logger.info("Authenticating with the Meta API...")
     auth_data = {
         "client_id": META_API_KEY,
         "client_secret": META_API_SECRET,
         "grant_type": "client_credentials"
     }
+    response = graph_request("POST", f"{META_API_BASE_URL}/oauth/access_token", "oauth", data=auth_data)
+    response.raise_for_status()
+    payload = response.json()
+    return payload["access_token"], payload.get("expires_in")
+
+def _request_user_token():
+    """
+    Exchanges META_USER_ACCESS_TOKEN for a long-lived user token (about 60 days).
+    
+    Returns:
+        tuple: (access token, seconds until it expires or None if it does not)
+    """
+    response = graph_request(
+        "GET",
+        f"{META_API_BASE_URL}/oauth/access_token",
+        "oauth",
+        params={
+            "grant_type": "fb_exchange_token",
+            "client_id": META_API_KEY,
+            "client_secret": META_API_SECRET,
+            "fb_exchange_token": META_USER_ACCESS_TOKEN
+        }
+    )
+    response.raise_for_status()
+    payload = response.json()
+    return payload["access_token"], payload.get("expires_in")
+
+def authenticate_with_meta():
+    """
+    Gets the app access token for the Meta API.
     
-    # In a real case, a POST request would be made to the Meta API here
-    # response = requests.post(f"{META_API_BASE_URL}/oauth/access_token", data=auth_data)
-    # access_token = response.json()["access_token"]
+    The token comes from the disk cache shared with other crawler processes
+    and is only requested from Meta when it is missing or expired; tokens
+    close to expiry are replaced in the background.
+    
+    Returns:
+        str: Access token for the Meta API
+    """
+    if not META_API_SIMULATED:
+        return TOKEN_MANAGER.get(f"app@{META_API_BASE_URL}", _request_app_token)
     
     # For the pseudocode, we simply return a fake token
     access_token = "FAKE_ACCESS_TOKEN"
     
     return access_token
 
+def get_page_token(page_id):
+    """
+    Gets the access token of a page managed by the owner of META_USER_ACCESS_TOKEN.
+    
+    The long-lived user token is cached and refreshed like the app token;
+    page tokens derived from it do not expire, so they are cached as they are.
+    
+    Args:
+        page_id (str): Page ID in Meta
+        
+    Returns:
+        str: Page access token (the app token if no user token is configured)
+        
+    Raises:
+        requests.RequestException: If Meta rejects the exchange
+    """
+    if META_API_SIMULATED or not META_USER_ACCESS_TOKEN:
+        return authenticate_with_meta()
+    
+    def request_page_token():
+        user_token = TOKEN_MANAGER.get(f"user@{META_API_BASE_URL}", _request_user_token)
+        response = graph_request(
+            "GET",
+            f"{META_API_BASE_URL}/{page_id}",
+            "oauth",
+            params={"fields": "access_token", "access_token": user_token}
+        )
+        response.raise_for_status()
+        return response.json()["access_token"], None
+    
+    return TOKEN_MANAGER.get(f"page:{page_id}@{META_API_BASE_URL}", request_page_token)
+
 def get_acces_venues():
     """
     Pseudocode for obtaining the list of ACCES venues.
@@ -59,6 +245,7 @@ def get_acces_venues():
     
     return venues
 
+@timed("meta_fetch")
 def get_posts_from_venue(venue_id, access_token, limit=10):
     """
     Pseudocode for obtaining posts from a specific venue.
@@ -71,18 +258,32 @@ def get_posts_from_venue(venue_id, access_token, limit=10):
     Returns:
         list: List of posts from the venue
     """
-    print(f"Getting posts from venue with ID {venue_id}...")
+    logger.debug("Getting posts from venue with ID %s", venue_id)
     
     # In a real case, a GET request would be made to the Meta API here
     # url = f"{META_API_BASE_URL}/{venue_id}/posts"
     # params = {
     #     "access_token": access_token,
     #     "limit": limit,
-    #     "fields": "id,message,created_time,attachments"
+    #     "fields": META_POST_FIELDS
     # }
     # response = requests.get(url, params=params)
     # posts = response.json()["data"]
     
+    if not META_API_SIMULATED:
+        response = graph_request(
+            "GET",
+            f"{META_API_BASE_URL}/{venue_id}/posts",
+            "posts",
+            params={
+                "access_token": access_token,
+                "limit": limit,
+                "fields": META_POST_FIELDS
+            }
+        )
+        response.raise_for_status()
+        return [convert_graph_post(post) for post in response.json()["data"]]
+    
     # For the pseudocode, we simply return a list of fake posts
     posts = [
         {
@@ -101,6 +302,112 @@ def get_posts_from_venue(venue_id, access_token, limit=10):
     
     return posts
 
+def get_posts_from_venues(venue_ids, access_token, limit=10):
+    """
+    Obtains the posts of many venues with Graph API batch requests.
+    
+    Up to META_BATCH_SIZE venues are read per HTTP call. Meta still counts
+    every sub-request against the rate limits, but the round-trips drop from
+    one per venue to one per batch.
+    
+    Args:
+        venue_ids (list): Venue IDs in Meta
+        access_token (str): Access token for the Meta API
+        limit (int): Maximum number of posts per venue
+        
+    Returns:
+        dict: List of posts per venue ID; venues whose sub-request failed, or
+            kept being throttled after META_THROTTLE_RETRIES rounds, are left out
+        
+    Raises:
+        requests.RequestException: If a batch call itself fails
+    """
+    if META_API_SIMULATED:
+        return {venue_id: get_posts_from_venue(venue_id, access_token, limit=limit) for venue_id in venue_ids}
+    
+    posts = {}
+    pending = list(venue_ids)
+    batch_calls = 0
+    for attempt in range(META_THROTTLE_RETRIES):
+        throttled = []
+        for start in range(0, len(pending), META_BATCH_SIZE):
+            chunk = pending[start:start + META_BATCH_SIZE]
+            query = urlencode({"limit": limit, "fields": META_POST_FIELDS})
+            batch = [{"method": "GET", "relative_url": f"{venue_id}/posts?{query}"} for venue_id in chunk]
+            with stage_timer("meta_fetch"):
+                response = graph_request(
+                    "POST",
+                    META_API_BASE_URL,
+                    "batch",
+                    cost=len(batch),
+                    data={
+                        "access_token": access_token,
+                        "batch": json.dumps(batch),
+                        "include_headers": "false"
+                    }
+                )
+            response.raise_for_status()
+            batch_calls += 1
+            
+            # Each sub-response has its own status code and a JSON body as text (null if it timed out)
+            for venue_id, result in zip(chunk, response.json()):
+                status = result.get("code") if result else None
+                META_API_SUBREQUESTS.inc(status=str(status))
+                try:
+                    body = json.loads(result.get("body") or "null") if result else None
+                except ValueError:
+                    body = None
+                if status != 200:
+                    code = throttle_error_code(body)
+                    if code is not None:
+                        # Pause the following calls and read the venue again in the next round
+                        META_RATE_LIMITER.throttled({}, code)
+                        throttled.append(venue_id)
+                    else:
+                        logger.warning("Error getting posts from venue %s in batch: %s", venue_id, result and result.get("body"))
+                    continue
+                if not isinstance(body, dict) or "data" not in body:
+                    logger.warning("Unexpected response for venue %s in batch: %s", venue_id, result.get("body"))
+                    continue
+                posts[venue_id] = [convert_graph_post(post) for post in body["data"]]
+        
+        if not throttled:
+            break
+        # graph_request waits for the limiter before the next batch call
+        logger.warning("%d venues throttled in batch (attempt %d)", len(throttled), attempt + 1)
+        pending = throttled
+    else:
+        logger.warning("Giving up on %d throttled venues: %s", len(pending), pending)
+    
+    logger.debug("Posts of %d venues obtained in %d batch calls", len(venue_ids), batch_calls)
+    return posts
+
+def convert_graph_post(graph_post):
+    """
+    Converts a post returned by the Graph API to the format used by the system.
+    
+    Args:
+        graph_post (dict): Post with the fields id, message, created_time and attachments
+        
+    Returns:
+        dict: Post with id, caption, date and, if it has one, image_url
+    """
+    post = {
+        "id": graph_post["id"],
+        "caption": graph_post.get("message", ""),
+        "date": graph_post.get("created_time", "")[:10]
+    }
+    
+    # Take the first image among the attachments
+    for attachment in graph_post.get("attachments", {}).get("data", []):
+        image = attachment.get("media", {}).get("image", {})
+        if image.get("src"):
+            post["image_url"] = image["src"]
+            break
+    
+    return post
+
+@timed("image_download")
 def download_image(image_url, save_path):
     """
     Pseudocode for downloading an image from a post.
@@ -112,7 +419,7 @@ def download_image(image_url, save_path):
     Returns:
         str: Path where the image was saved
     """
-    print(f"Downloading image from {image_url}...")
+    logger.debug("Downloading image from %s", image_url, extra={"per_item": True})
     
     # In a real case, the image would be downloaded here
     # response = requests.get(image_url, stream=True)
@@ -121,15 +428,27 @@ def download_image(image_url, save_path):
     #         if chunk:
     #             f.write(chunk)
     
+    if not META_API_SIMULATED:
+        os.makedirs(os.path.dirname(save_path) or ".", exist_ok=True)
+        response = requests.get(image_url, stream=True, timeout=META_API_TIMEOUT)
+        response.raise_for_status()
+        with open(save_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                if chunk:
+                    f.write(chunk)
+    
     # For the pseudocode, we simply return the path
     return save_path
 
-def get_posts_with_images(days_back=30):
+def get_posts_with_images(days_back=30, venues=None, image_dir="img", limit=10):
     """
     Pseudocode for obtaining posts with images from all ACCES venues.
     
     Args:
         days_back (int): Number of days back to search for posts
+        venues (list): Venues to read (default: get_acces_venues())
+        image_dir (str): Directory where the images are saved
+        limit (int): Maximum number of posts per venue
         
     Returns:
         list: List of posts with their images
@@ -138,28 +457,35 @@ def get_posts_with_images(days_back=30):
     access_token = authenticate_with_meta()
     
     # Get list of ACCES venues
-    venues = get_acces_venues()
+    if venues is None:
+        venues = get_acces_venues()
     
     all_posts = []
     
-    # For each venue, get its posts
+    # Get the posts of every venue in batch calls, then process each venue
+    posts_by_venue = get_posts_from_venues([venue["id"] for venue in venues], access_token, limit=limit)
     for venue in venues:
-        venue_posts = get_posts_from_venue(venue["id"], access_token)
+        venue_posts = posts_by_venue.get(venue["id"], [])
         
         # Process each post
         for post in venue_posts:
+            # Remember which venue published the post
+            post["venue_id"] = venue["id"]
+            
             # If the post has an image, download it
             if "image_url" in post:
-                image_path = f"img/{post['id']}.jpg"
+                image_path = os.path.join(image_dir, f"{post['id']}.jpg")
                 download_image(post["image_url"], image_path)
                 post["image_path"] = image_path
             
             # Add the post to the list
             all_posts.append(post)
     
+    logger.info("Meta API calls: %s", get_api_usage())
     return all_posts
 
 if __name__ == "__main__":
     # Example of use
+    setup_logging()
     posts = get_posts_with_images()
-    print(f"Obtained {len(posts)} posts with images")
+    logger.info("Obtained %d posts with images", len(posts))
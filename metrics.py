@@ -0,0 +1,435 @@
+"""
+Per-stage latency metrics of the ingestion pipeline.
+
+Counters and histograms are kept in memory and exposed in Prometheus text
+format, either on a local /metrics endpoint or dumped to a file at the end of
+a run. Stage timings of the post being processed are also collected per
+thread so they can be attached to its Langfuse trace.
+"""
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Local address of the metrics endpoint
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+
+# Stage timings of the post processed by the current thread
+_local = threading.local()
+
+# Callbacks notified when a stage starts and ends (used by the profiler)
+_stage_listeners = []
+
+
+def _format_labels(labelnames, key):
+    """
+    Formats a label set for the Prometheus text format.
+
+    Args:
+        labelnames (tuple): Label names
+        key (tuple): Label values in the same order
+
+    Returns:
+        str: Labels between braces, or an empty string without labels
+    """
+    if not labelnames:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(labelnames, key))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """
+    Monotonic counter with optional labels.
+    """
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """
+        Increments the counter.
+
+        Args:
+            amount (float): Increment
+            **labels: Label values
+        """
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        """
+        Renders the counter in Prometheus text format.
+
+        Returns:
+            list: Lines of the exposition
+        """
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+    def snapshot(self):
+        """
+        Returns the current values.
+
+        Returns:
+            dict: Value per label set (joined with "," when there are several labels)
+        """
+        with self.lock:
+            return {",".join(key): value for key, value in self.values.items()}
+
+
+class Histogram:
+    """
+    Cumulative histogram with optional labels.
+    """
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """
+        Records one observation.
+
+        Args:
+            value (float): Observed value
+            **labels: Label values
+        """
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        """
+        Renders the histogram in Prometheus text format.
+
+        Returns:
+            list: Lines of the exposition
+        """
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in sorted(self.series.items()):
+                names = self.labelnames + ("le",)
+                for bound, count in zip(self.buckets, series["counts"]):
+                    lines.append(f"{self.name}_bucket{_format_labels(names, key + (bound,))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(names, key + ('+Inf',))} {series['count']}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {series['sum']:.6f}")
+                lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+    def snapshot(self):
+        """
+        Returns count, total and mean per label set.
+
+        Returns:
+            dict: Summary per label set (joined with "," when there are several labels)
+        """
+        with self.lock:
+            return {
+                ",".join(key): {
+                    "count": series["count"],
+                    "sum_seconds": round(series["sum"], 6),
+                    "mean_seconds": round(series["sum"] / series["count"], 6) if series["count"] else 0.0,
+                }
+                for key, series in self.series.items()
+            }
+
+
+class MetricsRegistry:
+    """
+    Collection of the metrics exposed by the process.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labelnames=()):
+        """
+        Gets or creates a counter.
+
+        Args:
+            name (str): Metric name
+            help (str): Description
+            labelnames (tuple): Label names
+
+        Returns:
+            Counter: Registered counter
+        """
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """
+        Gets or creates a histogram.
+
+        Args:
+            name (str): Metric name
+            help (str): Description
+            labelnames (tuple): Label names
+            buckets (tuple): Upper bounds of the buckets
+
+        Returns:
+            Histogram: Registered histogram
+        """
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        """
+        Renders every metric in Prometheus text format.
+
+        Returns:
+            str: Metrics exposition
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """
+        Returns a JSON-serializable summary of every metric.
+
+        Returns:
+            dict: Summary per metric name
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+
+# Registry shared by the whole process
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "pipeline_stage_seconds", "Time spent in each pipeline stage", ("stage",)
+)
+STAGE_ERRORS = REGISTRY.counter(
+    "pipeline_stage_errors_total", "Pipeline stages that raised an exception", ("stage",)
+)
+
+
+@contextmanager
+def stage_timer(stage):
+    """
+    Measures a pipeline stage.
+
+    The duration is recorded in the stage histogram and, if the current
+    thread is collecting timings, added to them.
+
+    Args:
+        stage (str): Stage name
+
+    Yields:
+        None
+    """
+    for listener in _stage_listeners:
+        listener(stage, True)
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        timings = getattr(_local, "timings", None)
+        if timings is not None:
+            timings[stage] = round(timings.get(stage, 0.0) + elapsed, 6)
+        for listener in _stage_listeners:
+            listener(stage, False)
+
+
+def add_stage_listener(listener):
+    """
+    Registers a callback notified when any stage starts or ends.
+
+    The callback receives the stage name and True when the stage starts or
+    False when it ends, on the thread running the stage.
+
+    Args:
+        listener (callable): Callback listener(stage, started)
+    """
+    _stage_listeners.append(listener)
+
+
+def remove_stage_listener(listener):
+    """
+    Unregisters a callback added with add_stage_listener.
+
+    Args:
+        listener (callable): Callback to remove
+    """
+    if listener in _stage_listeners:
+        _stage_listeners.remove(listener)
+
+
+def timed(stage):
+    """
+    Decorator measuring every call of a function as a pipeline stage.
+
+    Args:
+        stage (str): Stage name
+
+    Returns:
+        callable: Decorator
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def collect_stage_timings():
+    """
+    Collects the stage timings of the current thread, e.g. for one post.
+
+    Nested collections share the outer dictionary.
+
+    Yields:
+        dict: Seconds spent per stage, filled while the block runs
+    """
+    outer = getattr(_local, "timings", None)
+    if outer is not None:
+        yield outer
+        return
+
+    _local.timings = {}
+    try:
+        yield _local.timings
+    finally:
+        _local.timings = None
+
+
+def current_stage_timings():
+    """
+    Gets the stage timings being collected by the current thread.
+
+    Returns:
+        dict: Seconds per stage, or an empty dict when nothing is collected
+    """
+    return dict(getattr(_local, "timings", None) or {})
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves GET /metrics.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """
+    Serves the metrics on http://host:port/metrics from a background thread.
+
+    Args:
+        host (str): Listening address
+        port (int): Listening port
+
+    Returns:
+        ThreadingHTTPServer: Running server; call shutdown() to stop it
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("Metrics available at http://%s:%d/metrics", host, server.server_address[1])
+    return server
+
+
+def dump_metrics(path):
+    """
+    Writes the metrics to a file.
+
+    Files ending in .json get the JSON summary; any other file gets the
+    Prometheus text format.
+
+    Args:
+        path (str): Output file
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        if path.endswith(".json"):
+            json.dump(REGISTRY.snapshot(), f, indent=2)
+        else:
+            f.write(REGISTRY.render())
+    logger.info("Metrics written to %s", path)
+
+
+def merge_snapshots(snapshots):
+    """
+    Merges the snapshot() summaries of several processes into one.
+
+    Counter values are added; histogram counts and totals are added and
+    their means recomputed.
+
+    Args:
+        snapshots (list): Summaries returned by REGISTRY.snapshot()
+
+    Returns:
+        dict: Merged summary per metric name
+    """
+    merged = {}
+    for snapshot in snapshots:
+        for name, series in snapshot.items():
+            target = merged.setdefault(name, {})
+            for key, value in series.items():
+                if isinstance(value, dict):
+                    total = target.setdefault(key, {"count": 0, "sum_seconds": 0.0, "mean_seconds": 0.0})
+                    total["count"] += value["count"]
+                    total["sum_seconds"] = round(total["sum_seconds"] + value["sum_seconds"], 6)
+                    total["mean_seconds"] = round(total["sum_seconds"] / total["count"], 6) if total["count"] else 0.0
+                else:
+                    target[key] = target.get(key, 0) + value
+    return merged
@@ -0,0 +1,233 @@
+"""
+In-memory index of names for resolving free-text mentions to known entities.
+
+Extracted names rarely match the stored ones exactly ("Riquelaclub",
+"RIQUELA CLUB", "#riquelaclub" and "Riquela Club" are the same venue). Names
+are folded (accents, case, punctuation, spaces) into a few keys looked up in
+dictionaries, and misspellings fall back to a trigram index that only scores
+the names sharing at least one trigram with the query.
+"""
+
+import re
+import unicodedata
+from collections import Counter, defaultdict
+
+# Minimum Dice similarity of trigrams for a fuzzy match
+DEFAULT_MIN_SIMILARITY = 0.6
+
+# Suffixes of social media handles that are not part of the name
+HANDLE_SUFFIXES = ("oficial", "official", "oficiall")
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+_CAMEL_CASE = re.compile(r"(?<=[a-z])(?=[A-Z])")
+
+
+def normalize_name(text):
+    """
+    Folds a name to lowercase ASCII words separated by single spaces.
+
+    Leading @ and # are dropped and camelCase hashtags are split, so
+    "#StereoRockBar" becomes "stereo rock bar".
+
+    Args:
+        text (str): Name as written
+
+    Returns:
+        str: Normalized name
+    """
+    text = _CAMEL_CASE.sub(" ", text.strip().lstrip("@#"))
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return _NON_ALNUM.sub(" ", text.casefold().replace("&", " and ")).strip()
+
+
+def compact_name(text, suffixes=HANDLE_SUFFIXES):
+    """
+    Folds a name to a single lowercase ASCII word, without handle suffixes.
+
+    "@xoan_curiel", "Xoan Curiel" and "XoanCuriel" all give "xoancuriel".
+
+    Args:
+        text (str): Name as written
+        suffixes (tuple): Handle suffixes dropped from the end of the name
+
+    Returns:
+        str: Compact name
+    """
+    compact = normalize_name(text).replace(" ", "")
+    for suffix in suffixes:
+        if compact.endswith(suffix) and len(compact) > len(suffix) + 2:
+            return compact[:-len(suffix)]
+    return compact
+
+
+def name_keys(text, stopwords=frozenset(), suffixes=HANDLE_SUFFIXES):
+    """
+    Builds the exact-match keys of a name, from the most to the least specific.
+
+    Args:
+        text (str): Name as written
+        stopwords (frozenset): Generic words ignored by the last key (e.g. "sala")
+        suffixes (tuple): Handle suffixes dropped from the compact key
+
+    Returns:
+        list: Distinct keys: normalized name, name without spaces and, if
+            different, name without spaces or stopwords
+    """
+    normalized = normalize_name(text)
+    if not normalized:
+        return []
+
+    words = normalized.split()
+    compact = compact_name(normalized, suffixes)
+    keys = [normalized, compact]
+    core = "".join(word for word in words if word not in stopwords)
+    if core and core != compact:
+        keys.append(core)
+
+    # Keep the order while dropping duplicates
+    return list(dict.fromkeys(keys))
+
+
+def trigrams(text):
+    """
+    Gets the trigrams of a compact name, padded so that short names still have some.
+
+    Args:
+        text (str): Compact name
+
+    Returns:
+        set: Trigrams of the name
+    """
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """
+    Inverted index from trigrams to names, scored with the Dice coefficient.
+    """
+
+    def __init__(self):
+        self.postings = defaultdict(list)
+        self.sizes = []
+        self.values = []
+
+    def add(self, text, value):
+        """
+        Adds a name.
+
+        Args:
+            text (str): Compact name
+            value: Value returned when the name matches
+        """
+        grams = trigrams(text)
+        position = len(self.values)
+        self.values.append(value)
+        self.sizes.append(len(grams))
+        for gram in grams:
+            self.postings[gram].append(position)
+
+    def candidates(self, text, min_similarity=DEFAULT_MIN_SIMILARITY):
+        """
+        Finds every name similar enough to the query.
+
+        Args:
+            text (str): Compact name to look for
+            min_similarity (float): Minimum Dice similarity to accept a match
+
+        Returns:
+            list: (value, similarity) pairs, most similar first
+        """
+        grams = trigrams(text)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+
+        matches = []
+        for position, count in shared.items():
+            score = 2 * count / (len(grams) + self.sizes[position])
+            if score >= min_similarity:
+                matches.append((position, score))
+        matches.sort(key=lambda match: (-match[1], match[0]))
+        return [(self.values[position], score) for position, score in matches]
+
+    def search(self, text, min_similarity=DEFAULT_MIN_SIMILARITY):
+        """
+        Finds the most similar name.
+
+        Args:
+            text (str): Compact name to look for
+            min_similarity (float): Minimum Dice similarity to accept a match
+
+        Returns:
+            tuple: (value, similarity), or (None, 0.0) if nothing is similar enough
+        """
+        matches = self.candidates(text, min_similarity)
+        return matches[0] if matches else (None, 0.0)
+
+
+class NameIndex:
+    """
+    Resolves names through exact folded keys first and trigrams second.
+    """
+
+    def __init__(self, stopwords=frozenset(), min_similarity=DEFAULT_MIN_SIMILARITY, suffixes=HANDLE_SUFFIXES):
+        """
+        Creates an empty index.
+
+        Args:
+            stopwords (frozenset): Generic words ignored by the loosest key
+            min_similarity (float): Minimum trigram similarity of fuzzy matches
+            suffixes (tuple): Handle suffixes that are not part of the names
+        """
+        self.stopwords = frozenset(stopwords)
+        self.min_similarity = min_similarity
+        self.suffixes = tuple(suffixes)
+        self.exact = {}
+        self.fuzzy = TrigramIndex()
+
+    def __len__(self):
+        return len(self.fuzzy.values)
+
+    def add(self, name, value):
+        """
+        Adds a name (or an alias) of an entity.
+
+        The first entity added with a key keeps it.
+
+        Args:
+            name (str): Name or alias as written
+            value: Entity returned when the name matches
+        """
+        keys = name_keys(name, self.stopwords, self.suffixes)
+        if not keys:
+            return
+        for key in keys:
+            self.exact.setdefault(key, value)
+        self.fuzzy.add(compact_name(name, self.suffixes), value)
+
+    def lookup(self, name):
+        """
+        Resolves a name.
+
+        Args:
+            name (str): Name as extracted
+
+        Returns:
+            tuple: (value, score, method) where method is "exact" or "fuzzy",
+                or (None, 0.0, None) if the name is unknown
+        """
+        keys = name_keys(name, self.stopwords, self.suffixes)
+        if not keys:
+            return None, 0.0, None
+
+        for key in keys:
+            value = self.exact.get(key)
+            if value is not None:
+                return value, 1.0, "exact"
+
+        value, score = self.fuzzy.search(compact_name(name, self.suffixes), self.min_similarity)
+        if value is None:
+            return None, 0.0, None
+        return value, score, "fuzzy"
@@ -0,0 +1,331 @@
+"""
+Profiling of evaluation runs, tagged by pipeline stage.
+
+Three modes are available:
+- sampling: a background thread samples the Python stacks of the working
+  threads and tags every sample with the pipeline stage being run. Writes
+  collapsed stacks (profile.folded, usable with flamegraph.pl or speedscope).
+- cprofile: deterministic cProfile of the main thread. Writes profile.prof
+  (pstats format, usable with snakeviz or flameprof).
+- alloc: tracemalloc allocation tracking, with the memory retained by each
+  stage. Writes allocations.snapshot, which can be passed as a baseline to a
+  later run to find memory regressions.
+
+Every mode also writes summary.json with the top-N hotspots, which the
+evaluation attaches to the run's Langfuse metadata.
+"""
+
+import cProfile
+import json
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from metrics import add_stage_listener, remove_stage_listener
+
+logger = logging.getLogger(__name__)
+
+# Supported profiling modes
+PROFILE_MODES = ("sampling", "cprofile", "alloc")
+
+# Directory where the profiles of each run are written
+PROFILE_DIR = "profiles"
+
+# Number of hotspots reported in the summary
+PROFILE_TOP_N = 25
+
+# Seconds between two samples of the sampling profiler
+PROFILE_SAMPLE_INTERVAL = 0.005
+
+# Frames recorded per allocation by tracemalloc
+ALLOC_TRACE_FRAMES = 25
+
+# Label of the samples taken outside any pipeline stage
+NO_STAGE = "other"
+
+
+def _frame_label(code):
+    """
+    Builds the label of a frame in the collapsed stacks.
+
+    Args:
+        code: Code object of the frame
+
+    Returns:
+        str: "module.py:function"
+    """
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class RunProfiler:
+    """
+    Context manager profiling everything run inside it.
+    """
+
+    def __init__(self, mode="sampling", output_dir=PROFILE_DIR, top_n=PROFILE_TOP_N,
+                 interval=PROFILE_SAMPLE_INTERVAL, baseline=None):
+        """
+        Prepares the profiler.
+
+        Args:
+            mode (str): "sampling", "cprofile" or "alloc"
+            output_dir (str): Directory where the profile files are written
+            top_n (int): Number of hotspots in the summary
+            interval (float): Seconds between samples (sampling mode)
+            baseline (str): Previous allocations.snapshot to compare with (alloc mode)
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profiling mode: {mode}")
+
+        self.mode = mode
+        self.output_dir = output_dir
+        self.top_n = top_n
+        self.interval = interval
+        self.baseline = baseline
+        self.summary = {}
+        self.files = []
+
+        # Stage stack of every thread, maintained by the stage listener
+        self._stages = {}
+        self._stage_lock = threading.Lock()
+
+        # Sampling state
+        self._stacks = Counter()
+        self._samples = 0
+        self._stop = threading.Event()
+        self._sampler = None
+        self._main_thread = threading.main_thread().ident
+
+        # Allocation state
+        self._stage_memory = Counter()
+        self._memory_at_enter = {}
+
+        self._profile = None
+        self._started = None
+
+    def _on_stage(self, stage, started):
+        """
+        Keeps track of the stage run by each thread.
+
+        Args:
+            stage (str): Stage name
+            started (bool): True when the stage starts, False when it ends
+        """
+        thread_id = threading.get_ident()
+        with self._stage_lock:
+            stack = self._stages.setdefault(thread_id, [])
+            if started:
+                stack.append(stage)
+            elif stack:
+                stack.pop()
+
+        if self.mode == "alloc":
+            key = (thread_id, stage, len(stack))
+            current = tracemalloc.get_traced_memory()[0]
+            if started:
+                self._memory_at_enter[key] = current
+            else:
+                before = self._memory_at_enter.pop((thread_id, stage, len(stack) + 1), current)
+                self._stage_memory[stage] += current - before
+
+    def _current_stage(self, thread_id):
+        """
+        Gets the innermost stage run by a thread.
+
+        Args:
+            thread_id (int): Thread identifier
+
+        Returns:
+            str: Stage name, or None if the thread is outside any stage
+        """
+        with self._stage_lock:
+            stack = self._stages.get(thread_id)
+            return stack[-1] if stack else None
+
+    def _sample(self):
+        """
+        Samples the stacks of the working threads until stopped.
+
+        Only the main thread and threads inside a pipeline stage are sampled,
+        so idle background threads (log listener, Langfuse) do not add noise.
+        """
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stage = self._current_stage(thread_id)
+                if stage is None and thread_id != self._main_thread:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(f"stage:{stage or NO_STAGE}")
+                stack.reverse()
+
+                self._stacks[";".join(stack)] += 1
+                self._samples += 1
+
+    def __enter__(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        add_stage_listener(self._on_stage)
+        self._started = time.perf_counter()
+
+        if self.mode == "sampling":
+            self._sampler = threading.Thread(target=self._sample, name="profiler", daemon=True)
+            self._sampler.start()
+        elif self.mode == "cprofile":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            tracemalloc.start(ALLOC_TRACE_FRAMES)
+
+        logger.info("Profiling run in %s mode", self.mode)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._started
+        remove_stage_listener(self._on_stage)
+
+        if self.mode == "sampling":
+            self._stop.set()
+            self._sampler.join()
+            self._write_sampling()
+        elif self.mode == "cprofile":
+            self._profile.disable()
+            self._write_cprofile()
+        else:
+            self._write_alloc()
+            tracemalloc.stop()
+
+        self.summary["mode"] = self.mode
+        self.summary["elapsed_seconds"] = round(elapsed, 3)
+        self.summary["files"] = self.files
+        self._write_file("summary.json", json.dumps(self.summary, indent=2))
+        logger.info("Profile written to %s", self.output_dir)
+        return False
+
+    def _write_file(self, name, content):
+        """
+        Writes one output file and remembers its path.
+
+        Args:
+            name (str): File name inside the output directory
+            content (str): File content
+        """
+        path = os.path.join(self.output_dir, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        self.files.append(path)
+
+    def _write_sampling(self):
+        """
+        Writes the collapsed stacks and the sampling hotspots.
+        """
+        self._write_file(
+            "profile.folded",
+            "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+        )
+
+        stage_samples = Counter()
+        self_samples = Counter()
+        total_samples = Counter()
+        for stack, count in self._stacks.items():
+            frames = stack.split(";")
+            stage_samples[frames[0][len("stage:"):]] += count
+            self_samples[frames[-1]] += count
+            # Count each function once per stack for inclusive time
+            for label in set(frames[1:]):
+                total_samples[label] += count
+
+        total = self._samples or 1
+        self.summary["samples"] = self._samples
+        self.summary["sample_interval_seconds"] = self.interval
+        self.summary["stages"] = {
+            stage: {"samples": count, "share": round(count / total, 4)}
+            for stage, count in stage_samples.most_common()
+        }
+        self.summary["self_hotspots"] = [
+            {"function": label, "samples": count, "share": round(count / total, 4)}
+            for label, count in self_samples.most_common(self.top_n)
+        ]
+        self.summary["inclusive_hotspots"] = [
+            {"function": label, "samples": count, "share": round(count / total, 4)}
+            for label, count in total_samples.most_common(self.top_n)
+        ]
+
+    def _write_cprofile(self):
+        """
+        Writes the pstats file and the cProfile hotspots.
+        """
+        path = os.path.join(self.output_dir, "profile.prof")
+        self._profile.dump_stats(path)
+        self.files.append(path)
+
+        stats = pstats.Stats(self._profile)
+        rows = []
+        for (filename, line, function), (_, calls, own, cumulative, _) in stats.stats.items():
+            rows.append({
+                "function": f"{os.path.basename(filename)}:{line}:{function}",
+                "calls": calls,
+                "self_seconds": round(own, 6),
+                "cumulative_seconds": round(cumulative, 6),
+            })
+
+        self.summary["self_hotspots"] = sorted(rows, key=lambda r: r["self_seconds"], reverse=True)[:self.top_n]
+        self.summary["inclusive_hotspots"] = sorted(
+            rows, key=lambda r: r["cumulative_seconds"], reverse=True
+        )[:self.top_n]
+
+    def _write_alloc(self):
+        """
+        Writes the allocation snapshot and the allocation hotspots.
+        """
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ))
+        path = os.path.join(self.output_dir, "allocations.snapshot")
+        snapshot.dump(path)
+        self.files.append(path)
+
+        current, peak = tracemalloc.get_traced_memory()
+        self.summary["current_bytes"] = current
+        self.summary["peak_bytes"] = peak
+        self.summary["stages"] = {
+            stage: {"retained_bytes": size} for stage, size in self._stage_memory.most_common()
+        }
+        self.summary["allocation_hotspots"] = [
+            {"location": str(stat.traceback[0]), "bytes": stat.size, "blocks": stat.count}
+            for stat in snapshot.statistics("lineno")[:self.top_n]
+        ]
+
+        if self.baseline:
+            previous = tracemalloc.Snapshot.load(self.baseline)
+            self.summary["growth_since_baseline"] = [
+                {"location": str(stat.traceback[0]), "size_diff": stat.size_diff, "count_diff": stat.count_diff}
+                for stat in snapshot.compare_to(previous, "lineno")[:self.top_n]
+            ]
+
+
+def profile_dir_for_run(run_name, base_dir=PROFILE_DIR):
+    """
+    Builds the directory where the profile of a run is written.
+
+    Args:
+        run_name (str): Experiment name
+        base_dir (str): Base directory of the profiles
+
+    Returns:
+        str: Directory path
+    """
+    return os.path.join(base_dir, re.sub(r"[^A-Za-z0-9_.-]+", "_", run_name))
@@ -0,0 +1,236 @@
+"""
+Client-side pacing of Graph API calls driven by the quota usage Meta reports.
+
+Every Graph API response carries X-App-Usage (app-level quota) and, for page
+tokens, X-Business-Use-Case-Usage (per business object) headers with the
+percentage of the quota used. The limiter is a token bucket whose refill
+rate shrinks as the reported usage grows; past USAGE_PAUSE_PERCENT, or when a
+call is throttled (error codes 4, 17, 32, 613 or 80001-80014), it stops
+handing out tokens until the quota is expected to recover. Callers block in
+acquire() instead of failing, so a crawl slows down and resumes by itself.
+
+One limiter is shared by every thread that calls the Graph API.
+"""
+
+import json
+import logging
+import threading
+import time
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Calls per second and burst size when the quota is far from its limit
+RATE_LIMIT_RATE = 5.0
+RATE_LIMIT_BURST = 10
+
+# Usage percentage from which the rate is reduced, and at which calls stop
+USAGE_SLOWDOWN_PERCENT = 60
+USAGE_PAUSE_PERCENT = 90
+
+# Fraction of the rate kept just before USAGE_PAUSE_PERCENT
+MIN_RATE_FRACTION = 0.1
+
+# Pause when Meta does not say when access will be regained (seconds)
+DEFAULT_PAUSE_SECONDS = 60
+
+# Graph API error codes meaning the call was rate limited
+THROTTLE_ERROR_CODES = frozenset({4, 17, 32, 613} | set(range(80001, 80015)))
+
+# Usage headers and the metrics inside them (percentages)
+USAGE_HEADERS = ("X-App-Usage", "X-Business-Use-Case-Usage")
+USAGE_FIELDS = ("call_count", "total_cputime", "total_time")
+
+RATE_LIMIT_WAIT = REGISTRY.histogram(
+    "meta_rate_limit_wait_seconds", "Time Graph API calls waited for the rate limiter"
+)
+RATE_LIMIT_PAUSES = REGISTRY.counter(
+    "meta_rate_limit_pauses_total", "Times the Graph API calls were paused, by reason", ("reason",)
+)
+
+
+def parse_usage_headers(headers):
+    """
+    Reads the quota usage reported in the headers of a Graph API response.
+
+    Args:
+        headers (Mapping): Response headers
+
+    Returns:
+        tuple: (usage, regain_seconds) with the highest percentage of any
+            usage metric (None if there are no usage headers) and the longest
+            estimated_time_to_regain_access in seconds (0 if none)
+    """
+    usage, regain = None, 0
+    for header in USAGE_HEADERS:
+        value = headers.get(header)
+        if not value:
+            continue
+        try:
+            report = json.loads(value)
+        except ValueError:
+            logger.debug("Unreadable %s header: %s", header, value)
+            continue
+
+        # X-App-Usage is one object; X-Business-Use-Case-Usage maps ids to lists of objects
+        if header == "X-App-Usage":
+            entries = [report]
+        else:
+            entries = [entry for values in report.values() for entry in (values if isinstance(values, list) else [values])]
+
+        for entry in entries:
+            for field in USAGE_FIELDS:
+                if isinstance(entry.get(field), (int, float)):
+                    usage = max(usage or 0, entry[field])
+            regain = max(regain, 60 * (entry.get("estimated_time_to_regain_access") or 0))
+    return usage, regain
+
+
+def throttle_error_code(payload):
+    """
+    Tells whether a Graph API error response means the call was rate limited.
+
+    Args:
+        payload (dict): Decoded response body
+
+    Returns:
+        int: The throttling error code, or None for other responses
+    """
+    error = payload.get("error") if isinstance(payload, dict) else None
+    if not isinstance(error, dict):
+        return None
+    code = error.get("code")
+    return code if code in THROTTLE_ERROR_CODES else None
+
+
+class RateLimiter:
+    """
+    Token bucket whose rate adapts to the quota usage reported by Meta.
+    """
+
+    def __init__(self, rate=RATE_LIMIT_RATE, burst=RATE_LIMIT_BURST, slowdown_percent=USAGE_SLOWDOWN_PERCENT,
+                 pause_percent=USAGE_PAUSE_PERCENT, clock=time.monotonic, sleep=time.sleep):
+        """
+        Creates a limiter with a full bucket.
+
+        Args:
+            rate (float): Calls per second while usage is low
+            burst (int): Maximum calls made back to back
+            slowdown_percent (float): Usage from which the rate is reduced
+            pause_percent (float): Usage at which calls stop until the quota recovers
+            clock (callable): Monotonic clock (replaceable in tests)
+            sleep (callable): Sleep function (replaceable in tests)
+        """
+        self.rate = rate
+        self.burst = burst
+        self.slowdown_percent = slowdown_percent
+        self.pause_percent = pause_percent
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = float(burst)
+        self.updated = clock()
+        self.usage = 0.0
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def current_rate(self):
+        """
+        Computes the refill rate for the last reported usage.
+
+        Returns:
+            float: Calls per second
+        """
+        if self.usage <= self.slowdown_percent:
+            return self.rate
+        if self.usage >= self.pause_percent:
+            return self.rate * MIN_RATE_FRACTION
+        # Linear from the full rate at slowdown_percent to MIN_RATE_FRACTION at pause_percent
+        progress = (self.usage - self.slowdown_percent) / (self.pause_percent - self.slowdown_percent)
+        return self.rate * (1 - progress * (1 - MIN_RATE_FRACTION))
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.current_rate())
+        self.updated = now
+
+    def acquire(self, cost=1):
+        """
+        Waits until a call of the given cost can be made.
+
+        Calls costing more than the burst wait for a full bucket and leave it
+        in debt, so the calls after them wait until the whole cost has been
+        paid back at the current rate.
+
+        Args:
+            cost (int): Calls counted by Meta (sub-requests of a batch count separately)
+
+        Returns:
+            float: Seconds waited
+        """
+        needed = min(cost, self.burst)
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = self.clock()
+                if now < self.paused_until:
+                    delay = self.paused_until - now
+                else:
+                    self._refill(now)
+                    if self.tokens >= needed:
+                        self.tokens -= cost
+                        break
+                    delay = (needed - self.tokens) / self.current_rate()
+            self.sleep(delay)
+            waited += delay
+
+        if waited:
+            RATE_LIMIT_WAIT.observe(waited)
+        return waited
+
+    def pause(self, seconds, reason):
+        """
+        Stops handing out tokens for a while.
+
+        Args:
+            seconds (float): Pause duration
+            reason (str): Cause of the pause, used as metric label
+        """
+        with self.lock:
+            until = self.clock() + seconds
+            if until <= self.paused_until:
+                return
+            self.paused_until = until
+            # Keep any debt left by large batches
+            self.tokens = min(self.tokens, 0.0)
+        RATE_LIMIT_PAUSES.inc(reason=reason)
+        logger.warning("Pausing Graph API calls for %.0fs (%s, usage %.0f%%)", seconds, reason, self.usage)
+
+    def update(self, headers):
+        """
+        Adapts the pacing to the usage headers of a response.
+
+        Args:
+            headers (Mapping): Response headers
+        """
+        usage, regain = parse_usage_headers(headers)
+        if usage is None:
+            return
+        with self.lock:
+            self._refill(self.clock())
+            self.usage = float(usage)
+        if usage >= self.pause_percent or regain:
+            self.pause(regain or DEFAULT_PAUSE_SECONDS, "usage")
+
+    def throttled(self, headers, code):
+        """
+        Pauses after Meta rejected a call for exceeding the rate limits.
+
+        Args:
+            headers (Mapping): Headers of the rejected response
+            code (int): Graph API error code
+        """
+        usage, regain = parse_usage_headers(headers)
+        if usage is not None:
+            with self.lock:
+                self.usage = float(usage)
+        self.pause(regain or DEFAULT_PAUSE_SECONDS, f"error_{code}")
@@ -0,0 +1,272 @@
+"""
+Selective re-extraction of posts after a prompt or model change.
+
+Every saved post is recorded in the post table with the EXTRACTION_VERSION
+that produced its events (linked through evento_fuente). Instead of wiping
+the events and extracting everything again, this command only re-runs the
+posts extracted with an older version or whose score fell below a threshold:
+
+    python reprocess.py [--min-score 0.5] [--limit 100] [--dry-run]
+
+The workflow runs outside any transaction. The events of a post are then
+replaced in one transaction: events extracted again keep their id, new ones
+are inserted and the ones no other post produced are deleted, with the
+change log and the monthly summaries updated alongside.
+"""
+
+import argparse
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
+from langfuse.decorators import langfuse_context
+
+from evaluation import EXTRACTION_VERSION, connect_to_db, process_post, save_results_to_db
+from db_pool import close_all_pools
+from event_changes import record_event_changes
+from event_stats import refresh_event_stats
+from meta_api_connector import download_image
+from metrics import REGISTRY
+from log_config import setup_logging, add_logging_arguments
+
+logger = logging.getLogger(__name__)
+
+# Posts read per query when selecting the posts to re-extract
+REPROCESS_PAGE_SIZE = 100
+
+# Posts re-extracted at the same time (workflow calls dominate the time)
+REPROCESS_WORKERS = 4
+
+# Directory where the images of the posts are downloaded
+IMAGE_DIR = "img"
+
+REPROCESSED_POSTS = REGISTRY.counter(
+    "reprocessed_posts_total", "Posts selected for re-extraction, by result", ("result",)
+)
+
+
+class StalePost(NamedTuple):
+    """
+    Post whose extraction is outdated or scored too low.
+    """
+    id: str
+    entrada: dict
+    extraccion_version: int
+    puntuacion: Optional[float]
+
+
+def fetch_stale_posts(connection, version=EXTRACTION_VERSION, min_score=None, after=None, limit=REPROCESS_PAGE_SIZE):
+    """
+    Fetches one page of posts that need a new extraction, ordered by id.
+
+    Args:
+        connection: Connection to the database
+        version (int): Current extraction version; older posts are selected
+        min_score (float): Posts scored below it are selected too (None: ignore scores)
+        after (str): Last post id of the previous page
+        limit (int): Maximum number of posts
+
+    Returns:
+        list: StalePost of the page
+    """
+    conditions = ["extraccion_version < %s"]
+    params = [version]
+    if min_score is not None:
+        conditions.append("puntuacion < %s")
+        params.append(min_score)
+    query = f"SELECT id, entrada, extraccion_version, puntuacion FROM post WHERE ({' OR '.join(conditions)})"
+    if after is not None:
+        query += " AND id > %s"
+        params.append(after)
+    query += " ORDER BY id LIMIT %s"
+    params.append(limit)
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute(query, params)
+        return [StalePost(*row) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def replace_post_events(connection, post, output, score=None):
+    """
+    Replaces the events of a post with those of a new extraction.
+
+    Runs in the caller's transaction, so readers see either the old or the
+    new events of the post. Events that the new extraction yields again keep
+    their id; events that no post produces any more are deleted.
+
+    Args:
+        connection: Connection to the database
+        post (dict): Source post, with its Meta id
+        output (dict): New extraction results
+        score (float): Quality score of the new extraction, if known
+
+    Returns:
+        tuple: Number of events of the post and number of events deleted
+
+    Raises:
+        RuntimeError: If the new results could not be saved (the transaction
+            is rolled back)
+    """
+    post_id = str(post["id"])
+    cursor = connection.cursor()
+    try:
+        # Serialize with other writers of the same post
+        cursor.execute("SELECT id FROM post WHERE id = %s FOR UPDATE", (post_id,))
+
+        # Unlink the old events; the new extraction links again the ones it still yields
+        cursor.execute(
+            "DELETE FROM evento_fuente WHERE post_id = %s RETURNING evento_id, evento_fecha", (post_id,)
+        )
+        previous = cursor.fetchall()
+
+        event_ids = save_results_to_db(connection, output, post, score)
+        if event_ids is None:
+            raise RuntimeError(f"Could not save the new extraction of post {post_id}")
+
+        # Drop the old events that are no longer produced by any post
+        deleted = []
+        if previous:
+            cursor.execute(
+                """
+                DELETE FROM eventos e
+                USING unnest(%s::integer[], %s::date[]) AS old(evento_id, evento_fecha)
+                WHERE e.id = old.evento_id AND e.fecha = old.evento_fecha
+                  AND NOT EXISTS (
+                      SELECT 1 FROM evento_fuente f WHERE f.evento_id = e.id AND f.evento_fecha = e.fecha
+                  )
+                RETURNING e.id, e.artista_id, e.sala_id, e.fecha, e.hora
+                """,
+                ([row[0] for row in previous], [row[1] for row in previous])
+            )
+            deleted = cursor.fetchall()
+    finally:
+        cursor.close()
+
+    record_event_changes(connection, "delete", deleted)
+    refresh_event_stats(connection, [row[3] for row in deleted])
+    return len(set(event_ids)), len(deleted)
+
+
+def reprocess_post(pool, stale):
+    """
+    Extracts a post again and replaces its events.
+
+    The old events are kept if the workflow fails.
+
+    Args:
+        pool (ConnectionPool): Pool of connections to the database
+        stale (StalePost): Post to re-extract
+
+    Returns:
+        str: "replaced" or "failed"
+    """
+    post = dict(stale.entrada, id=stale.id)
+
+    try:
+        if post.get("image_url"):
+            image_path = os.path.join(IMAGE_DIR, f"{stale.id}.jpg")
+            post["image_path"] = image_path if os.path.exists(image_path) else download_image(post["image_url"], image_path)
+
+        output = process_post(post, post_id=stale.id)
+        if not isinstance(output, dict):
+            logger.warning("Post %s could not be extracted again, keeping its events", stale.id)
+            return "failed"
+
+        with pool.connection() as connection:
+            events, deleted = replace_post_events(connection, post, output)
+    except Exception as e:
+        logger.warning("Error reprocessing post %s: %s", stale.id, e)
+        return "failed"
+
+    logger.info(
+        "Post %s re-extracted (version %s -> %s): %d events, %d removed",
+        stale.id, stale.extraccion_version, EXTRACTION_VERSION, events, deleted
+    )
+    return "replaced"
+
+
+def reprocess_posts(pool, min_score=None, limit=None, workers=REPROCESS_WORKERS, dry_run=False):
+    """
+    Re-extracts every post with an older extraction version or a low score.
+
+    Args:
+        pool (ConnectionPool): Pool of connections to the database
+        min_score (float): Posts scored below it are re-extracted too
+        limit (int): Maximum number of posts (None: all)
+        workers (int): Posts re-extracted at the same time
+        dry_run (bool): Only report the posts that would be re-extracted
+
+    Returns:
+        dict: Number of posts per result
+    """
+    results = {}
+    after = None
+    selected = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="reprocess") as executor:
+        while limit is None or selected < limit:
+            page_size = REPROCESS_PAGE_SIZE if limit is None else min(REPROCESS_PAGE_SIZE, limit - selected)
+            with pool.connection() as connection:
+                page = fetch_stale_posts(connection, min_score=min_score, after=after, limit=page_size)
+            if not page:
+                break
+            after = page[-1].id
+            selected += len(page)
+
+            if dry_run:
+                for stale in page:
+                    logger.info("Would re-extract post %s (version %s, score %s)", stale.id, stale.extraccion_version, stale.puntuacion)
+                outcomes = ["dry_run"] * len(page)
+            else:
+                outcomes = executor.map(lambda stale: reprocess_post(pool, stale), page)
+
+            for outcome in outcomes:
+                REPROCESSED_POSTS.inc(result=outcome)
+                results[outcome] = results.get(outcome, 0) + 1
+
+    logger.info("Reprocessing finished: %s", results or "nothing to do")
+    return results
+
+
+def parse_arguments():
+    """
+    Parses the command line arguments.
+
+    Returns:
+        argparse.Namespace: Object with the processed arguments
+    """
+    parser = argparse.ArgumentParser(description='Re-extract posts with an outdated or low-scored extraction')
+    parser.add_argument('--min-score', type=float, default=None,
+                    help='Also re-extract posts scored below this value (default: only outdated versions)')
+    parser.add_argument('--limit', type=int, default=None,
+                    help='Maximum number of posts to re-extract (default: all)')
+    parser.add_argument('--workers', type=int, default=REPROCESS_WORKERS,
+                    help=f'Posts re-extracted at the same time (default: {REPROCESS_WORKERS})')
+    parser.add_argument('--dry-run', action='store_true',
+                    help='Only report the posts that would be re-extracted')
+    add_logging_arguments(parser)
+    return parser.parse_args()
+
+
+def main():
+    """
+    Entry point of the re-extraction command.
+    """
+    args = parse_arguments()
+    setup_logging(level=args.log_level, log_format=args.log_format, quiet=args.quiet)
+
+    pool = connect_to_db()
+    if pool is None:
+        return
+    try:
+        reprocess_posts(pool, args.min_score, args.limit, args.workers, args.dry_run)
+    finally:
+        close_all_pools()
+        langfuse_context.flush()
+
+
+if __name__ == "__main__":
+    main()
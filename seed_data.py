@@ -0,0 +1,398 @@
+"""
+Idempotent bulk loader of venues, artists and events.
+
+Rows are streamed with COPY FROM STDIN into temporary staging tables, their
+ids are resolved by natural key with a few set-based statements, and only
+what is missing is inserted:
+
+- venues by Meta page id, or by name and city for venues without one;
+  known venues get the city, province, capacity and page id of the seed
+- artists by folded name (the artista_alias key used by artist_resolver),
+  so "@xoan_curiel" and "Xoan Curiel" are the same artist
+- events by (artist, venue, date, time)
+
+Loading the same files twice changes nothing, and ids are never assumed,
+so seeds can be applied to a database that already has data:
+
+    python seed_data.py --venues salas.csv --artists artistas.csv --events eventos.jsonl
+
+CSV files have a header row; JSONL files hold one object per line. Columns:
+venues nombre, ciudad, provincia, aforo, meta_page_id; artists nombre;
+events artista, sala (venue name) or meta_page_id, fecha (YYYY-MM-DD) and
+optionally hora (HH:MM). Artists named by events are created if needed;
+events whose venue is unknown are skipped.
+"""
+
+import argparse
+import csv
+import io
+import json
+import logging
+import time
+
+from database_schema import connect_to_db, ensure_event_partition
+from dataset_loader import JSONL_EXTENSIONS
+from db_pool import close_all_pools
+from event_changes import record_event_changes
+from event_stats import refresh_event_stats
+from artist_resolver import artist_key
+from log_config import setup_logging, add_logging_arguments
+
+logger = logging.getLogger(__name__)
+
+# Staging tables, dropped when the seeding transaction ends
+STAGING_SCHEMA = """
+DROP TABLE IF EXISTS seed_sala, seed_artista, seed_evento;
+CREATE TEMP TABLE seed_sala (
+    nombre VARCHAR(255) NOT NULL,
+    ciudad VARCHAR(255),
+    provincia VARCHAR(255),
+    aforo INTEGER,
+    meta_page_id VARCHAR(64),
+    sala_id INTEGER
+) ON COMMIT DROP;
+CREATE TEMP TABLE seed_artista (
+    clave VARCHAR(255) PRIMARY KEY,
+    nombre VARCHAR(255) NOT NULL,
+    artista_id INTEGER
+) ON COMMIT DROP;
+CREATE TEMP TABLE seed_evento (
+    clave VARCHAR(255) NOT NULL,
+    sala VARCHAR(255),
+    meta_page_id VARCHAR(64),
+    fecha DATE NOT NULL,
+    hora TIME,
+    artista_id INTEGER,
+    sala_id INTEGER
+) ON COMMIT DROP;
+"""
+
+# Venue match: same Meta page, or same name and city if one of them has no page
+VENUE_MATCH = """
+(x.meta_page_id = s.meta_page_id
+ OR ((x.meta_page_id IS NULL OR s.meta_page_id IS NULL)
+     AND lower(x.nombre) = lower(s.nombre)
+     AND lower(COALESCE(x.ciudad, '')) = lower(COALESCE(s.ciudad, ''))))
+"""
+
+
+def read_records(path):
+    """
+    Reads the rows of a CSV or JSONL seed file.
+
+    Args:
+        path (str): Path to the .csv or .jsonl file
+
+    Returns:
+        list: One dict per row
+    """
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        if path.lower().endswith(JSONL_EXTENSIONS):
+            return [json.loads(line) for line in f if line.strip()]
+        return list(csv.DictReader(f))
+
+
+def _blank(value):
+    # Empty CSV cells are NULL
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _copy(cursor, table, columns, rows):
+    """
+    Streams rows into a table with COPY FROM STDIN.
+
+    Args:
+        cursor: Cursor of the connection to the database
+        table (str): Target table
+        columns (tuple): Target columns
+        rows (list): Tuples of values (None is NULL)
+
+    Returns:
+        int: Number of rows copied
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        # Unquoted empty fields are NULL in COPY's CSV format
+        writer.writerow(["" if value is None else value for value in row])
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    return len(rows)
+
+
+def _stage(cursor, venues, artists, events):
+    """
+    Copies the seed rows into the staging tables, removing duplicates.
+
+    Args:
+        cursor: Cursor of the connection to the database
+        venues (list): Venue records
+        artists (list): Artist records
+        events (list): Event records
+
+    Returns:
+        dict: Number of distinct venues, artists and events staged
+    """
+    cursor.execute(STAGING_SCHEMA)
+
+    staged_venues = {}
+    for venue in venues:
+        nombre = _blank(venue.get("nombre"))
+        if nombre is None:
+            continue
+        meta_page_id = _blank(venue.get("meta_page_id"))
+        key = meta_page_id or (nombre.lower(), (_blank(venue.get("ciudad")) or "").lower())
+        aforo = _blank(venue.get("aforo"))
+        staged_venues[key] = (
+            nombre, _blank(venue.get("ciudad")), _blank(venue.get("provincia")),
+            int(aforo) if aforo else None, meta_page_id
+        )
+
+    # Artists named only by events are created too
+    staged_artists = {}
+    for nombre in [artist.get("nombre") for artist in artists] + [event.get("artista") for event in events]:
+        nombre = _blank(nombre)
+        clave = artist_key(nombre) if nombre else ""
+        if clave:
+            staged_artists.setdefault(clave, (clave, nombre))
+
+    staged_events = set()
+    for event in events:
+        nombre = _blank(event.get("artista"))
+        clave = artist_key(nombre) if nombre else ""
+        fecha = _blank(event.get("fecha"))
+        if not clave or not fecha:
+            logger.warning("Skipping event without artist or date: %s", event)
+            continue
+        staged_events.add((clave, _blank(event.get("sala")), _blank(event.get("meta_page_id")), fecha, _blank(event.get("hora"))))
+
+    return {
+        "venues": _copy(cursor, "seed_sala", ("nombre", "ciudad", "provincia", "aforo", "meta_page_id"), list(staged_venues.values())),
+        "artists": _copy(cursor, "seed_artista", ("clave", "nombre"), list(staged_artists.values())),
+        "events": _copy(cursor, "seed_evento", ("clave", "sala", "meta_page_id", "fecha", "hora"), list(staged_events)),
+    }
+
+
+def _upsert_venues(cursor):
+    """
+    Updates the known venues and inserts the new ones from seed_sala.
+
+    Args:
+        cursor: Cursor of the connection to the database
+
+    Returns:
+        tuple: Number of venues updated and inserted
+    """
+    # Resolve the ids of the known venues; prefer a match by page id
+    cursor.execute(f"""
+    UPDATE seed_sala s SET sala_id = (
+        SELECT x.id FROM sala x WHERE {VENUE_MATCH}
+        ORDER BY (x.meta_page_id = s.meta_page_id) DESC NULLS LAST, x.id
+        LIMIT 1
+    )
+    """)
+
+    cursor.execute("""
+    UPDATE sala x SET
+        ciudad = COALESCE(s.ciudad, x.ciudad),
+        provincia = COALESCE(s.provincia, x.provincia),
+        aforo = COALESCE(s.aforo, x.aforo),
+        meta_page_id = COALESCE(x.meta_page_id, s.meta_page_id)
+    FROM seed_sala s
+    WHERE x.id = s.sala_id
+      AND (x.ciudad, x.provincia, x.aforo, x.meta_page_id) IS DISTINCT FROM
+          (COALESCE(s.ciudad, x.ciudad), COALESCE(s.provincia, x.provincia),
+           COALESCE(s.aforo, x.aforo), COALESCE(x.meta_page_id, s.meta_page_id))
+    """)
+    updated = cursor.rowcount
+
+    cursor.execute("""
+    INSERT INTO sala (nombre, ciudad, provincia, aforo, meta_page_id)
+    SELECT s.nombre, s.ciudad, s.provincia, s.aforo, s.meta_page_id
+    FROM seed_sala s
+    WHERE s.sala_id IS NULL
+    """)
+    return updated, cursor.rowcount
+
+
+def _upsert_artists(cursor):
+    """
+    Inserts the new artists from seed_artista and resolves every artist id.
+
+    Args:
+        cursor: Cursor of the connection to the database
+
+    Returns:
+        int: Number of artists inserted
+    """
+    # Known spellings first, then artists stored without aliases (exact name)
+    cursor.execute("""
+    UPDATE seed_artista s SET artista_id = a.artista_id
+    FROM artista_alias a WHERE a.clave = s.clave
+    """)
+    cursor.execute("""
+    UPDATE seed_artista s SET artista_id = (SELECT MIN(a.id) FROM artista a WHERE a.nombre = s.nombre)
+    WHERE s.artista_id IS NULL
+    """)
+
+    cursor.execute("""
+    WITH nuevos AS (
+        INSERT INTO artista (nombre, clave)
+        SELECT s.nombre, s.clave FROM seed_artista s WHERE s.artista_id IS NULL
+        ON CONFLICT (clave) DO NOTHING
+        RETURNING id, clave
+    )
+    UPDATE seed_artista s SET artista_id = nuevos.id
+    FROM nuevos WHERE s.artista_id IS NULL AND s.clave = nuevos.clave
+    """)
+    inserted = cursor.rowcount
+
+    # Artists stored by the resolver meanwhile, before their alias was visible
+    cursor.execute("""
+    UPDATE seed_artista s SET artista_id = a.id
+    FROM artista a WHERE s.artista_id IS NULL AND a.clave = s.clave
+    """)
+
+    # Every seeded spelling becomes an alias, as if the resolver had seen it
+    cursor.execute("""
+    INSERT INTO artista_alias (clave, alias, artista_id)
+    SELECT s.clave, s.nombre, s.artista_id FROM seed_artista s
+    ON CONFLICT (clave) DO NOTHING
+    """)
+    return inserted
+
+
+def _insert_events(connection, cursor):
+    """
+    Inserts the events of seed_evento that are not in eventos yet.
+
+    Args:
+        connection: Connection to the database
+        cursor: Cursor of the connection
+
+    Returns:
+        tuple: Rows (id, artista_id, sala_id, fecha, hora) inserted and
+            number of events skipped because their venue is unknown
+    """
+    cursor.execute("""
+    UPDATE seed_evento e SET artista_id = s.artista_id
+    FROM seed_artista s WHERE s.clave = e.clave
+    """)
+    cursor.execute("""
+    UPDATE seed_evento e SET sala_id = COALESCE(
+        (SELECT x.id FROM sala x WHERE x.meta_page_id = e.meta_page_id ORDER BY x.id LIMIT 1),
+        (SELECT x.id FROM sala x WHERE lower(x.nombre) = lower(e.sala) ORDER BY x.id LIMIT 1)
+    )
+    """)
+    cursor.execute("SELECT COUNT(*) FROM seed_evento WHERE sala_id IS NULL")
+    skipped = cursor.fetchone()[0]
+
+    # Create the partitions of every month seeded before inserting
+    cursor.execute("SELECT DISTINCT date_trunc('month', fecha)::date FROM seed_evento WHERE sala_id IS NOT NULL")
+    for (month,) in cursor.fetchall():
+        ensure_event_partition(connection, month)
+
+    # The unique event key (idx_eventos_clave) skips events inserted
+    # meanwhile by the ingestion; NOT EXISTS spares the known ones a conflict
+    cursor.execute("""
+    INSERT INTO eventos (artista_id, sala_id, fecha, hora)
+    SELECT DISTINCT s.artista_id, s.sala_id, s.fecha, s.hora
+    FROM seed_evento s
+    WHERE s.sala_id IS NOT NULL
+      AND NOT EXISTS (
+          SELECT 1 FROM eventos e
+          WHERE e.artista_id = s.artista_id AND e.sala_id = s.sala_id
+            AND e.fecha = s.fecha AND e.hora IS NOT DISTINCT FROM s.hora
+      )
+    ON CONFLICT DO NOTHING
+    RETURNING id, artista_id, sala_id, fecha, hora
+    """)
+    return cursor.fetchall(), skipped
+
+
+def seed_database(connection, venues=(), artists=(), events=()):
+    """
+    Loads venues, artists and events, inserting only what is missing.
+
+    Runs in the caller's transaction and does not commit. New events are
+    appended to the change log and their months refreshed in the summary
+    tables.
+
+    Args:
+        connection: Connection to the database
+        venues (list): Dicts with nombre, ciudad, provincia, aforo, meta_page_id
+        artists (list): Dicts with nombre
+        events (list): Dicts with artista, sala or meta_page_id, fecha and hora
+
+    Returns:
+        dict: Rows staged and venues/artists/events inserted or updated
+    """
+    started = time.perf_counter()
+    cursor = connection.cursor()
+    try:
+        stats = {f"staged_{name}": count for name, count in _stage(cursor, venues, artists, events).items()}
+        stats["venues_updated"], stats["venues_inserted"] = _upsert_venues(cursor)
+        stats["artists_inserted"] = _upsert_artists(cursor)
+        inserted, stats["events_skipped"] = _insert_events(connection, cursor)
+        stats["events_inserted"] = len(inserted)
+    finally:
+        cursor.close()
+
+    record_event_changes(connection, "insert", inserted)
+    refresh_event_stats(connection, [row[3] for row in inserted])
+
+    if stats["events_skipped"]:
+        logger.warning("%d events skipped because their venue is unknown", stats["events_skipped"])
+    logger.info("Seed loaded in %.2fs: %s", time.perf_counter() - started, stats)
+    return stats
+
+
+def parse_arguments():
+    """
+    Parses the command line arguments.
+
+    Returns:
+        argparse.Namespace: Object with the processed arguments
+    """
+    parser = argparse.ArgumentParser(description='Bulk, idempotent load of venues, artists and events')
+    parser.add_argument('--venues', type=str, default=None,
+                    help='CSV/JSONL file with nombre, ciudad, provincia, aforo, meta_page_id')
+    parser.add_argument('--artists', type=str, default=None,
+                    help='CSV/JSONL file with nombre')
+    parser.add_argument('--events', type=str, default=None,
+                    help='CSV/JSONL file with artista, sala or meta_page_id, fecha, hora')
+    add_logging_arguments(parser)
+    return parser.parse_args()
+
+
+def main():
+    """
+    Loads the given seed files in one transaction.
+    """
+    args = parse_arguments()
+    setup_logging(level=args.log_level, log_format=args.log_format, quiet=args.quiet)
+
+    if not (args.venues or args.artists or args.events):
+        logger.info("Nothing to do: use --venues, --artists and/or --events")
+        return
+
+    pool = connect_to_db()
+    if pool is None:
+        return
+    try:
+        with pool.connection() as connection:
+            seed_database(
+                connection,
+                read_records(args.venues) if args.venues else [],
+                read_records(args.artists) if args.artists else [],
+                read_records(args.events) if args.events else []
+            )
+    finally:
+        close_all_pools()
+
+
+if __name__ == "__main__":
+    main()
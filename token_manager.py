@@ -0,0 +1,270 @@
+"""
+Cache of Meta access tokens shared by every crawler process.
+
+Tokens are kept on disk with their expiry, so a run reuses the token of the
+previous one instead of authenticating again. A token is refreshed in the
+background once it enters its refresh margin, and synchronously only if it
+is missing or already expired. Refreshes are single-flight: within a
+process one thread fetches while the others wait for its result, and across
+processes an exclusive lock on a lock file per token (<cache>.<key hash>.lock)
+makes the others read the token the first one wrote instead of fetching
+their own. The cache file itself is only locked (<cache>.lock) while it is
+read and rewritten, so a fetch may get other tokens (a page token fetch
+needs the user token) without deadlocking.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process single-flight
+    fcntl = None
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# File where tokens are cached
+TOKEN_CACHE_PATH = os.environ.get("META_TOKEN_CACHE", ".meta_tokens.json")
+
+# Tokens are refreshed in the background when less than this is left (seconds)
+TOKEN_REFRESH_MARGIN = 24 * 60 * 60
+
+# Longest sleep of the background refresher between checks (seconds)
+TOKEN_CHECK_INTERVAL = 60 * 60
+
+TOKEN_REFRESHES = REGISTRY.counter(
+    "meta_token_refreshes_total", "Access tokens fetched from Meta, by token kind and mode", ("kind", "mode")
+)
+TOKEN_CACHE_HITS = REGISTRY.counter(
+    "meta_token_cache_hits_total", "Access tokens served from the cache", ("kind",)
+)
+
+
+def _kind(key):
+    # "page:123" -> "page", used as metric label
+    return key.split(":", 1)[0].split("@", 1)[0]
+
+
+@contextmanager
+def _file_lock(path):
+    # Exclusive lock shared with other processes (only threads of this process on Windows)
+    with open(path, 'a') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class TokenManager:
+    """
+    Disk-backed cache of access tokens with single-flight refreshes.
+    """
+
+    def __init__(self, path=TOKEN_CACHE_PATH, refresh_margin=TOKEN_REFRESH_MARGIN, clock=time.time):
+        """
+        Creates the manager; the cache file is read on first use.
+
+        Args:
+            path (str): Cache file
+            refresh_margin (float): Seconds before expiry at which tokens are refreshed
+            clock (callable): Wall clock (replaceable in tests)
+        """
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.refresh_margin = refresh_margin
+        self.clock = clock
+        self.tokens = None
+        self.fetchers = {}
+        self.key_locks = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.refresher = None
+        self.stopping = False
+
+    def _read_cache(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logger.warning("Ignoring unreadable token cache %s", self.path)
+            return {}
+
+    def _write_cache(self, tokens):
+        # Write to a temporary file and rename, readable only by the owner
+        temporary_path = self.path + ".tmp"
+        descriptor = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as f:
+            json.dump(tokens, f, indent=2)
+        os.replace(temporary_path, self.path)
+
+    def _key_lock_path(self, key):
+        return f"{self.path}.{hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]}.lock"
+
+    def _entry(self, key):
+        with self.lock:
+            if self.tokens is None:
+                self.tokens = self._read_cache()
+            return self.tokens.get(key)
+
+    def _refresh_at(self, entry):
+        """
+        Computes when a token should be replaced.
+
+        Short-lived tokens are refreshed at half their lifetime rather than
+        refresh_margin before expiry, which could be before they were obtained.
+
+        Args:
+            entry (dict): Cached token
+
+        Returns:
+            float: Unix time of the refresh, or None for tokens that do not expire
+        """
+        expires_at = entry.get("expires_at")
+        if expires_at is None:
+            return None
+        lifetime = expires_at - entry.get("obtained_at", expires_at)
+        return expires_at - min(self.refresh_margin, lifetime / 2)
+
+    def _is_valid(self, entry):
+        if not entry:
+            return False
+        expires_at = entry.get("expires_at")
+        return expires_at is None or self.clock() < expires_at
+
+    def _is_fresh(self, entry):
+        if not self._is_valid(entry):
+            return False
+        refresh_at = self._refresh_at(entry)
+        return refresh_at is None or self.clock() < refresh_at
+
+    def get(self, key, fetch):
+        """
+        Gets a token, fetching it only if it is missing or expired.
+
+        A token within its refresh margin is returned as is while the
+        background refresher replaces it.
+
+        Args:
+            key (str): Token identifier, e.g. "app" or "page:<page id>"
+            fetch (callable): Returns (token, expires_in seconds or None) from Meta
+
+        Returns:
+            str: Access token
+        """
+        with self.lock:
+            self.fetchers[key] = fetch
+        entry = self._entry(key)
+        if self._is_valid(entry):
+            TOKEN_CACHE_HITS.inc(kind=_kind(key))
+            token = entry["token"]
+            if not self._is_fresh(entry):
+                self.wakeup.set()
+        else:
+            token = self.refresh(key, mode="sync")
+
+        # Tokens that expire are kept fresh by the background refresher
+        if self._entry(key).get("expires_at") is not None:
+            self._start_refresher()
+        return token
+
+    def refresh(self, key, mode="sync", force=False):
+        """
+        Fetches a new token unless another thread or process just did.
+
+        Args:
+            key (str): Token identifier
+            mode (str): "sync" or "background", used as metric label
+            force (bool): Fetch even if the cached token is not due for a refresh
+
+        Returns:
+            str: Access token
+        """
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+            fetch = self.fetchers[key]
+
+        with key_lock, _file_lock(self._key_lock_path(key)):
+            # Another thread or process may have refreshed it while we waited
+            with _file_lock(self.lock_path):
+                tokens = self._read_cache()
+            entry = tokens.get(key)
+            if not force and self._is_fresh(entry):
+                with self.lock:
+                    self.tokens = tokens
+                return entry["token"]
+
+            # Only this token is locked while fetching; the fetch may need other tokens
+            token, expires_in = fetch()
+            now = self.clock()
+
+            # Read again: other tokens may have been written during the fetch
+            with _file_lock(self.lock_path):
+                tokens = self._read_cache()
+                tokens[key] = {
+                    "token": token,
+                    "obtained_at": now,
+                    "expires_at": now + expires_in if expires_in else None,
+                }
+                self._write_cache(tokens)
+            with self.lock:
+                self.tokens = tokens
+
+        TOKEN_REFRESHES.inc(kind=_kind(key), mode=mode)
+        logger.info("Access token %s refreshed (%s)", key, "no expiry" if not expires_in else f"expires in {expires_in}s")
+        return token
+
+    def _next_refresh_delay(self):
+        """
+        Computes how long the refresher can sleep before a token enters its margin.
+
+        Returns:
+            float: Seconds until the next refresh is due (0 if one is due now)
+        """
+        with self.lock:
+            entries = [(key, (self.tokens or {}).get(key)) for key in self.fetchers]
+        delay = TOKEN_CHECK_INTERVAL
+        for _, entry in entries:
+            refresh_at = self._refresh_at(entry) if entry else None
+            if refresh_at is not None:
+                delay = min(delay, refresh_at - self.clock())
+        return max(0.0, delay)
+
+    def _refresh_loop(self):
+        while not self.stopping:
+            with self.lock:
+                keys = list(self.fetchers)
+            for key in keys:
+                entry = self._entry(key)
+                if entry and entry.get("expires_at") is not None and not self._is_fresh(entry):
+                    try:
+                        self.refresh(key, mode="background")
+                    except Exception as e:
+                        logger.warning("Background refresh of token %s failed: %s", key, e)
+            self.wakeup.wait(self._next_refresh_delay() or TOKEN_CHECK_INTERVAL)
+            self.wakeup.clear()
+
+    def _start_refresher(self):
+        with self.lock:
+            if self.refresher is not None:
+                return
+            self.refresher = threading.Thread(target=self._refresh_loop, name="token-refresher", daemon=True)
+        self.refresher.start()
+
+    def close(self):
+        """
+        Stops the background refresher.
+        """
+        self.stopping = True
+        self.wakeup.set()
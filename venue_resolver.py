@@ -0,0 +1,300 @@
+"""
+Resolution of extracted venue names to canonical sala rows.
+
+The extracted "ubicacion" is free text ("Riquelaclub", "Arca da Noe", "Sala
+Capitol"). Instead of looking the exact string up in sala and inserting a
+new row on every miss, the resolver keeps an in-memory NameIndex of the ACCES
+venues and the sala table (names, hashtags and Meta page ids) and resolves
+each mention with dictionary lookups, falling back to trigram similarity and
+finally to the venue that published the post.
+"""
+
+import logging
+import re
+import threading
+from typing import NamedTuple, Optional
+
+from meta_api_connector import get_acces_venues
+from name_index import NameIndex, name_keys, normalize_name
+
+logger = logging.getLogger(__name__)
+
+# Generic words ignored when comparing venue names ("Sala Capitol" == "Capitol")
+VENUE_STOPWORDS = frozenset({
+    "sala", "salas", "club", "bar", "pub", "cafe", "the", "el", "la", "los", "las",
+    "o", "a", "os", "as", "de", "del", "da", "do", "das", "dos", "l", "d",
+})
+
+# Minimum trigram similarity to accept a misspelled venue name
+VENUE_MIN_SIMILARITY = 0.7
+
+# Values the model uses when it could not find a venue
+UNKNOWN_VENUES = frozenset({"", "indeterminado", "desconocido", "unknown", "n a", "none"})
+
+_HASHTAG = re.compile(r"[#@](\w+)")
+
+
+def venue_key(nombre):
+    """
+    Gets the folded name that identifies a venue without a Meta page in sala.clave.
+
+    Args:
+        nombre (str): Venue name as written
+
+    Returns:
+        str: Least specific exact-match key of the name ("Sala Capitol" -> "capitol")
+    """
+    keys = name_keys(nombre, VENUE_STOPWORDS)
+    return keys[-1] if keys else None
+
+
+class VenueMatch(NamedTuple):
+    """
+    Result of resolving a venue mention.
+    """
+    sala_id: int
+    nombre: str
+    meta_page_id: Optional[str]
+    score: float
+    method: str
+
+
+class _Venue:
+    """
+    Venue known to the resolver; sala_id is None until its row exists.
+    """
+
+    def __init__(self, nombre, ciudad=None, meta_page_id=None, sala_id=None, confirmed=True):
+        self.nombre = nombre
+        self.ciudad = ciudad
+        self.meta_page_id = meta_page_id
+        self.sala_id = sala_id
+        # Rows created by the resolver may still be rolled back by their transaction
+        self.confirmed = confirmed
+        # Transaction (txid) that inserted the row
+        self.created_by = None
+
+
+class VenueResolver:
+    """
+    In-memory index resolving venue mentions to sala ids.
+
+    Safe to share between worker threads.
+    """
+
+    def __init__(self, min_similarity=VENUE_MIN_SIMILARITY):
+        """
+        Creates an empty resolver; call load() before resolving.
+
+        Args:
+            min_similarity (float): Minimum trigram similarity of fuzzy matches
+        """
+        self.min_similarity = min_similarity
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.index = NameIndex(VENUE_STOPWORDS, self.min_similarity)
+        self.by_page_id = {}
+        self.by_sala_id = {}
+
+    def _add(self, venue):
+        """
+        Indexes a venue by name, hashtag-style name and page id.
+
+        Args:
+            venue (_Venue): Venue to index
+        """
+        self.index.add(venue.nombre, venue)
+        if venue.meta_page_id:
+            self.by_page_id.setdefault(str(venue.meta_page_id), venue)
+        if venue.sala_id is not None:
+            self.by_sala_id[venue.sala_id] = venue
+
+    def load(self, connection=None, venues=None):
+        """
+        (Re)builds the index from the sala table and the ACCES venue list.
+
+        Args:
+            connection: Connection to the database (None to index only the ACCES list)
+            venues (list): ACCES venues with id, name and city (default: get_acces_venues())
+        """
+        with self.lock:
+            self._reset()
+
+            # Rows already in the database are the canonical venues
+            if connection is not None:
+                cursor = connection.cursor()
+                cursor.execute("SELECT id, nombre, ciudad, meta_page_id FROM sala ORDER BY id")
+                for sala_id, nombre, ciudad, meta_page_id in cursor.fetchall():
+                    self._add(_Venue(nombre, ciudad, meta_page_id, sala_id))
+                cursor.close()
+
+            # ACCES venues without a row yet get one the first time they are mentioned
+            for venue in get_acces_venues() if venues is None else venues:
+                known = self.by_page_id.get(str(venue["id"]))
+                if known is None:
+                    self._add(_Venue(venue["name"], venue.get("city"), str(venue["id"])))
+                elif normalize_name(known.nombre) != normalize_name(venue["name"]):
+                    # The Meta page name is an alias of the stored venue
+                    self.index.add(venue["name"], known)
+
+            logger.info("Venue index loaded: %d venues", len(self.by_page_id) + len(self.by_sala_id))
+
+    def add_alias(self, alias, sala_id):
+        """
+        Adds an alternative name (e.g. a hashtag) of a stored venue.
+
+        Args:
+            alias (str): Alternative name
+            sala_id (int): ID of the venue
+
+        Returns:
+            bool: True if the venue is known and the alias was added
+        """
+        with self.lock:
+            venue = self.by_sala_id.get(sala_id)
+            if venue is None:
+                return False
+            self.index.add(alias, venue)
+            return True
+
+    def _store_row(self, connection, venue):
+        """
+        Gets the sala row of a venue, inserting it if it does not exist.
+
+        Venues are keyed by Meta page id or, without one, by folded name, so
+        an INSERT racing with another worker's open transaction waits for it
+        instead of adding a duplicate. Runs without the resolver lock.
+
+        Args:
+            connection: Connection to the database
+            venue (_Venue): Venue to store
+
+        Returns:
+            tuple: (sala_id, txid, inserted) where txid is the current transaction
+        """
+        if venue.meta_page_id:
+            column, value = "meta_page_id", venue.meta_page_id
+        else:
+            column, value = "clave", venue_key(venue.nombre)
+
+        cursor = connection.cursor()
+        try:
+            cursor.execute(
+                f"""
+                INSERT INTO sala (nombre, ciudad, {column}) VALUES (%s, %s, %s)
+                ON CONFLICT ({column}) DO NOTHING
+                RETURNING id, txid_current()
+                """,
+                (venue.nombre, venue.ciudad, value)
+            )
+            row = cursor.fetchone()
+            if row is not None:
+                logger.info("New venue stored: %s (ID %s)", venue.nombre, row[0])
+                return row[0], row[1], True
+
+            # Committed by another transaction, or stored earlier by this one
+            cursor.execute(f"SELECT id, txid_current() FROM sala WHERE {column} = %s", (value,))
+            sala_id, txid = cursor.fetchone()
+            return sala_id, txid, False
+        finally:
+            cursor.close()
+
+    def _match(self, connection, venue, score, method):
+        with self.lock:
+            sala_id, confirmed = venue.sala_id, venue.confirmed
+
+        # Rows created by the resolver are looked up again until they are
+        # seen from a later transaction, in case theirs was rolled back
+        if sala_id is None or not confirmed:
+            sala_id, txid, inserted = self._store_row(connection, venue)
+            with self.lock:
+                if venue.sala_id is not None and venue.sala_id != sala_id:
+                    self.by_sala_id.pop(venue.sala_id, None)
+                venue.sala_id = sala_id
+                self.by_sala_id[sala_id] = venue
+                if inserted:
+                    venue.confirmed = False
+                    venue.created_by = txid
+                elif venue.created_by != txid:
+                    venue.confirmed = True
+
+        return VenueMatch(sala_id, venue.nombre, venue.meta_page_id, score, method)
+
+    def resolve(self, connection, ubicacion, post=None, create=True):
+        """
+        Resolves an extracted venue to its sala row.
+
+        A named venue is looked up by folded name and then by trigram
+        similarity; unknown names get a new row if create is set. When the
+        model found no venue, the hashtags of the post caption and then the
+        Meta page that published the post are used instead. The index is
+        only locked while it is read or updated, never during SQL.
+
+        Args:
+            connection: Connection to the database
+            ubicacion (str): Extracted venue name (may be empty)
+            post (dict): Post the mention comes from (caption/message, venue_id)
+            create (bool): Insert a new venue when a named venue is unknown
+
+        Returns:
+            VenueMatch: Resolved venue, or None if it could not be resolved
+        """
+        post = post or {}
+        ubicacion = str(ubicacion or "").strip()
+        if normalize_name(ubicacion) not in UNKNOWN_VENUES:
+            with self.lock:
+                venue, score, method = self.index.lookup(ubicacion)
+            if venue is not None:
+                return self._match(connection, venue, score, method)
+            if not create:
+                return None
+
+            venue = _Venue(ubicacion)
+            match = self._match(connection, venue, 0.0, "created")
+            with self.lock:
+                # Another worker may have indexed the same name meanwhile
+                if self.index.lookup(ubicacion)[2] != "exact":
+                    self._add(venue)
+            return match
+
+        # Venues tagged in the caption
+        caption = post.get("caption") or post.get("message") or ""
+        for tag in _HASHTAG.findall(caption):
+            with self.lock:
+                venue, score, method = self.index.lookup(tag)
+            if method == "exact":
+                return self._match(connection, venue, score, "hashtag")
+
+        # The venue that published the post
+        page_id = post.get("venue_id")
+        with self.lock:
+            venue = self.by_page_id.get(str(page_id)) if page_id else None
+        if venue is not None:
+            return self._match(connection, venue, 1.0, "page_id")
+        return None
+
+
+# Resolver shared by the whole process, loaded on first use
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def get_venue_resolver(connection=None):
+    """
+    Gets the shared venue resolver, loading it on first use.
+
+    Args:
+        connection: Connection used to load the sala table the first time
+
+    Returns:
+        VenueResolver: Shared resolver
+    """
+    global _resolver
+    with _resolver_lock:
+        if _resolver is None:
+            resolver = VenueResolver()
+            resolver.load(connection)
+            _resolver = resolver
+        return _resolver
@@ -10,6 +10,12 @@ import requests
 import asyncio
 import argparse
 import difflib
+import os
+import sys
+
+# El almacén local de datasets está en la raíz del repositorio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dataset_store import iter_dataset_items
 
 # ==========================
 # CONFIGURACIÓN MANUAL
@@ -48,8 +54,10 @@ def parse_arguments():
                     help='Descripción del experimento (default: evaluacion posts redes sociales)')
     parser.add_argument('--metrics', type=str, default='distancia JSON',
                     help='Métricas RAGAS a evaluar, separadas por comas (default: factual,recall,precision,noise)')
-    parser.add_argument('--dataset', type=str, default='dataset.csv',
-                    help='Ruta al archivo CSV del dataset (default: dataset.csv)')
+    parser.add_argument('--dataset', type=str, default='langfuse:posts_db',
+                    help='Ruta al archivo CSV del dataset, o langfuse:<nombre> para un dataset de Langfuse (default: langfuse:posts_db)')
+    parser.add_argument('--refresh-dataset', action='store_true',
+                    help='Sincronizar la copia local del dataset de Langfuse aunque sea reciente')
 
 
     return parser.parse_args()
@@ -62,6 +70,7 @@ RUN_NAME = args.run_name
 RUN_DESCRIPTION = args.run_description
 METRICS = [metric.strip() for metric in args.metrics.split(',')]
 DATASET_PATH = args.dataset
+REFRESH_DATASET = args.refresh_dataset
 
 # Inicialización del cliente de Langfuse para tracking de experimentos
 langfuse = Langfuse(
@@ -125,38 +134,27 @@ class Dataset:
     def __init__(self, items):
         self.items = items
 
-# Cargar dataset desde Langfuse
-print("Cargando dataset 'posts_db' desde Langfuse...")
-langfuse_dataset = langfuse.get_dataset("posts_db")
-
-# Convertir el dataset de Langfuse a nuestro formato
-def convert_langfuse_dataset(langfuse_dataset):
+# Leer el dataset desde el CSV o desde la copia local del dataset de Langfuse
+def iterar_dataset(source):
     """
-    Convierte un dataset de Langfuse a nuestro formato interno.
+    Recorre los ítems del dataset sin cargarlos todos en memoria.
+    
+    La copia local (SQLite) solo se sincroniza con Langfuse si ha caducado,
+    y solo se descargan los cambios.
     
     Args:
-        langfuse_dataset: Dataset de Langfuse
+        source (str): Ruta al CSV o "langfuse:<nombre>"
         
-    Returns:
-        Dataset: Objeto Dataset con los ítems convertidos
+    Yields:
+        DatasetItem: Ítems del dataset
     """
-    items = []
-    
-    for item in langfuse_dataset.items:
-        # Crear ítem del dataset
-        dataset_item = DatasetItem(
+    for item in iter_dataset_items(source, langfuse, refresh=REFRESH_DATASET):
+        yield DatasetItem(
             id=item.id,
             input_data=item.input,
             expected_output=item.expected_output,
             metadata=item.metadata
         )
-        items.append(dataset_item)
-    
-    print(f"Dataset cargado: {len(items)} ítems")
-    return Dataset(items)
-
-# Convertir el dataset de Langfuse a nuestro formato
-dataset = convert_langfuse_dataset(langfuse_dataset)
 
 
 # Función para calcular la distancia entre dos objetos JSON
@@ -336,8 +334,11 @@ print(f"- Métricas a evaluar: {', '.join(METRICS)}")
 
 
 # Procesar cada ítem del dataset
-for idx, item in enumerate(dataset.items):
-    print(f"\nProcesando ítem {idx+1}/{len(dataset.items)}")
+print(f"Cargando dataset {DATASET_PATH}...")
+processed = 0
+for idx, item in enumerate(iterar_dataset(DATASET_PATH)):
+    print(f"\nProcesando ítem {idx+1}")
+    processed += 1
     post_data = item.input
     expected_output = item.expected_output
     
@@ -391,5 +392,5 @@ for idx, item in enumerate(dataset.items):
 print("\nFinalizando evaluación y enviando datos a Langfuse...")
 # Flush final para asegurar que todos los datos se han enviado
 langfuse_context.flush()
-print(f"Evaluación completada: {len(dataset.items)} ítems procesados")
+print(f"Evaluación completada: {processed} ítems procesados")
 print(f"Timestamp: {timestamp}")